@@ -17,12 +17,9 @@ echo "MODELS: $MODELS"
 for REPEAT in `seq 10`; do # Repetition to handle errors and crashes, everything is cached so it's fast
     for M in $MODELS; do
 
-        # If the M starts with `groq-` then we set WORKERS to 1, else to 5
-        if [[ $M == groq-* ]]; then
-            WORKERS=1
-        else
-            WORKERS=5
-        fi
+        # Requests are throttled per provider by the shared rate limiter (src/rate_limiter.py),
+        # so the same worker count works for every model
+        WORKERS=8
 
         poetry run python3 scripts/generate_and_compare_descriptions.py \
             --item-type=paper \
@@ -0,0 +1,209 @@
+import scripts_common_setup
+
+import functools
+import logging
+import os
+import sqlite3
+import typing as t
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import click
+from interlab.context import FileStorage
+
+from llm_comparison.comparison_storage import (db_bulk_insert_comparisons,
+                                               db_stats,
+                                               get_comparison_results_db)
+from llm_comparison.config import ComparisonMode
+from llm_comparison.llm_comparison import COMPARISON_STORAGE_DB_FILENAME
+from llm_descriptions_generator.schema import Origin
+from storage import cache_friendly_file_storage, get_context_tag_names
+
+# PURPOSE OF SCRIPT: compare_descriptions only copies Context-cached verdicts into the
+# comparison results DB lazily, one pair at a time. This script migrates every
+# compare_descriptions Context in the storage directory into the DB in one go, so that
+# later runs never need to fall back on searching the Context cache.
+# Re-running is cheap: storage entries already backfilled are recorded and skipped.
+
+BACKFILL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS context_cache_backfill_entries (
+    entry_name TEXT PRIMARY KEY,
+    backfilled_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);"""
+
+DEFAULT_TRANSACTION_ROW_COUNT = 5000
+
+
+def _get_tag_value(tag_names: list[str], prefix: str) -> t.Optional[str]:
+    for tag_name in tag_names:
+        if tag_name.startswith(prefix):
+            return tag_name[len(prefix):]
+    return None
+
+
+def _make_comparison_row(context_data: dict) -> t.Optional[dict[str, t.Any]]:
+    # skip failed or unfinished comparisons, those were never verdicts
+    if context_data.get("error", None) is not None or context_data.get("state", None) is not None:
+        return None
+
+    # NOTE: key off the tags (not the inputs) since that's what the Context cache lookup matches on
+    tag_names = get_context_tag_names(context_data.get("tags", None))
+    llm_engine = _get_tag_value(tag_names, "engine:")
+    comparison_prompt_key = _get_tag_value(tag_names, "comparison_prompt_key:")
+    description_uids = _get_tag_value(tag_names, "compare_descriptions:")
+    if llm_engine is None or comparison_prompt_key is None or description_uids is None:
+        return None
+    (description_uid_1, description_uid_2) = description_uids.split(":", 1)
+
+    inputs = context_data.get("inputs", None) or {}
+    comparison_prompt_config = inputs.get("comparison_prompt_config", None) or {}
+    description_llm = {}
+    for description in [inputs.get("description_1", None), inputs.get("description_2", None)]:
+        if description and description.get("origin", None) == Origin.LLM:
+            description_llm = description
+    origins = [(inputs.get(key, None) or {}).get("origin", None) for key in ["description_1", "description_2"]]
+    llm_position = None
+    if sorted(map(str, origins)) == sorted([str(Origin.Human), str(Origin.LLM)]):
+        llm_position = 1 if origins[0] == Origin.LLM else 2
+
+    result = context_data.get("result", None)
+    if result is None:
+        winner = 0
+    elif result.get("uid", None) == description_uid_1:
+        winner = 1
+    elif result.get("uid", None) == description_uid_2:
+        winner = 2
+    else:
+        logging.warning(f"Skipping Context {context_data.get('uid')} with a result matching neither compared description")
+        return None
+
+    return {
+        "comparison_prompt_key": comparison_prompt_key,
+        "comparison_llm_engine": llm_engine,
+        "description_uid_1": description_uid_1,
+        "description_uid_2": description_uid_2,
+        "winner": winner,
+        "item_type": comparison_prompt_config.get("item_type", None),
+        "description_llm_engine": description_llm.get("engine", None),
+        "description_prompt_key": description_llm.get("prompt_key", None),
+        # Contexts of two-step verdicts have no mode tag
+        "comparison_mode": _get_tag_value(tag_names, "comparison_mode:") or ComparisonMode.TwoStep.value,
+        "llm_position": llm_position,
+    }
+
+
+def _collect_comparison_rows(context_data: dict, rows: list[dict[str, t.Any]]) -> None:
+    if context_data.get("name", None) == "compare_descriptions":
+        row = _make_comparison_row(context_data)
+        if row is not None:
+            rows.append(row)
+    for child in context_data.get("children", None) or []:
+        _collect_comparison_rows(child, rows)
+
+
+def decode_storage_entry(directory: str, entry_name: str) -> tuple[str, list[dict[str, t.Any]]]:
+    # NOTE: runs in a worker process, so it only gets picklable arguments
+    storage = FileStorage(directory)
+    uid = entry_name.removesuffix(".ctx").removesuffix(".full.gz")
+    rows: list[dict[str, t.Any]] = []
+    try:
+        _collect_comparison_rows(storage._read_from(directory, uid), rows)
+    except Exception as e:
+        logging.warning(f"Skipping unreadable context storage entry {entry_name}: {e}")
+    return (entry_name, rows)
+
+
+def _flush(
+    conn: sqlite3.Connection,
+    rows: list[dict[str, t.Any]],
+    entry_names: list[str],
+) -> int:
+    inserted_count = db_bulk_insert_comparisons(conn, rows)
+    # mark entries done only after their rows are committed, so an interrupted run resumes cleanly
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO context_cache_backfill_entries (entry_name) VALUES (?)",
+            [(name,) for name in entry_names],
+        )
+    return inserted_count
+
+
+def backfill_comparison_db_from_context_cache(
+    workers: t.Optional[int] = None,
+    transaction_row_count: int = DEFAULT_TRANSACTION_ROW_COUNT,
+    force: bool = False,
+) -> None:
+    directory = cache_friendly_file_storage.directory
+    conn = get_comparison_results_db(Path(directory) / COMPARISON_STORAGE_DB_FILENAME)
+    conn.execute(BACKFILL_SCHEMA)
+    conn.commit()
+
+    done_entry_names = set()
+    if not force:
+        done_entry_names = set(
+            row[0] for row in conn.execute("SELECT entry_name FROM context_cache_backfill_entries")
+        )
+    entry_names = [
+        name for name in sorted(os.listdir(directory))
+        if (name.endswith(".full.gz") or name.endswith(".ctx")) and name not in done_entry_names
+    ]
+    logging.info(f"Backfilling comparison DB from {len(entry_names)} Context storage entries ({len(done_entry_names)} already done)")
+
+    decoded_count = 0
+    found_count = 0
+    inserted_count = 0
+    pending_rows: list[dict[str, t.Any]] = []
+    pending_entry_names: list[str] = []
+    with ProcessPoolExecutor(max_workers=workers) as process_exec:
+        for (entry_name, rows) in process_exec.map(
+            functools.partial(decode_storage_entry, directory),
+            entry_names,
+            chunksize=16,
+        ):
+            pending_rows += rows
+            pending_entry_names.append(entry_name)
+            decoded_count += 1
+            found_count += len(rows)
+            if len(pending_rows) >= transaction_row_count:
+                inserted_count += _flush(conn, pending_rows, pending_entry_names)
+                pending_rows = []
+                pending_entry_names = []
+                logging.info(f"=== ENTRIES DECODED: {decoded_count}/{len(entry_names)}, comparisons found: {found_count}, inserted: {inserted_count} ===")
+    inserted_count += _flush(conn, pending_rows, pending_entry_names)
+
+    logging.info(f"Backfill done: {decoded_count} entries decoded, {found_count} comparisons found, {inserted_count} new rows inserted")
+    logging.info(db_stats(conn))
+
+
+@click.command()
+@click.option(
+    "--workers",
+    type=int,
+    default=None,
+    help="Number of worker processes decoding Context files. Defaults to the CPU count.",
+)
+@click.option(
+    "--transaction-row-count",
+    type=int,
+    default=DEFAULT_TRANSACTION_ROW_COUNT,
+    help="Number of comparison rows to insert per DB transaction.",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    help="If present, re-decode storage entries that were already backfilled by an earlier run.",
+)
+def _cli_func(
+    workers: t.Optional[int],
+    transaction_row_count: int,
+    force: bool,
+) -> None:
+    return backfill_comparison_db_from_context_cache(
+        workers=workers,
+        transaction_row_count=transaction_row_count,
+        force=force,
+    )
+
+
+if __name__ == "__main__":
+    _cli_func()
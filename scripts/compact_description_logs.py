@@ -0,0 +1,23 @@
+import scripts_common_setup
+
+import logging
+import typing as t
+
+import click
+
+from llm_descriptions_generator.file_io import compact_all_description_logs
+
+# PURPOSE OF SCRIPT: description generation appends new descriptions to per-item `.jsonl` logs
+# and compacts them into the `.json` batch files when it finishes. Logs left behind by an
+# interrupted run are loaded fine as they are; this script folds them into the `.json` files.
+
+
+@click.command()
+@click.option("--item-type", type=str, default=None, help="Item type to compact logs of (default: all).")
+def _cli_func(item_type: t.Optional[str]) -> None:
+    compacted_count = compact_all_description_logs(item_type=item_type)
+    logging.info(f"Compacted {compacted_count} description logs")
+
+
+if __name__ == "__main__":
+    _cli_func()
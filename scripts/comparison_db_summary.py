@@ -3,13 +3,56 @@ import scripts_common_setup
 import logging
 from pathlib import Path
 
-from llm_comparison.comparison_storage import (db_stats,
+import click
+
+from llm_comparison.comparison_storage import (db_backfill_llm_positions,
+                                               db_rebuild_summary, db_stats,
                                                get_comparison_results_db)
-from llm_comparison.llm_comparison import COMPARISON_STORAGE_DB_FILENAME
+from llm_comparison.llm_comparison import (
+    COMPARISON_STORAGE_DB_FILENAME,
+    _make_descriptions_from_human_description_batch)
+from llm_descriptions_generator import file_io
+from llm_descriptions_generator.schema import Origin
 from storage import cache_friendly_file_storage
 
-if __name__ == "__main__":
+# PURPOSE OF SCRIPT: print per-collection result counts of the comparison results DB, read from its
+# summary table (kept up to date by triggers on every write). Results stored before the position of
+# the LLM description was recorded count towards neither LLM nor human wins until
+# --backfill-llm-positions looks their descriptions up in the human description files.
+
+
+def _load_all_human_description_uids() -> set[str]:
+    uids: set[str] = set()
+    for item_type_dirpath in sorted(Path(file_io.DATA_DIR).iterdir()):
+        if not file_io.generate_descriptions_dirpath(item_type_dirpath.name, Origin.Human).is_dir():
+            continue
+        for human_description_batch in file_io.load_all_human_description_batches(item_type=item_type_dirpath.name):
+            uids.update(description.uid for description in _make_descriptions_from_human_description_batch(human_description_batch))
+    return uids
+
+
+@click.command()
+@click.option(
+    "--backfill-llm-positions",
+    is_flag=True,
+    help="If present, first record which description is the LLM one for results stored without it, using the human description files.",
+)
+@click.option(
+    "--rebuild-summary",
+    is_flag=True,
+    help="If present, first recount the summary table from all results.",
+)
+def _cli_func(backfill_llm_positions: bool, rebuild_summary: bool) -> None:
     db = get_comparison_results_db(
         Path(cache_friendly_file_storage.directory) / COMPARISON_STORAGE_DB_FILENAME
     )
-    logging.info(db_stats(db))
\ No newline at end of file
+    if rebuild_summary:
+        db_rebuild_summary(db)
+    if backfill_llm_positions:
+        updated_count = db_backfill_llm_positions(db, _load_all_human_description_uids())
+        logging.info(f"Backfilled the LLM description position of {updated_count} results")
+    logging.info(db_stats(db))
+
+
+if __name__ == "__main__":
+    _cli_func()
@@ -0,0 +1,86 @@
+import scripts_common_setup
+
+import dataclasses
+import itertools
+import json
+from pathlib import Path
+
+import click
+
+from llm_comparison.analytics import (
+    DEFAULT_BOOTSTRAP_SAMPLE_COUNT,
+    DEFAULT_CONFIDENCE_LEVEL,
+    ComparisonPermutation,
+    analyze_comparison_permutations,
+)
+from llm_comparison.comparison_storage import get_comparison_results_db
+from llm_comparison.llm_comparison import COMPARISON_STORAGE_DB_FILENAME
+from llm_descriptions_generator.schema import Engine
+from storage import cache_friendly_file_storage
+
+# PURPOSE OF SCRIPT: print LLM win ratios with bootstrap confidence intervals and position bias
+# of stored comparison results (see src/llm_comparison/analytics.py), for every permutation of the
+# given engines and prompts, without running any comparisons.
+
+engine_choices = [e.value for e in Engine]
+
+
+@click.command()
+@click.option("--item-type", type=str, required=True, help="Item type to compute stats for.")
+@click.option(
+    "--item-title-like",
+    multiple=True,
+    default=[],
+    help="(Multiple OK) Optional item title(s) (fragments ok) to limit stats to.",
+)
+@click.option("--comparison-engine", type=click.Choice(engine_choices, case_sensitive=False), multiple=True, required=True, help="(Multiple OK) Comparison LLM model/engine.")
+@click.option("--comparison-prompt-key", type=str, multiple=True, required=True, help="(Multiple OK) Comparison prompt key/nickname.")
+@click.option("--description-engine", type=click.Choice(engine_choices, case_sensitive=False), multiple=True, required=True, help="(Multiple OK) Description LLM model/engine.")
+@click.option("--description-prompt-key", type=str, multiple=True, required=True, help="(Multiple OK) Description prompt key/nickname.")
+@click.option(
+    "--description-count-limit",
+    type=int,
+    default=None,
+    help="Optional limit for number of LLM descriptions per item (as passed to the comparison run).",
+)
+@click.option("--bootstrap-sample-count", type=int, default=DEFAULT_BOOTSTRAP_SAMPLE_COUNT, help="Bootstrap resamples per permutation.")
+@click.option("--confidence", type=float, default=DEFAULT_CONFIDENCE_LEVEL, help="Confidence level of the intervals.")
+@click.option("--seed", type=int, default=None, help="Optional random seed, for reproducible intervals.")
+def _cli_func(
+    item_type: str,
+    item_title_like: list[str],
+    comparison_engine: list[str],
+    comparison_prompt_key: list[str],
+    description_engine: list[str],
+    description_prompt_key: list[str],
+    description_count_limit: int | None,
+    bootstrap_sample_count: int,
+    confidence: float,
+    seed: int | None,
+) -> None:
+    conn = get_comparison_results_db(
+        Path(cache_friendly_file_storage.directory) / COMPARISON_STORAGE_DB_FILENAME
+    )
+    stats_by_label = analyze_comparison_permutations(
+        conn=conn,
+        item_type=item_type,
+        permutations=[
+            ComparisonPermutation(
+                comparison_llm_engine=Engine(ce),
+                comparison_prompt_key=cpk,
+                description_llm_engine=Engine(de),
+                description_prompt_key=dpk,
+            )
+            for (ce, cpk, de, dpk) in itertools.product(comparison_engine, comparison_prompt_key, description_engine, description_prompt_key)
+        ],
+        item_title_like=list(item_title_like) if item_title_like else None,
+        description_count_limit=description_count_limit,
+        bootstrap_sample_count=bootstrap_sample_count,
+        confidence=confidence,
+        seed=seed,
+    )
+    print(json.dumps({label: dataclasses.asdict(stats) for (label, stats) in stats_by_label.items()}, indent=4))
+
+
+if __name__ == "__main__":
+    _cli_func()
@@ -1,5 +1,6 @@
 import scripts_common_setup
 
+import dataclasses
 import json
 import click
 from datetime import datetime
@@ -9,7 +10,17 @@ from interlab.context import Context
 from interlab.ext.pyplot import capture_figure
 
 from generate_llm_descriptions import batch_gen_descriptions
+from llm_comparison.analytics import (
+    DEFAULT_BOOTSTRAP_SAMPLE_COUNT,
+    ComparisonPermutation,
+    analyze_comparison_permutations,
+)
+from llm_comparison.comparison_storage import get_comparison_storage_db
 from llm_comparison.config import get_all_comparison_prompt_keys_for_item_type
+from llm_comparison.early_stopping import (
+    DEFAULT_EARLY_STOPPING_MIN_COMPARISONS,
+    EarlyStoppingConfig,
+)
 from llm_comparison.presentation import (
     compute_llm_win_ratio,
     compute_avg_llm_win_ratio,
@@ -17,8 +28,14 @@ from llm_comparison.presentation import (
     make_comparison_run_permutation_label,
 )
 from llm_descriptions_generator.config import get_all_description_prompt_keys_for_item_type
-from llm_descriptions_generator.schema import Engine, Origin
+from llm_descriptions_generator.schema import Engine, Origin, get_engine_provider
 from run_comparisons import run_comparisons
+from run_graph import (
+    DEFAULT_MAX_CONCURRENT_NODES,
+    DEFAULT_MAX_CONCURRENT_NODES_PER_PROVIDER,
+    RunGraphNode,
+    run_graph,
+)
 from storage import cache_friendly_file_storage
 import llm_comparison.llm_comparison
 
@@ -31,6 +48,17 @@ DEFAULT_DESCRIPTION_ENGINE = Engine.gpt4turbo.value
 
 engine_choices = [e.value for e in Engine]
 
+
+def _make_comparison_node_key(rp: dict) -> tuple:
+    return (
+        "compare",
+        rp["comparison_engine"],
+        rp["comparison_prompt_key"],
+        rp["description_engine"],
+        rp["description_prompt_key"],
+    )
+
+
 @click.command()
 @click.option(
     "--item-type",
@@ -90,6 +118,47 @@ engine_choices = [e.value for e in Engine]
     is_flag=True,
     help="If present, 'Invalid' results in the comparison SQL db will be re-run instead of skipped (no effect on Context cache behavior).",
 )
+# option to set llm_comparison.llm_comparison.CONTEXT_CACHE_FALLBACK to false if present
+@click.option(
+    "--skip-context-cache-fallback",
+    is_flag=True,
+    help="If present, comparisons missing from the comparison SQL db are queried right away instead of first searching the Context cache (use after running scripts/backfill_comparison_db_from_context_cache.py).",
+)
+@click.option(
+    "--use-asyncio",
+    is_flag=True,
+    help="If present, run comparisons concurrently on an asyncio event loop (throttled per LLM provider, see rate_limiter.PROVIDER_RATE_LIMITS) instead of a thread pool.",
+)
+@click.option(
+    "--early-stopping-confidence",
+    type=float,
+    default=None,
+    help="If present (e.g. 0.95), stop comparing an item once its LLM win ratio is on one side of 0.5 with this confidence (see src/llm_comparison/early_stopping.py). Skipped comparisons are reported per item.",
+)
+@click.option(
+    "--early-stopping-min-comparisons",
+    type=int,
+    default=DEFAULT_EARLY_STOPPING_MIN_COMPARISONS,
+    help="Valid comparisons an item needs before it can stop early.",
+)
+@click.option(
+    "--bootstrap-sample-count",
+    type=int,
+    default=DEFAULT_BOOTSTRAP_SAMPLE_COUNT,
+    help="Bootstrap resamples behind the win ratio confidence intervals of the results (see src/llm_comparison/analytics.py).",
+)
+@click.option(
+    "--max-concurrent-nodes",
+    type=int,
+    default=DEFAULT_MAX_CONCURRENT_NODES,
+    help="Number of description generation / comparison steps of different permutations to run at once (see src/run_graph.py). 1 runs the permutations one after another.",
+)
+@click.option(
+    "--max-concurrent-nodes-per-provider",
+    type=int,
+    default=DEFAULT_MAX_CONCURRENT_NODES_PER_PROVIDER,
+    help="Number of those steps to run at once against the same LLM provider.",
+)
 def generate_and_compare_descriptions(
     item_type: str,
     item_title_like: list[str],
@@ -100,11 +169,25 @@ def generate_and_compare_descriptions(
     min_description_generation_count: int,
     max_comparison_concurrent_workers: int | None,
     redo_invalid_results: bool,
+    skip_context_cache_fallback: bool,
+    use_asyncio: bool,
+    early_stopping_confidence: float | None,
+    early_stopping_min_comparisons: int,
+    bootstrap_sample_count: int,
+    max_concurrent_nodes: int,
+    max_concurrent_nodes_per_provider: int,
 ) -> None:
     if max_comparison_concurrent_workers is not None:
         llm_comparison.llm_comparison.MAX_CONCURRENT_WORKERS = max_comparison_concurrent_workers
     if redo_invalid_results:
         llm_comparison.llm_comparison.REDO_INVALID_RESULTS = True
+    if skip_context_cache_fallback:
+        llm_comparison.llm_comparison.CONTEXT_CACHE_FALLBACK = False
+    if early_stopping_confidence is not None:
+        llm_comparison.llm_comparison.EARLY_STOPPING = EarlyStoppingConfig(
+            confidence=early_stopping_confidence,
+            min_comparisons=early_stopping_min_comparisons,
+        )
     print(f"""
             item_type: {item_type}
             item_title_like: {item_title_like}
@@ -115,6 +198,11 @@ def generate_and_compare_descriptions(
             min_description_generation_count: {min_description_generation_count}
             max_comparison_concurrent_workers: {llm_comparison.llm_comparison.MAX_CONCURRENT_WORKERS}
             redo_invalid_results: {llm_comparison.llm_comparison.REDO_INVALID_RESULTS}
+            context_cache_fallback: {llm_comparison.llm_comparison.CONTEXT_CACHE_FALLBACK}
+            use_asyncio: {use_asyncio}
+            early_stopping: {llm_comparison.llm_comparison.EARLY_STOPPING}
+            max_concurrent_nodes: {max_concurrent_nodes}
+            max_concurrent_nodes_per_provider: {max_concurrent_nodes_per_provider}
           """)
     run_start = datetime.now()
 
@@ -150,26 +238,49 @@ def generate_and_compare_descriptions(
         charts = {}
         item_names = []
 
+        # descriptions of each description engine + prompt are generated once, and every
+        # comparison permutation using them starts as soon as they are ready; permutations
+        # against different providers run side by side
+        nodes_by_key: dict[tuple, RunGraphNode] = {}
         for rp in run_permutations:
-            batch_gen_descriptions(
-                item_type=item_type,
-                prompt_nickname=rp["description_prompt_key"],
-                item_title_like=item_title_like,
-                engine=rp["description_engine"],
-                target_count=min_description_generation_count,
-                all_combos=False,
-            )
-
-            (tallies_by_item_title, total_tally) = run_comparisons(
-                item_type=item_type,
-                item_title_like=item_title_like,
-                comparison_engine=rp["comparison_engine"],
-                comparison_prompt_key=rp["comparison_prompt_key"],
-                description_engine=rp["description_engine"],
-                description_prompt_key=rp["description_prompt_key"],
-                description_count_limit=min_description_generation_count,
+            generation_key = ("generate", rp["description_engine"], rp["description_prompt_key"])
+            if generation_key not in nodes_by_key:
+                nodes_by_key[generation_key] = RunGraphNode(
+                    key=generation_key,
+                    run=lambda rp=rp: batch_gen_descriptions(
+                        item_type=item_type,
+                        prompt_nickname=rp["description_prompt_key"],
+                        item_title_like=item_title_like,
+                        engine=rp["description_engine"],
+                        target_count=min_description_generation_count,
+                        all_combos=False,
+                    ),
+                    provider=get_engine_provider(Engine(rp["description_engine"])),
+                )
+            comparison_key = _make_comparison_node_key(rp)
+            nodes_by_key[comparison_key] = RunGraphNode(
+                key=comparison_key,
+                run=lambda rp=rp: run_comparisons(
+                    item_type=item_type,
+                    item_title_like=item_title_like,
+                    comparison_engine=rp["comparison_engine"],
+                    comparison_prompt_key=rp["comparison_prompt_key"],
+                    description_engine=rp["description_engine"],
+                    description_prompt_key=rp["description_prompt_key"],
+                    description_count_limit=min_description_generation_count,
+                    use_asyncio=use_asyncio,
+                ),
+                provider=get_engine_provider(Engine(rp["comparison_engine"])),
+                dependencies=[generation_key],
             )
+        node_results = run_graph(
+            list(nodes_by_key.values()),
+            max_concurrent_nodes=max_concurrent_nodes,
+            max_concurrent_nodes_per_provider=max_concurrent_nodes_per_provider,
+        )
 
+        for rp in run_permutations:
+            (tallies_by_item_title, total_tally) = node_results[_make_comparison_node_key(rp)]
             label = make_comparison_run_permutation_label(
                 item_type=item_type,
                 comparison_llm_engine=rp["comparison_engine"],
@@ -182,7 +293,9 @@ def generate_and_compare_descriptions(
                     "LLM_win_ratio": compute_llm_win_ratio(tally),
                     "Human": tally.get(str(Origin.Human), 0),
                     "LLM": tally.get(str(Origin.LLM), 0), 
-                    "Invalid": tally.get("Invalid", 0)
+                    "Invalid": tally.get("Invalid", 0),
+                    # comparisons not run because the item stopped early
+                    "Skipped": tally.get("Skipped", 0),
                 }
                 for (title, tally) in tallies_by_item_title.items()
             }
@@ -197,6 +310,39 @@ def generate_and_compare_descriptions(
             if not item_names:
                 item_names = list(details_by_item.keys())
 
+        # bootstrap confidence intervals of every permutation, from the comparison results DB
+        comparison_storage_db = get_comparison_storage_db(
+            Path(cache_friendly_file_storage.directory) / llm_comparison.llm_comparison.COMPARISON_STORAGE_DB_FILENAME
+        )
+        comparison_storage_db.flush()
+        stats_by_label = analyze_comparison_permutations(
+            conn=comparison_storage_db.reader_conn(),
+            item_type=item_type,
+            permutations=[
+                ComparisonPermutation(
+                    comparison_llm_engine=Engine(rp["comparison_engine"]),
+                    comparison_prompt_key=rp["comparison_prompt_key"],
+                    description_llm_engine=Engine(rp["description_engine"]),
+                    description_prompt_key=rp["description_prompt_key"],
+                )
+                for rp in run_permutations
+            ],
+            item_title_like=list(item_title_like) if item_title_like else None,
+            description_count_limit=min_description_generation_count,
+            bootstrap_sample_count=bootstrap_sample_count,
+        )
+        for (label, stats) in stats_by_label.items():
+            for (title, item_stats) in stats.stats_by_item.items():
+                if title in results_data[label]["details_by_item"]:
+                    results_data[label]["details_by_item"][title]["LLM_win_ratio_ci"] = item_stats.llm_win_ratio_ci
+            results_data[label]["avg_llm_win_ratio_ci"] = stats.avg_llm_win_ratio_ci
+            results_data[label]["position_bias"] = {
+                "LLM_first_win_ratio": stats.llm_first_win_ratio,
+                "LLM_second_win_ratio": stats.llm_second_win_ratio,
+                "first_position_win_ratio": stats.first_position_win_ratio,
+                "first_position_win_ratio_ci": stats.first_position_win_ratio_ci,
+            }
+
         run_end = datetime.now()
         
         final_run_data = {
@@ -207,7 +353,12 @@ def generate_and_compare_descriptions(
                 "item_title_like": item_title_like,
                 "items_covered": item_names,
                 "min_description_generation_count": min_description_generation_count,
+                "bootstrap_sample_count": bootstrap_sample_count,
                 "engine_and_prompt_permutations": run_permutations,
+                "early_stopping": (
+                    dataclasses.asdict(llm_comparison.llm_comparison.EARLY_STOPPING)
+                    if llm_comparison.llm_comparison.EARLY_STOPPING else None
+                ),
             },
             "results": results_data,
         }
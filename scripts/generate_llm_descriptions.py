@@ -1,16 +1,14 @@
 import scripts_common_setup
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
 
 import click
 
 from llm_descriptions_generator.schema import Engine
 from llm_descriptions_generator.config import TEXT_GENERATION_PROMPT_CONFIG
-from llm_descriptions_generator.llm_descriptions import generate_llm_descriptions_for_item_type
+from llm_descriptions_generator.llm_descriptions import generate_missing_llm_descriptions
 
 DEFAULT_ENGINE = Engine.gpt4turbo
-MAX_CONCURRENT_WORKERS = 3
 
 engine_choices = [e.value for e in Engine]
 
@@ -41,28 +39,12 @@ Running item description generator with the following options:
 - Item Type & Prompts to iterate over: {item_prompts_to_generate}
 """
     )
-    llm_description_batches = []
-
-    def generate_descriptions(item, nickname):
-        return generate_llm_descriptions_for_item_type(
-            item_type=item,
-            prompt_nickname=nickname,
-            description_count=target_count,
-            llm_engine=llm_engine,
-            item_title_like=item_title_like if item_title_like else None,
-        )
-
-    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_WORKERS) as executor:
-        future_to_item = {executor.submit(generate_descriptions, item, nickname): (item, nickname) for item, nickname in item_prompts_to_generate}
-        for future in as_completed(future_to_item):
-            item, nickname = future_to_item[future]
-            try:
-                llm_description_batch = future.result()
-            except Exception as exc:
-                logging.error(f'{item, nickname} generated an exception: {exc}')
-                raise exc
-            else:
-                llm_description_batches.append(llm_description_batch)
+    llm_description_batches = generate_missing_llm_descriptions(
+        item_prompts=item_prompts_to_generate,
+        description_count=target_count,
+        llm_engine=llm_engine,
+        item_title_like=item_title_like if item_title_like else None,
+    )
 
     logging.info("Generation done")
     return llm_description_batches
@@ -0,0 +1,163 @@
+import scripts_common_setup
+
+import logging
+import typing as t
+from pathlib import Path
+
+import click
+
+import llm_batch
+from llm_comparison.batch_comparison import (
+    ingest_comparison_batch_results, prepare_comparison_batch_requests)
+from llm_comparison.config import get_comparison_prompt_config
+from llm_descriptions_generator.batch_generation import (
+    ingest_generation_batch_results, prepare_generation_batch_requests)
+from llm_descriptions_generator.schema import Engine
+from storage import cache_friendly_file_storage
+
+DEFAULT_COMPARISON_ENGINE = Engine.gpt4turbo.value
+DEFAULT_DESCRIPTION_ENGINE = Engine.gpt4turbo.value
+
+engine_choices = [e.value for e in Engine]
+
+# Typical flow (see README):
+#   prepare-comparisons / prepare-descriptions -> submit -> download --wait -> ingest-comparisons / ingest-descriptions
+# Two-step comparisons may leave follow-up choice analysis shards after ingesting: submit, download and ingest again.
+
+
+@click.group()
+def _cli_group() -> None:
+    pass
+
+
+@_cli_group.command("prepare-comparisons")
+@click.option("--item-type", type=str, required=True, help="Item type to prepare comparisons for.")
+@click.option(
+    "--item-title-like",
+    multiple=True,
+    default=[],
+    help="(Multiple OK) Optional item title(s) (fragments ok) to limit comparisons to.",
+)
+@click.option(
+    "--comparison-engine",
+    type=click.Choice(engine_choices, case_sensitive=False),
+    default=DEFAULT_COMPARISON_ENGINE,
+    help="LLM model/engine to run description comparisons with.",
+)
+@click.option("--comparison-prompt-key", type=str, required=True, help="Comparison prompt key/nickname.")
+@click.option(
+    "--description-engine",
+    type=click.Choice(engine_choices, case_sensitive=False),
+    default=DEFAULT_DESCRIPTION_ENGINE,
+    help="LLM model/engine that generated the descriptions to compare.",
+)
+@click.option("--description-prompt-key", type=str, default="", help="Description prompt key/nickname to compare against.")
+@click.option(
+    "--description-count-limit",
+    type=int,
+    default=10,
+    help="Optional limit for number of available LLM descriptions to compare against.",
+)
+@click.option("--dirpath", type=click.Path(path_type=Path), default=None, help="Batch directory (default: under batch_requests/comparisons/).")
+def _prepare_comparisons(
+    item_type: str,
+    item_title_like: list[str],
+    comparison_engine: str,
+    comparison_prompt_key: str,
+    description_engine: str,
+    description_prompt_key: str,
+    description_count_limit: t.Optional[int],
+    dirpath: t.Optional[Path],
+) -> None:
+    prepare_comparison_batch_requests(
+        comparison_llm_engine=Engine(comparison_engine),
+        comparison_prompt_config=get_comparison_prompt_config(
+            item_type=item_type,
+            prompt_key=comparison_prompt_key,
+        ),
+        item_type=item_type,
+        description_llm_engine=Engine(description_engine),
+        description_prompt_key=description_prompt_key,
+        item_title_like=list(item_title_like) if item_title_like else None,
+        storage=cache_friendly_file_storage,
+        description_count_limit=description_count_limit,
+        dirpath=dirpath,
+    )
+
+
+@_cli_group.command("prepare-descriptions")
+@click.option("--item-type", type=str, required=True, help="Item type to prepare description generation for.")
+@click.option("--prompt-nickname", type=str, required=True, help="Generation prompt nickname (pseudo ID).")
+@click.option(
+    "--target-count",
+    type=int,
+    default=6,
+    help="Target number of descriptions per item; only the missing ones are requested.",
+)
+@click.option(
+    "--item-title-like",
+    multiple=True,
+    default=[],
+    help="(Multiple OK) Optional item title(s) (fragments ok) to limit generation to.",
+)
+@click.option(
+    "--engine",
+    type=click.Choice(engine_choices, case_sensitive=False),
+    default=DEFAULT_DESCRIPTION_ENGINE,
+    help="LLM model/engine to generate descriptions with.",
+)
+@click.option("--dirpath", type=click.Path(path_type=Path), default=None, help="Batch directory (default: under batch_requests/descriptions/).")
+def _prepare_descriptions(
+    item_type: str,
+    prompt_nickname: str,
+    target_count: int,
+    item_title_like: list[str],
+    engine: str,
+    dirpath: t.Optional[Path],
+) -> None:
+    prepare_generation_batch_requests(
+        item_type=item_type,
+        prompt_nickname=prompt_nickname,
+        description_count=target_count,
+        llm_engine=Engine(engine),
+        item_title_like=list(item_title_like) if item_title_like else None,
+        dirpath=dirpath,
+    )
+
+
+@_cli_group.command("submit")
+@click.argument("dirpath", type=click.Path(exists=True, file_okay=False, path_type=Path))
+@click.option(
+    "--api-base",
+    type=str,
+    default=None,
+    help="Batch API base URL, e.g. a local stand-in server (default: the engine provider's API).",
+)
+def _submit(dirpath: Path, api_base: t.Optional[str]) -> None:
+    batch_ids = llm_batch.submit_shards(dirpath, api_base=api_base)
+    logging.info(f"Submitted {len(batch_ids)} batches")
+
+
+@_cli_group.command("download")
+@click.argument("dirpath", type=click.Path(exists=True, file_okay=False, path_type=Path))
+@click.option("--wait", is_flag=True, help="If present, keep polling until every submitted batch has finished.")
+@click.option("--poll-interval", type=float, default=llm_batch.BATCH_POLL_INTERVAL_SECONDS, help="Seconds between polls with --wait.")
+def _download(dirpath: Path, wait: bool, poll_interval: float) -> None:
+    results_filepaths = llm_batch.download_shard_results(dirpath, wait=wait, poll_interval_seconds=poll_interval)
+    logging.info(f"Downloaded results of {len(results_filepaths)} batches")
+
+
+@_cli_group.command("ingest-comparisons")
+@click.argument("dirpath", type=click.Path(exists=True, file_okay=False, path_type=Path))
+def _ingest_comparisons(dirpath: Path) -> None:
+    ingest_comparison_batch_results(dirpath, storage=cache_friendly_file_storage)
+
+
+@_cli_group.command("ingest-descriptions")
+@click.argument("dirpath", type=click.Path(exists=True, file_okay=False, path_type=Path))
+def _ingest_descriptions(dirpath: Path) -> None:
+    ingest_generation_batch_results(dirpath)
+
+
+if __name__ == '__main__':
+    _cli_group()
@@ -16,9 +16,9 @@ from llm_comparison.llm_comparison import (
 )
 from llm_comparison.presentation import make_comparison_run_permutation_label
 from llm_descriptions_generator.file_io import (
-    load_all_academic_papers_as_description_batches,
     load_all_human_description_batches,
-    load_all_llm_description_batches,
+    load_llm_description_batches_by_title,
+    to_safe_filename,
 )
 from llm_descriptions_generator.schema import (
     Engine,
@@ -83,6 +83,26 @@ def pick_random_comparisons_for_human_review(
 
         metadata = run_data.get("metadata")
         item_type = metadata.get("item_type")
+
+        # every description of the run loaded once, looked up by the filesafe titles the run
+        # results are keyed by (first hit, like a title-like search would pick)
+        human_description_batch_by_title = {}
+        for human_description_batch in load_all_human_description_batches(item_type=item_type):
+            human_description_batch_by_title.setdefault(to_safe_filename(human_description_batch.title), human_description_batch)
+        llm_description_batches_by_title = load_llm_description_batches_by_title(
+            item_type=item_type,
+            llm_engines=list({
+                Engine(permutation_config.get("description_engine"))
+                for permutation_config in metadata.get("engine_and_prompt_permutations")
+            }),
+        )
+        llm_description_batch_by_key = {}
+        for (title, llm_description_batches) in llm_description_batches_by_title.items():
+            for llm_description_batch in llm_description_batches:
+                llm_description_batch_by_key.setdefault(
+                    (to_safe_filename(title), llm_description_batch.llm_engine, llm_description_batch.generation_prompt_nickname),
+                    llm_description_batch,
+                )
         
         run_permutations_comparison_selections = []
 
@@ -118,18 +138,8 @@ def pick_random_comparisons_for_human_review(
             # iterate through selections list
             desc_comparisons = []
             for (title, _) in random_selections:
-                # get human description
-                if item_type == "paper":
-                    human_description_batch = load_all_academic_papers_as_description_batches(
-                        item_type=item_type,
-                        fill_description_with="abstract",
-                        item_title_like=[title],
-                    )[0]
-                else:
-                    human_description_batch = load_all_human_description_batches(
-                        item_type=item_type,
-                        item_title_like=[title],
-                    )[0]
+                # get human description (paper abstracts, for papers)
+                human_description_batch = human_description_batch_by_title[to_safe_filename(title)]
                 
                 #  - take first description in human list
                 # human_description = human_description_batch.descriptions[0]
@@ -139,12 +149,9 @@ def pick_random_comparisons_for_human_review(
 
 
                 # get LLM descriptions for item + DESCRIPTION prompt-key and engine
-                llm_description_batch = load_all_llm_description_batches(
-                    item_type=item_type,
-                    title=title,
-                    llm_engine=description_engine,
-                    prompt_nickname=description_prompt_key,
-                )[0]
+                llm_description_batch = llm_description_batch_by_key[
+                    (to_safe_filename(title), Engine(description_engine), description_prompt_key)
+                ]
                 #  - pick random description from LLM list
                 # llm_description = random.choice(llm_description_batch.descriptions)
                 llm_description = random.choice(
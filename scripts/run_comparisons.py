@@ -1,10 +1,12 @@
 import scripts_common_setup
 
+import asyncio
 import typing as t
 
 import click
 
 from llm_descriptions_generator.schema import Engine
+from llm_comparison import async_llm_comparison
 from llm_comparison.llm_comparison import compare_saved_description_batches
 from llm_comparison.config import get_comparison_prompt_config
 from storage import cache_friendly_file_storage
@@ -25,6 +27,7 @@ def run_comparisons(
     description_engine: str,
     description_prompt_key: str,
     description_count_limit: t.Optional[int] = None,
+    use_asyncio: bool = False,
 ):
     comparison_prompt_config = get_comparison_prompt_config(
         item_type=item_type,
@@ -33,6 +36,18 @@ def run_comparisons(
     comparison_llm_engine = Engine(comparison_engine)
     description_llm_engine = Engine(description_engine)
 
+    if use_asyncio:
+        return asyncio.run(async_llm_comparison.compare_saved_description_batches(
+            comparison_llm_engine=comparison_llm_engine,
+            comparison_prompt_config=comparison_prompt_config,
+            item_type=item_type,
+            item_title_like=list(item_title_like) if item_title_like else None,
+            description_llm_engine=description_llm_engine,
+            description_prompt_key=description_prompt_key,
+            storage=cache_friendly_file_storage,
+            description_count_limit=description_count_limit,
+        ))
+
     return compare_saved_description_batches(
         comparison_llm_engine=comparison_llm_engine,
         comparison_prompt_config=comparison_prompt_config,
@@ -88,6 +103,11 @@ def run_comparisons(
     default=10,
     help="Optional limit for number of available LLM descriptions to run comparison script against.",
 )
+@click.option(
+    "--use-asyncio",
+    is_flag=True,
+    help="If present, run all comparisons concurrently on an asyncio event loop (limited per LLM provider) instead of a thread pool.",
+)
 def _cli_func(
     item_type: str,
     item_title_like: list[str],
@@ -96,6 +116,7 @@ def _cli_func(
     description_engine: str,
     description_prompt_key: str,
     description_count_limit: t.Optional[int] = None,
+    use_asyncio: bool = False,
 ) -> None:
     return run_comparisons(
         item_type=item_type,
@@ -105,6 +126,7 @@ def _cli_func(
         description_engine=description_engine,
         description_prompt_key=description_prompt_key,
         description_count_limit=description_count_limit,
+        use_asyncio=use_asyncio,
     )
     
 
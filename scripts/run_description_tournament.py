@@ -0,0 +1,145 @@
+import scripts_common_setup
+
+import dataclasses
+import itertools
+import json
+import typing as t
+from datetime import datetime
+from pathlib import Path
+
+import click
+
+from llm_descriptions_generator.schema import Engine
+from llm_comparison import llm_comparison
+from llm_comparison.config import get_comparison_prompt_config
+from llm_comparison.tournament import DEFAULT_TOURNAMENT_ROUND_SIZE, run_description_tournament
+from storage import cache_friendly_file_storage
+
+# PURPOSE OF SCRIPT: rank several description sources (human descriptions and any number of
+# description engine + prompt combinations) against each other with a limited comparison budget,
+# picking the most informative comparisons as the ratings come in (see llm_comparison/tournament.py).
+# Comparisons already in the comparison results DB are reused, so a tournament can be continued
+# with more budget later.
+
+TOURNAMENT_OUTPUT_DIR = Path(__file__).parent.resolve() / "../full_run_outputs/tournaments"
+DEFAULT_COMPARISON_ENGINE = Engine.gpt4turbo.value
+DEFAULT_COMPARISON_BUDGET = 200
+
+engine_choices = [e.value for e in Engine]
+
+
+@click.command()
+@click.option("--item-type", type=str, required=True, help="Item type to run the tournament for.")
+@click.option(
+    "--item-title-like",
+    multiple=True,
+    default=[],
+    help="(Multiple OK) Optional item title(s) (fragments ok) to limit the tournament to.",
+)
+@click.option(
+    "--comparison-engine",
+    type=click.Choice(engine_choices, case_sensitive=False),
+    default=DEFAULT_COMPARISON_ENGINE,
+    help="LLM model/engine to run description comparisons with.",
+)
+@click.option("--comparison-prompt-key", type=str, required=True, help="Comparison prompt key/nickname to run comparisons with.")
+@click.option(
+    "--description-engine",
+    type=click.Choice(engine_choices, case_sensitive=False),
+    multiple=True,
+    required=True,
+    help="(Multiple OK) LLM model/engine whose descriptions take part (with every --description-prompt-key).",
+)
+@click.option(
+    "--description-prompt-key",
+    type=str,
+    multiple=True,
+    required=True,
+    help="(Multiple OK) Description prompt key/nickname whose descriptions take part (with every --description-engine).",
+)
+@click.option("--exclude-human", is_flag=True, help="If present, leave human descriptions out of the tournament.")
+@click.option(
+    "--comparison-budget",
+    type=int,
+    default=DEFAULT_COMPARISON_BUDGET,
+    help="Maximum number of comparisons to run, on top of those already stored.",
+)
+@click.option(
+    "--round-size",
+    type=int,
+    default=DEFAULT_TOURNAMENT_ROUND_SIZE,
+    help="Comparisons picked (and run concurrently) between rating updates.",
+)
+@click.option(
+    "--description-count-limit",
+    type=int,
+    default=10,
+    help="Optional limit for number of LLM descriptions per item and source.",
+)
+@click.option(
+    "--max-concurrent-workers",
+    type=int,
+    default=None,
+    help="Optional number of comparisons to run concurrently (default: llm_comparison.MAX_CONCURRENT_WORKERS).",
+)
+def run_tournament(
+    item_type: str,
+    item_title_like: list[str],
+    comparison_engine: str,
+    comparison_prompt_key: str,
+    description_engine: list[str],
+    description_prompt_key: list[str],
+    exclude_human: bool,
+    comparison_budget: int,
+    round_size: int,
+    description_count_limit: t.Optional[int],
+    max_concurrent_workers: t.Optional[int],
+) -> None:
+    if max_concurrent_workers is not None:
+        llm_comparison.MAX_CONCURRENT_WORKERS = max_concurrent_workers
+    comparison_prompt_config = get_comparison_prompt_config(
+        item_type=item_type,
+        prompt_key=comparison_prompt_key,
+    )
+    llm_sources = [
+        (Engine(engine), prompt_key)
+        for (engine, prompt_key) in itertools.product(description_engine, description_prompt_key)
+    ]
+
+    run_start = datetime.now()
+    result = run_description_tournament(
+        comparison_llm_engine=Engine(comparison_engine),
+        comparison_prompt_config=comparison_prompt_config,
+        item_type=item_type,
+        llm_sources=llm_sources,
+        comparison_budget=comparison_budget,
+        include_human=not exclude_human,
+        item_title_like=list(item_title_like) if item_title_like else None,
+        description_count_limit=description_count_limit,
+        round_size=round_size,
+        storage=cache_friendly_file_storage,
+    )
+    run_end = datetime.now()
+
+    tournament_data = {
+        "metadata": {
+            "run_start": run_start.isoformat(),
+            "run_end": run_end.isoformat(),
+            "item_type": item_type,
+            "item_title_like": item_title_like,
+            "comparison_engine": comparison_engine,
+            "comparison_prompt_key": comparison_prompt_key,
+            "comparison_budget": comparison_budget,
+        },
+        "results": dataclasses.asdict(result),
+    }
+    print(json.dumps(tournament_data, indent=4))
+
+    filepath = TOURNAMENT_OUTPUT_DIR / f"{run_end.strftime('%y%m%dT%H%M')}.json"
+    filepath.parent.mkdir(exist_ok=True, parents=True)
+    with open(filepath, "w") as f:
+        json.dump(tournament_data, f, ensure_ascii=False, indent=4)
+
+
+if __name__ == '__main__':
+    run_tournament()
@@ -1,50 +1,91 @@
-import functools
+import asyncio
 import logging
 import os
-import random
-import time
 import typing as t
+import weakref
 
+import httpx
 import interlab
 
+from llm_descriptions_generator.schema import EngineProvider
+from rate_limiter import get_rate_limiter
 
-@functools.lru_cache(maxsize=None)
+
+# NOTE: create through llm_clients.get_llm_client to share one instance (and connection pool) per model
 class GroqModel(interlab.lang_models.LangModelBase):
-    def __init__(self, model_name: str, min_delay=1.0, timeout=120.0):
+    def __init__(
+        self,
+        model_name: str,
+        api_key: t.Optional[str] = None,
+        base_url: t.Optional[str] = None,
+        pool_size: t.Optional[int] = None,
+        timeout=120.0,
+    ):
         self.model_name = model_name
-        self.min_delay = min_delay
         self.timeout = timeout
+        self.api_key = api_key or os.environ.get("GROQ_API_KEY")
+        self.base_url = base_url
+        self.limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
         import groq
-        self.client = groq.Groq(api_key=os.environ.get("GROQ_API_KEY"))
+        self.client = groq.Groq(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            http_client=httpx.Client(limits=self.limits),
+        )
+        # async connections can't be shared between event loops, so keep one client per loop
+        self._async_clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, t.Any] = weakref.WeakKeyDictionary()
         logging.info(
             f"Instantiated GroqModel {model_name} and key {self.client.api_key[:8]}...{self.client.api_key[-6:]}")
 
+    def _get_async_client(self) -> t.Any:
+        import groq
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_clients:
+            self._async_clients[loop] = groq.AsyncGroq(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                http_client=httpx.AsyncClient(limits=self.limits),
+            )
+        return self._async_clients[loop]
+
+    def _make_request_kwargs(self, prompt: str, conf: dict[str, t.Any]) -> dict[str, t.Any]:
+        return dict(
+            max_tokens=conf["max_tokens"],
+            temperature=conf["temperature"],
+            messages=[
+                {
+                    "role": "user",
+                    "content": prompt,
+                }
+            ],
+            model=conf["model_name"],
+        )
+
     def _query(self, prompt: str, conf: dict[str, t.Any]) -> str:
         import groq
-        start = time.time()
-        delay = self.min_delay * random.uniform(0.8, 1.2)
-
-        while True:
-            try:
-                chat_completion = self.client.with_options(max_retries=5, timeout=self.timeout).chat.completions.create(
-                    max_tokens=conf["max_tokens"],
-                    temperature=conf["temperature"],
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": prompt,
-                        }
-                    ],
-                    model=conf["model_name"],
-                )
-                return chat_completion.choices[0].message.content
-            except (groq.APIError) as e:
-                if time.time() - start > self.timeout:
-                    raise e
-                logging.info(f"Query failed, retrying after a delay: {e}")
-                time.sleep(delay)
-                delay *= 2
-                
+
+        # raw response to get at the rate limit headers, retries and backoff are left to the shared rate limiter
+        raw_response = get_rate_limiter(EngineProvider.Groq).call(
+            lambda: self.client.with_options(max_retries=0, timeout=self.timeout).chat.completions.with_raw_response.create(
+                **self._make_request_kwargs(prompt, conf),
+            ),
+            retryable_errors=(groq.APIError,),
+            get_headers=lambda response: response.headers,
+        )
+        return raw_response.parse().choices[0].message.content
+
+    async def _aquery(self, prompt: str, conf: dict[str, t.Any]) -> str:
+        """Same as `_query`, but awaits the request and the retry backoff instead of blocking the thread."""
+        import groq
+
+        raw_response = await get_rate_limiter(EngineProvider.Groq).call_async(
+            lambda: self._get_async_client().with_options(max_retries=0, timeout=self.timeout).chat.completions.with_raw_response.create(
+                **self._make_request_kwargs(prompt, conf),
+            ),
+            retryable_errors=(groq.APIError,),
+            get_headers=lambda response: response.headers,
+        )
+        return (await raw_response.parse()).choices[0].message.content
 
     def prepare_conf(self, max_tokens=1024, temperature=None) -> tuple[str, dict[str, t.Any]]:
         name = f"query interlab {__class__.__qualname__} ({self.model_name})"
@@ -0,0 +1,390 @@
+import hashlib
+import json
+import logging
+import os
+import time
+import typing as t
+from pathlib import Path
+
+import requests
+from interlab.queries.json_parsing import find_and_parse_json_block
+from interlab.queries.json_schema import get_json_schema, get_pydantic_model
+# NOTE: private, but batch prompts must match what query_for_json sends interactively
+from interlab.queries.query_for_json import _FORMAT_PROMPT
+from pydantic.dataclasses import dataclass
+
+from llm_clients import TOGETHER_API_BASE
+from llm_descriptions_generator.schema import (Engine, EngineProvider,
+                                               get_engine_provider)
+
+# Offline batch mode: instead of one interactive API call per prompt, pending prompts are written
+# to sharded JSONL request files (OpenAI batch API format), submitted in bulk, and the result files
+# are ingested back into the usual result storage once the batches have completed.
+#
+# Each shard in a batch directory is a set of files sharing one name prefix:
+# * <shard>.requests.jsonl  -- the request lines that get uploaded
+# * <shard>.manifest.jsonl  -- local bookkeeping per custom_id, needed to ingest results
+# * <shard>.batch.json      -- submission state (uploaded file ID, batch ID, status, ...)
+# * <shard>.results.jsonl   -- downloaded output (and error) lines
+
+THIS_FILE_DIR = Path(__file__).parent.resolve()
+BATCH_REQUESTS_DIR = THIS_FILE_DIR / "../batch_requests"
+
+# OpenAI allows up to 50k requests and 200 MB per batch input file
+MAX_REQUESTS_PER_SHARD = 50_000
+MAX_SHARD_BYTES = 190 * 1024 * 1024
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_POLL_INTERVAL_SECONDS = 60
+# langchain's ChatOpenAI default, which the interactive queries use
+BATCH_TEMPERATURE = 0.7
+OPENAI_API_BASE = "https://api.openai.com/v1"
+GROQ_API_BASE = "https://api.groq.com/openai/v1"
+HTTP_TIMEOUT_SECONDS = 300
+
+REQUESTS_FILE_SUFFIX = ".requests.jsonl"
+MANIFEST_FILE_SUFFIX = ".manifest.jsonl"
+BATCH_STATE_FILE_SUFFIX = ".batch.json"
+RESULTS_FILE_SUFFIX = ".results.jsonl"
+
+BATCH_FINAL_STATUSES = ["completed", "failed", "expired", "cancelled"]
+
+
+@dataclass
+class BatchRequest:
+    custom_id: str
+    engine: Engine
+    prompt: str
+    # anything needed to store the result once it comes back (written to the manifest, not uploaded)
+    metadata: dict[str, t.Any]
+
+
+def make_custom_id(prefix: str, *key_parts: t.Any) -> str:
+    """Stable request ID: the same prompt target always gets the same ID, across runs and machines."""
+    key = "|".join(str(part) for part in key_parts)
+    return f"{prefix}-{hashlib.md5(key.encode('utf-8')).hexdigest()}"
+
+
+def make_json_query_prompt(T: type, prompt: str) -> str:
+    """The prompt `interlab.queries.query_for_json` would send to ask for a JSON instance of `T`."""
+    schema = get_json_schema(get_pydantic_model(T))
+    return prompt + "\n\n" + _FORMAT_PROMPT.format(schema=schema, deliberation="")
+
+
+def parse_json_response(T: type, text: str) -> t.Optional[t.Any]:
+    """Parses and validates a JSON response the way `query_for_json` does, returns None on failure."""
+    try:
+        data = find_and_parse_json_block(text)
+        return T(**get_pydantic_model(T)(**data).dict())
+    except Exception as e:
+        logging.warning(f"Failed to parse a {T.__name__} JSON instance from response: {e}")
+        return None
+
+
+def get_batch_model_name(llm_engine: Engine) -> str:
+    # same model names as the interactive clients (see llm_clients.py)
+    if get_engine_provider(llm_engine) in [EngineProvider.Groq, EngineProvider.Together]:
+        return llm_engine.value.split("-", 1)[1]
+    return llm_engine.value
+
+
+def get_batch_api_base_and_key(llm_engine: Engine) -> tuple[str, t.Optional[str]]:
+    provider = get_engine_provider(llm_engine)
+    if provider == EngineProvider.Groq:
+        return (os.environ.get("GROQ_BASE_URL", GROQ_API_BASE), os.environ.get("GROQ_API_KEY"))
+    if provider == EngineProvider.Together:
+        return (TOGETHER_API_BASE, os.environ.get("TOGETHER_API_KEY"))
+    if provider == EngineProvider.Local:
+        return (os.getenv("LOCAL_LLM_API_BASE"), os.environ.get("OPENAI_API_KEY"))
+    return (os.environ.get("OPENAI_API_BASE", OPENAI_API_BASE), os.environ.get("OPENAI_API_KEY"))
+
+
+def _make_request_line(request: BatchRequest) -> dict[str, t.Any]:
+    return {
+        "custom_id": request.custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {
+            "model": get_batch_model_name(request.engine),
+            "messages": [{"role": "user", "content": request.prompt}],
+            "temperature": BATCH_TEMPERATURE,
+        },
+    }
+
+
+def get_shard_paths(dirpath: Path) -> list[Path]:
+    """Request files of every shard in `dirpath`."""
+    return sorted(Path(dirpath).glob(f"*{REQUESTS_FILE_SUFFIX}"))
+
+
+def _get_shard_file(requests_filepath: Path, suffix: str) -> Path:
+    return requests_filepath.with_name(requests_filepath.name.removesuffix(REQUESTS_FILE_SUFFIX) + suffix)
+
+
+def write_request_shards(
+    dirpath: Path,
+    batch_requests: t.Iterable[BatchRequest],
+    shard_name_prefix: str = "shard",
+) -> list[Path]:
+    """
+    Writes requests into as many JSONL shards as the batch API limits require, skipping custom IDs
+    that are already in a shard of `dirpath` that hasn't been ingested yet (so failed requests of
+    ingested shards get requested again). Returns the paths of the newly written request files.
+    """
+    dirpath = Path(dirpath)
+    dirpath.mkdir(exist_ok=True, parents=True)
+    existing_custom_ids = set()
+    for requests_filepath in get_shard_paths(dirpath):
+        if not is_shard_ingested(requests_filepath):
+            existing_custom_ids.update(read_manifest(requests_filepath).keys())
+    shard_index = len(list(dirpath.glob(f"{shard_name_prefix}-*{REQUESTS_FILE_SUFFIX}")))
+
+    written_filepaths: list[Path] = []
+    requests_file = None
+    manifest_file = None
+    shard_engine: t.Optional[Engine] = None
+    shard_request_count = 0
+    shard_byte_count = 0
+    skipped_count = 0
+    try:
+        for request in batch_requests:
+            if request.custom_id in existing_custom_ids:
+                skipped_count += 1
+                continue
+            existing_custom_ids.add(request.custom_id)
+            line = json.dumps(_make_request_line(request), ensure_ascii=False) + "\n"
+            line_byte_count = len(line.encode("utf-8"))
+            # batch APIs only accept one model per input file
+            if (
+                requests_file is None
+                or request.engine != shard_engine
+                or shard_request_count >= MAX_REQUESTS_PER_SHARD
+                or shard_byte_count + line_byte_count > MAX_SHARD_BYTES
+            ):
+                if requests_file is not None:
+                    requests_file.close()
+                    manifest_file.close()
+                requests_filepath = dirpath / f"{shard_name_prefix}-{shard_index:05d}{REQUESTS_FILE_SUFFIX}"
+                shard_index += 1
+                requests_file = open(requests_filepath, "w")
+                manifest_file = open(_get_shard_file(requests_filepath, MANIFEST_FILE_SUFFIX), "w")
+                written_filepaths.append(requests_filepath)
+                shard_engine = request.engine
+                shard_request_count = 0
+                shard_byte_count = 0
+            requests_file.write(line)
+            manifest_file.write(json.dumps({
+                "custom_id": request.custom_id,
+                "llm_engine": request.engine.value,
+                **request.metadata,
+            }, ensure_ascii=False) + "\n")
+            shard_request_count += 1
+            shard_byte_count += line_byte_count
+    finally:
+        if requests_file is not None:
+            requests_file.close()
+            manifest_file.close()
+
+    if skipped_count:
+        logging.info(f"Skipped {skipped_count} requests already written to shards in {dirpath}")
+    for requests_filepath in written_filepaths:
+        logging.info(f"Wrote batch request shard: {requests_filepath}")
+    return written_filepaths
+
+
+def read_manifest(requests_filepath: Path) -> dict[str, dict[str, t.Any]]:
+    manifest: dict[str, dict[str, t.Any]] = {}
+    manifest_filepath = _get_shard_file(requests_filepath, MANIFEST_FILE_SUFFIX)
+    if not manifest_filepath.exists():
+        return manifest
+    with open(manifest_filepath) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                manifest[entry["custom_id"]] = entry
+    return manifest
+
+
+def read_batch_state(requests_filepath: Path) -> t.Optional[dict[str, t.Any]]:
+    state_filepath = _get_shard_file(requests_filepath, BATCH_STATE_FILE_SUFFIX)
+    if not state_filepath.exists():
+        return None
+    with open(state_filepath) as f:
+        return json.load(f)
+
+
+def _write_batch_state(requests_filepath: Path, state: dict[str, t.Any]) -> None:
+    with open(_get_shard_file(requests_filepath, BATCH_STATE_FILE_SUFFIX), "w") as f:
+        json.dump(state, f, indent=4)
+
+
+def _get_shard_engine(requests_filepath: Path) -> Engine:
+    with open(requests_filepath) as f:
+        first_line = f.readline()
+    if not first_line.strip():
+        raise Exception(f"Batch request shard {requests_filepath} is empty")
+    custom_id = json.loads(first_line)["custom_id"]
+    return Engine(read_manifest(requests_filepath)[custom_id]["llm_engine"])
+
+
+class BatchApiClient:
+    """Minimal client for an OpenAI-style batch API (`/files` + `/batches`)."""
+
+    def __init__(self, api_base: str, api_key: t.Optional[str]):
+        if not api_base:
+            raise Exception("No API base URL configured for batch submission")
+        self.api_base = api_base.rstrip("/")
+        self.session = requests.Session()
+        if api_key:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+
+    def _request(self, method: str, path: str, **kwargs: t.Any) -> requests.Response:
+        response = self.session.request(method, f"{self.api_base}{path}", timeout=HTTP_TIMEOUT_SECONDS, **kwargs)
+        if not response.ok:
+            raise Exception(f"Batch API request {method} {path} failed ({response.status_code}): {response.text[:500]}")
+        return response
+
+    def upload_file(self, filepath: Path) -> str:
+        with open(filepath, "rb") as f:
+            response = self._request("POST", "/files", data={"purpose": "batch"}, files={"file": (filepath.name, f)})
+        return response.json()["id"]
+
+    def create_batch(self, input_file_id: str, metadata: t.Optional[dict[str, str]] = None) -> dict[str, t.Any]:
+        return self._request("POST", "/batches", json={
+            "input_file_id": input_file_id,
+            "endpoint": BATCH_ENDPOINT,
+            "completion_window": BATCH_COMPLETION_WINDOW,
+            "metadata": metadata or {},
+        }).json()
+
+    def get_batch(self, batch_id: str) -> dict[str, t.Any]:
+        return self._request("GET", f"/batches/{batch_id}").json()
+
+    def download_file(self, file_id: str, filepath: Path) -> None:
+        with self._request("GET", f"/files/{file_id}/content", stream=True) as response:
+            with open(filepath, "wb") as f:
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    f.write(chunk)
+
+
+def _make_batch_api_client(requests_filepath: Path, api_base: t.Optional[str] = None) -> BatchApiClient:
+    (default_api_base, api_key) = get_batch_api_base_and_key(_get_shard_engine(requests_filepath))
+    return BatchApiClient(api_base=api_base or default_api_base, api_key=api_key)
+
+
+def submit_shards(dirpath: Path, api_base: t.Optional[str] = None) -> list[str]:
+    """Uploads and starts a batch for every shard in `dirpath` that hasn't been submitted yet. Returns the new batch IDs."""
+    batch_ids: list[str] = []
+    for requests_filepath in get_shard_paths(dirpath):
+        if read_batch_state(requests_filepath) is not None:
+            logging.info(f"Already submitted, skipping: {requests_filepath.name}")
+            continue
+        client = _make_batch_api_client(requests_filepath, api_base)
+        input_file_id = client.upload_file(requests_filepath)
+        batch = client.create_batch(input_file_id, metadata={"shard": requests_filepath.name})
+        _write_batch_state(requests_filepath, {
+            "api_base": client.api_base,
+            "input_file_id": input_file_id,
+            "batch_id": batch["id"],
+            "status": batch.get("status", None),
+        })
+        logging.info(f"Submitted {requests_filepath.name} as batch {batch['id']}")
+        batch_ids.append(batch["id"])
+    return batch_ids
+
+
+def download_shard_results(
+    dirpath: Path,
+    wait: bool = False,
+    poll_interval_seconds: float = BATCH_POLL_INTERVAL_SECONDS,
+) -> list[Path]:
+    """
+    Checks every submitted shard in `dirpath` and downloads the results of finished batches.
+    With `wait`, keeps polling until every submitted batch has finished. Returns the downloaded result files.
+    """
+    downloaded_filepaths: list[Path] = []
+    while True:
+        unfinished_count = 0
+        for requests_filepath in get_shard_paths(dirpath):
+            state = read_batch_state(requests_filepath)
+            results_filepath = _get_shard_file(requests_filepath, RESULTS_FILE_SUFFIX)
+            if state is None or is_shard_downloaded(requests_filepath):
+                continue
+            client = _make_batch_api_client(requests_filepath, state["api_base"])
+            batch = client.get_batch(state["batch_id"])
+            state["status"] = batch["status"]
+            state["request_counts"] = batch.get("request_counts", None)
+            if batch["status"] not in BATCH_FINAL_STATUSES:
+                _write_batch_state(requests_filepath, state)
+                logging.info(f"Batch {state['batch_id']} ({requests_filepath.name}) is {batch['status']}: {batch.get('request_counts', None)}")
+                unfinished_count += 1
+                continue
+            # failed requests are listed in the error file, in the same format
+            partial_filepath = results_filepath.with_suffix(".partial")
+            with open(partial_filepath, "wb") as results_file:
+                ends_mid_line = False
+                for file_id_key in ["output_file_id", "error_file_id"]:
+                    file_id = batch.get(file_id_key, None)
+                    if not file_id:
+                        continue
+                    part_filepath = results_filepath.with_suffix(f".{file_id_key}")
+                    client.download_file(file_id, part_filepath)
+                    part = part_filepath.read_bytes()
+                    # keep the last line of one part from running into the first line of the next
+                    if ends_mid_line:
+                        results_file.write(b"\n")
+                    results_file.write(part)
+                    if part:
+                        ends_mid_line = not part.endswith(b"\n")
+                    part_filepath.unlink()
+            partial_filepath.rename(results_filepath)
+            # the final status is only saved once the results are, so an interrupted download is retried
+            _write_batch_state(requests_filepath, state)
+            logging.info(f"Batch {state['batch_id']} ({requests_filepath.name}) {batch['status']}, results saved to: {results_filepath}")
+            downloaded_filepaths.append(results_filepath)
+        if not wait or unfinished_count == 0:
+            return downloaded_filepaths
+        time.sleep(poll_interval_seconds)
+
+
+def iter_shard_results(
+    requests_filepath: Path,
+) -> t.Iterator[tuple[dict[str, t.Any], t.Optional[str]]]:
+    """
+    Streams (manifest entry, response text) for every result line of a shard. The response text
+    is None for failed requests, which are simply left pending for a later batch.
+    """
+    results_filepath = _get_shard_file(requests_filepath, RESULTS_FILE_SUFFIX)
+    if not results_filepath.exists():
+        return
+    manifest = read_manifest(requests_filepath)
+    with open(results_filepath) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            entry = manifest.get(result.get("custom_id", None), None)
+            if entry is None:
+                logging.warning(f"Ignoring batch result with unknown custom_id: {result.get('custom_id', None)}")
+                continue
+            response = result.get("response", None) or {}
+            if result.get("error", None) or response.get("status_code", None) != 200:
+                logging.warning(f"Batch request {entry['custom_id']} failed: {result.get('error', None) or response}")
+                yield (entry, None)
+                continue
+            yield (entry, response["body"]["choices"][0]["message"]["content"])
+
+
+def is_shard_downloaded(requests_filepath: Path) -> bool:
+    return _get_shard_file(requests_filepath, RESULTS_FILE_SUFFIX).exists()
+
+
+def mark_shard_ingested(requests_filepath: Path, ingested_count: int) -> None:
+    state = read_batch_state(requests_filepath) or {}
+    state["ingested_count"] = ingested_count
+    _write_batch_state(requests_filepath, state)
+
+
+def is_shard_ingested(requests_filepath: Path) -> bool:
+    state = read_batch_state(requests_filepath)
+    return state is not None and state.get("ingested_count", None) is not None
@@ -0,0 +1,147 @@
+import contextlib
+import functools
+import logging
+import os
+import threading
+import typing as t
+
+import langchain
+import openai
+import requests
+from interlab.context import Context
+from interlab.lang_models.query_model import _prepare_model
+
+import groq_model
+from llm_descriptions_generator.schema import (Engine, EngineProvider,
+                                               get_engine_provider)
+from openai_model import (RateLimitedChatOpenAI,
+                          make_response_headers_trace_config,
+                          record_response_headers)
+from rate_limiter import PROVIDER_RATE_LIMITS
+
+TOGETHER_API_BASE = "https://api.together.xyz/v1"
+# Providers whose chat completions API returns several samples (`n`) for one prompt in one request
+MULTI_SAMPLE_PROVIDERS = [EngineProvider.OpenAI, EngineProvider.Together]
+
+# One long-lived client per (engine, base URL, API key), shared by description generation and comparison
+_llm_clients: dict[tuple[Engine, t.Optional[str], t.Optional[str]], t.Any] = {}
+_llm_clients_lock = threading.Lock()
+
+
+def get_provider_pool_size(provider: EngineProvider) -> int:
+    # the rate limiter never lets more requests than this be in flight, so no point in more connections
+    return PROVIDER_RATE_LIMITS[provider].max_concurrent_requests
+
+
+@functools.lru_cache(maxsize=None)
+def _get_pooled_requests_session() -> requests.Session:
+    # NOTE: the openai (v0) SDK otherwise opens one session per worker thread
+    pool_size = max(get_provider_pool_size(provider) for provider in EngineProvider)
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=len(EngineProvider), pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # successful responses' x-ratelimit-* headers, for the rate limiter
+    session.hooks["response"].append(record_response_headers)
+    return session
+
+
+@contextlib.asynccontextmanager
+async def pooled_openai_aiohttp_session() -> t.AsyncIterator[None]:
+    """
+    Makes the openai (v0) SDK reuse one keep-alive connection pool for every async request in this block,
+    instead of opening a new HTTP session per request. Tasks started inside the block inherit it.
+    """
+    import aiohttp
+
+    pool_size = max(get_provider_pool_size(provider) for provider in EngineProvider)
+    async with aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=pool_size),
+        trace_configs=[make_response_headers_trace_config()],
+    ) as session:
+        token = openai.aiosession.set(session)
+        try:
+            yield
+        finally:
+            openai.aiosession.reset(token)
+
+
+def _get_llm_client_key(llm_engine: Engine) -> tuple[Engine, t.Optional[str], t.Optional[str]]:
+    provider = get_engine_provider(llm_engine)
+    if provider == EngineProvider.Groq:
+        return (llm_engine, os.environ.get("GROQ_BASE_URL"), os.environ.get("GROQ_API_KEY"))
+    if provider == EngineProvider.Together:
+        return (llm_engine, TOGETHER_API_BASE, os.environ.get("TOGETHER_API_KEY"))
+    if provider == EngineProvider.Local:
+        return (llm_engine, os.getenv('LOCAL_LLM_API_BASE'), os.environ.get("OPENAI_API_KEY"))
+    return (llm_engine, None, os.environ.get("OPENAI_API_KEY"))
+
+
+def _make_llm_client(
+    llm_engine: Engine,
+    base_url: t.Optional[str],
+    api_key: t.Optional[str],
+) -> t.Any:
+    provider = get_engine_provider(llm_engine)
+    if provider == EngineProvider.Groq:
+        name = llm_engine.value.split("-", 1)[1]
+        logging.info(f"Querying {name} on Groq")
+        return groq_model.GroqModel(
+            model_name=name,
+            api_key=api_key,
+            base_url=base_url,
+            pool_size=get_provider_pool_size(provider),
+        )
+
+    openai.requestssession = _get_pooled_requests_session()
+    if provider == EngineProvider.OpenAI:
+        logging.info(f"Querying OpenAI servers for: {llm_engine}")
+        return RateLimitedChatOpenAI(model_name=llm_engine, openai_api_key=api_key, provider=provider)
+    if provider == EngineProvider.Together:
+        name = llm_engine.value.split("-", 1)[1]
+        logging.info(f"Querying {name} on Together (via OpenAI API)")
+        return RateLimitedChatOpenAI(
+            model_name=name,
+            openai_api_key=api_key,
+            openai_api_base=base_url,
+            provider=provider,
+        )
+    logging.info(f"Assuming {llm_engine} is running locally")
+    return RateLimitedChatOpenAI(
+        model_name=llm_engine,
+        max_tokens=-1,
+        openai_api_key=api_key,
+        openai_api_base=base_url,
+        provider=provider,
+    )
+
+
+def get_llm_client(llm_engine: Engine) -> t.Any:
+    """Returns the shared client for `llm_engine`, creating it on first use."""
+    key = _get_llm_client_key(llm_engine)
+    with _llm_clients_lock:
+        if key not in _llm_clients:
+            (_, base_url, api_key) = key
+            _llm_clients[key] = _make_llm_client(llm_engine, base_url, api_key)
+        return _llm_clients[key]
+
+
+def supports_multiple_samples(llm_engine: Engine) -> bool:
+    return get_engine_provider(llm_engine) in MULTI_SAMPLE_PROVIDERS
+
+
+def query_model_samples(llm_model: t.Any, prompt: str, sample_count: int) -> list[str]:
+    """
+    Like `interlab.lang_models.query_model`, but asks for `sample_count` completions of the prompt
+    in a single request (the prompt is sent once). Only for chat model clients of MULTI_SAMPLE_PROVIDERS.
+    """
+    if not isinstance(llm_model, langchain.chat_models.base.BaseChatModel):
+        raise Exception(f"Multiple samples per request not supported for {llm_model.__class__}")
+    (name, conf, _) = _prepare_model(llm_model)
+    with Context(name, kind="query", inputs=dict(prompt=prompt, conf={**conf, "n": sample_count})) as c:
+        result = llm_model.generate([[langchain.schema.HumanMessage(content=prompt)]], n=sample_count)
+        samples = [generation.text for generation in result.generations[0]]
+        if len(samples) != sample_count:
+            raise Exception(f"Asked for {sample_count} samples, got {len(samples)}")
+        c.set_result(samples)
+        return samples
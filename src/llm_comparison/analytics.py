@@ -0,0 +1,381 @@
+import logging
+import sqlite3
+import time
+import typing as t
+
+import numpy as np
+from pydantic.dataclasses import dataclass
+
+from llm_comparison.llm_comparison import (
+    _make_descriptions_from_human_description_batch,
+    _make_descriptions_from_llm_description_batch)
+from llm_comparison.presentation import make_comparison_run_permutation_label
+from llm_descriptions_generator.file_io import (
+    load_all_human_description_batches, load_llm_description_batches_by_title)
+from llm_descriptions_generator.schema import Engine
+
+# Win ratio statistics of stored comparison results (see comparison_storage.py), computed on NumPy
+# arrays instead of per-item tallies: a permutation's results are loaded as one row per comparison
+# (item index, position of the LLM description, winner), and every statistic, including the
+# bootstrap resamples behind the confidence intervals, is a handful of array operations.
+#
+# Rows are assigned to items by description uid, using the current description files, so the
+# numbers match what a comparison run over the same items and descriptions would tally.
+#
+# Bootstrap resamples are two-stage: items are resampled with replacement, then each resampled
+# item's win counts are redrawn from binomials with the item's own win ratios (one per presentation
+# order). So the intervals cover both the choice of items and the comparison noise within each item.
+# Per-item intervals only redraw the item's own wins; for items with all-or-nothing results (in
+# each presentation order) they collapse to a point, so read them along with the item's counts.
+
+DEFAULT_BOOTSTRAP_SAMPLE_COUNT = 2000
+DEFAULT_CONFIDENCE_LEVEL = 0.95
+
+
+@dataclass
+class ComparisonPermutation:
+    comparison_llm_engine: Engine
+    comparison_prompt_key: str
+    description_llm_engine: Engine
+    description_prompt_key: str
+
+    def make_label(self, item_type: str) -> str:
+        return make_comparison_run_permutation_label(
+            item_type=item_type,
+            comparison_llm_engine=self.comparison_llm_engine.value,
+            comparison_prompt_key=self.comparison_prompt_key,
+            description_llm_engine=self.description_llm_engine.value,
+            description_prompt_key=self.description_prompt_key,
+        )
+
+
+class DescriptionItemIndex:
+    """Sorted description uids with the index of their item, for vectorised lookups of comparison rows."""
+
+    def __init__(self, uids: list[str], item_indexes: list[int], is_llm: list[bool]):
+        order = np.argsort(np.array(uids, dtype=str), kind="stable")
+        self.uids = np.array(uids, dtype=str)[order]
+        self.item_indexes = np.array(item_indexes, dtype=np.int64)[order]
+        self.is_llm = np.array(is_llm, dtype=bool)[order]
+
+    def lookup(self, uids: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(found, item index, is LLM description) of every uid."""
+        if len(self.uids) == 0:
+            return (np.zeros(len(uids), dtype=bool), np.zeros(len(uids), dtype=np.int64), np.zeros(len(uids), dtype=bool))
+        positions = np.clip(np.searchsorted(self.uids, uids), 0, len(self.uids) - 1)
+        found = self.uids[positions] == uids
+        return (found, self.item_indexes[positions], self.is_llm[positions])
+
+
+class ComparisonArrays:
+    """One permutation's stored comparisons, one array entry per comparison."""
+
+    def __init__(
+        self,
+        item_titles: list[str],
+        item_indexes: np.ndarray,
+        llm_positions: np.ndarray,
+        winners: np.ndarray,
+    ):
+        self.item_titles = item_titles
+        self.item_indexes = item_indexes
+        # 1 if the LLM description was presented first, 2 if second
+        self.llm_positions = llm_positions
+        # 0 for None/Invalid, 1 or 2 for the description presented first or second (as stored)
+        self.winners = winners
+
+    @property
+    def valid(self) -> np.ndarray:
+        return self.winners != 0
+
+    @property
+    def llm_won(self) -> np.ndarray:
+        return self.winners == self.llm_positions
+
+
+@dataclass
+class ItemWinRatioStats:
+    llm_win_ratio: t.Optional[float]
+    llm_win_ratio_ci: t.Optional[tuple[float, float]]
+    llm_wins: int
+    human_wins: int
+    invalid: int
+
+
+@dataclass
+class PermutationStats:
+    comparison_count: int
+    invalid_count: int
+    stats_by_item: dict[str, ItemWinRatioStats]
+    # mean of the per-item LLM win ratios (items without valid results left out), as presentation.compute_avg_llm_win_ratio
+    avg_llm_win_ratio: t.Optional[float]
+    avg_llm_win_ratio_ci: t.Optional[tuple[float, float]]
+    # pooled LLM win ratios of the comparisons presenting the LLM description first / second
+    llm_first_win_ratio: t.Optional[float]
+    llm_second_win_ratio: t.Optional[float]
+    # pooled ratio of comparisons won by whichever description was presented first (0.5: no position bias)
+    first_position_win_ratio: t.Optional[float]
+    first_position_win_ratio_ci: t.Optional[tuple[float, float]]
+
+
+def make_description_item_index(
+    item_titles: list[str],
+    human_descriptions_by_title: dict[str, list[str]],
+    llm_description_batches_by_title: dict[str, list[t.Any]],
+    description_llm_engine: Engine,
+    description_prompt_key: str,
+    description_count_limit: t.Optional[int] = None,
+) -> DescriptionItemIndex:
+    """
+    Human and LLM description uids of every item, picking the LLM batch and descriptions like
+    llm_comparison.load_item_comparison_descriptions does.
+    """
+    uids: list[str] = []
+    item_indexes: list[int] = []
+    is_llm: list[bool] = []
+    for (item_index, title) in enumerate(item_titles):
+        for uid in human_descriptions_by_title[title]:
+            uids.append(uid)
+            item_indexes.append(item_index)
+            is_llm.append(False)
+        llm_description_batches = [
+            llm_description_batch for llm_description_batch in llm_description_batches_by_title.get(title, [])
+            if llm_description_batch.llm_engine == description_llm_engine
+            and llm_description_batch.generation_prompt_nickname == description_prompt_key
+        ]
+        if not llm_description_batches:
+            continue
+        llm_descriptions = _make_descriptions_from_llm_description_batch(llm_description_batches[0])
+        if description_count_limit:
+            llm_descriptions = llm_descriptions[:description_count_limit]
+        for description in llm_descriptions:
+            uids.append(description.uid)
+            item_indexes.append(item_index)
+            is_llm.append(True)
+    return DescriptionItemIndex(uids, item_indexes, is_llm)
+
+
+def load_comparison_arrays(
+    conn: sqlite3.Connection,
+    permutation: ComparisonPermutation,
+    item_titles: list[str],
+    description_item_index: DescriptionItemIndex,
+) -> ComparisonArrays:
+    """Stored LLM-vs-human comparisons of the permutation between descriptions of the same item."""
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT description_uid_1, description_uid_2, winner
+        FROM comparison_results
+        WHERE comparison_llm_engine = ?
+          AND comparison_prompt_key = ?
+        """,
+        (permutation.comparison_llm_engine.value, permutation.comparison_prompt_key),
+    )
+    rows = cursor.fetchall()
+    cursor.close()
+    if rows:
+        (uids_1, uids_2, winners) = zip(*rows)
+    else:
+        (uids_1, uids_2, winners) = ((), (), ())
+    (found_1, item_indexes_1, is_llm_1) = description_item_index.lookup(np.array(uids_1, dtype=str))
+    (found_2, item_indexes_2, is_llm_2) = description_item_index.lookup(np.array(uids_2, dtype=str))
+    # exactly one LLM description, both of the same item
+    selected = found_1 & found_2 & (item_indexes_1 == item_indexes_2) & (is_llm_1 != is_llm_2)
+    return ComparisonArrays(
+        item_titles=item_titles,
+        item_indexes=item_indexes_1[selected],
+        llm_positions=np.where(is_llm_1[selected], 1, 2).astype(np.int8),
+        winners=np.array(winners, dtype=np.int8)[selected],
+    )
+
+
+def _get_percentile_ci(samples: np.ndarray, confidence: float, axis: int = 0) -> np.ndarray:
+    """Percentile bootstrap interval bounds along the axis, shape (2, ...)."""
+    alpha = (1 - confidence) / 2
+    return np.quantile(samples, [alpha, 1 - alpha], axis=axis)
+
+
+def _to_optional_float(value: float) -> t.Optional[float]:
+    return None if np.isnan(value) else float(value)
+
+
+def _to_optional_ci(low: float, high: float) -> t.Optional[tuple[float, float]]:
+    return None if np.isnan(low) or np.isnan(high) else (float(low), float(high))
+
+
+def _bootstrap_cis(
+    valid_counts: np.ndarray,
+    llm_win_counts: np.ndarray,
+    bootstrap_sample_count: int,
+    confidence: float,
+    rng: np.random.Generator,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    (average LLM win ratio interval, first position win ratio interval, per-item LLM win ratio
+    intervals) from (item, presentation order) valid and LLM win counts, items without valid results
+    getting NaN intervals.
+    """
+    item_valid_counts = valid_counts.sum(axis=1)
+    has_valid = item_valid_counts > 0
+    valid_item_indexes = np.flatnonzero(has_valid)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        order_llm_win_ratios = np.nan_to_num(llm_win_counts / valid_counts)
+
+    # (sample, item, presentation order) counts of the resampled items, with binomial redraws of their wins
+    sampled_items = valid_item_indexes[rng.integers(0, len(valid_item_indexes), size=(bootstrap_sample_count, len(valid_item_indexes)))]
+    sampled_valid_counts = valid_counts[sampled_items]
+    sampled_llm_win_counts = rng.binomial(sampled_valid_counts, order_llm_win_ratios[sampled_items])
+    sampled_avg_llm_win_ratios = (sampled_llm_win_counts.sum(axis=2) / sampled_valid_counts.sum(axis=2)).mean(axis=1)
+    # the description presented first wins: LLM wins when it was first, human wins when it was second
+    sampled_first_position_win_ratios = (
+        sampled_llm_win_counts[:, :, 0].sum(axis=1)
+        + (sampled_valid_counts[:, :, 1] - sampled_llm_win_counts[:, :, 1]).sum(axis=1)
+    ) / sampled_valid_counts.sum(axis=(1, 2))
+
+    # per item: binomial redraws of the item's own wins only
+    sampled_item_llm_win_ratios = rng.binomial(
+        np.broadcast_to(valid_counts[has_valid], (bootstrap_sample_count, len(valid_item_indexes), 2)),
+        order_llm_win_ratios[has_valid],
+    ).sum(axis=2) / item_valid_counts[has_valid]
+    item_cis = np.full((2, len(item_valid_counts)), np.nan)
+    item_cis[:, has_valid] = _get_percentile_ci(sampled_item_llm_win_ratios, confidence)
+    return (
+        _get_percentile_ci(sampled_avg_llm_win_ratios, confidence),
+        _get_percentile_ci(sampled_first_position_win_ratios, confidence),
+        item_cis,
+    )
+
+
+def compute_permutation_stats(
+    comparison_arrays: ComparisonArrays,
+    bootstrap_sample_count: int = DEFAULT_BOOTSTRAP_SAMPLE_COUNT,
+    confidence: float = DEFAULT_CONFIDENCE_LEVEL,
+    rng: t.Optional[np.random.Generator] = None,
+) -> PermutationStats:
+    rng = rng or np.random.default_rng()
+    item_count = len(comparison_arrays.item_titles)
+    item_indexes = comparison_arrays.item_indexes
+    valid = comparison_arrays.valid
+    llm_won = comparison_arrays.llm_won & valid
+
+    # (item, presentation order) counts: [item, 0] LLM description presented first, [item, 1] second
+    item_order_indexes = item_indexes * 2 + (comparison_arrays.llm_positions - 1)
+    valid_counts = np.bincount(item_order_indexes, weights=valid, minlength=item_count * 2).astype(np.int64).reshape(item_count, 2)
+    llm_win_counts = np.bincount(item_order_indexes, weights=llm_won, minlength=item_count * 2).astype(np.int64).reshape(item_count, 2)
+    invalid_counts = np.bincount(item_indexes, weights=~valid, minlength=item_count).astype(np.int64)
+
+    item_valid_counts = valid_counts.sum(axis=1)
+    item_llm_win_counts = llm_win_counts.sum(axis=1)
+    has_valid = item_valid_counts > 0
+    total_valid_counts = valid_counts.sum(axis=0)
+    total_llm_win_counts = llm_win_counts.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        item_llm_win_ratios = item_llm_win_counts / item_valid_counts
+        (llm_first_win_ratio, llm_second_win_ratio) = total_llm_win_counts / total_valid_counts
+        first_position_win_ratio = (total_llm_win_counts[0] + total_valid_counts[1] - total_llm_win_counts[1]) / total_valid_counts.sum()
+
+    if has_valid.any():
+        avg_llm_win_ratio = item_llm_win_ratios[has_valid].mean()
+        (avg_ci, first_position_ci, item_cis) = _bootstrap_cis(
+            valid_counts=valid_counts,
+            llm_win_counts=llm_win_counts,
+            bootstrap_sample_count=bootstrap_sample_count,
+            confidence=confidence,
+            rng=rng,
+        )
+    else:
+        logging.warning(f"Comparison arrays of {item_count} items have no valid results")
+        avg_llm_win_ratio = np.nan
+        avg_ci = first_position_ci = (np.nan, np.nan)
+        item_cis = np.full((2, item_count), np.nan)
+
+    stats_by_item: dict[str, ItemWinRatioStats] = {}
+    for (item_index, title) in enumerate(comparison_arrays.item_titles):
+        if item_valid_counts[item_index] + invalid_counts[item_index] == 0:
+            continue
+        stats_by_item[title] = ItemWinRatioStats(
+            llm_win_ratio=_to_optional_float(item_llm_win_ratios[item_index]),
+            llm_win_ratio_ci=_to_optional_ci(*item_cis[:, item_index]),
+            llm_wins=int(item_llm_win_counts[item_index]),
+            human_wins=int(item_valid_counts[item_index] - item_llm_win_counts[item_index]),
+            invalid=int(invalid_counts[item_index]),
+        )
+    return PermutationStats(
+        comparison_count=len(comparison_arrays.winners),
+        invalid_count=int((~valid).sum()),
+        stats_by_item=stats_by_item,
+        avg_llm_win_ratio=_to_optional_float(avg_llm_win_ratio),
+        avg_llm_win_ratio_ci=_to_optional_ci(*avg_ci),
+        llm_first_win_ratio=_to_optional_float(llm_first_win_ratio),
+        llm_second_win_ratio=_to_optional_float(llm_second_win_ratio),
+        first_position_win_ratio=_to_optional_float(first_position_win_ratio),
+        first_position_win_ratio_ci=_to_optional_ci(*first_position_ci),
+    )
+
+
+def analyze_comparison_permutations(
+    conn: sqlite3.Connection,
+    item_type: str,
+    permutations: list[ComparisonPermutation],
+    item_title_like: t.Optional[list[str]] = None,
+    description_count_limit: t.Optional[int] = None,
+    bootstrap_sample_count: int = DEFAULT_BOOTSTRAP_SAMPLE_COUNT,
+    confidence: float = DEFAULT_CONFIDENCE_LEVEL,
+    seed: t.Optional[int] = None,
+) -> dict[str, PermutationStats]:
+    """
+    Win ratio statistics with bootstrap confidence intervals of every permutation, keyed by
+    permutation label (see presentation.make_comparison_run_permutation_label). Descriptions are
+    loaded once for all permutations.
+    """
+    start = time.monotonic()
+    human_description_batches = load_all_human_description_batches(
+        item_type=item_type,
+        item_title_like=item_title_like,
+    )
+    item_titles = [human_description_batch.title for human_description_batch in human_description_batches]
+    human_descriptions_by_title = {
+        human_description_batch.title: [
+            description.uid for description in _make_descriptions_from_human_description_batch(human_description_batch)
+        ]
+        for human_description_batch in human_description_batches
+    }
+    llm_description_batches_by_title = load_llm_description_batches_by_title(
+        item_type=item_type,
+        llm_engines=list({permutation.description_llm_engine for permutation in permutations}),
+    )
+    loaded = time.monotonic()
+
+    rng = np.random.default_rng(seed)
+    stats_by_label: dict[str, PermutationStats] = {}
+    description_item_indexes: dict[tuple[Engine, str], DescriptionItemIndex] = {}
+    for permutation in permutations:
+        description_key = (permutation.description_llm_engine, permutation.description_prompt_key)
+        if description_key not in description_item_indexes:
+            description_item_indexes[description_key] = make_description_item_index(
+                item_titles=item_titles,
+                human_descriptions_by_title=human_descriptions_by_title,
+                llm_description_batches_by_title=llm_description_batches_by_title,
+                description_llm_engine=permutation.description_llm_engine,
+                description_prompt_key=permutation.description_prompt_key,
+                description_count_limit=description_count_limit,
+            )
+        comparison_arrays = load_comparison_arrays(
+            conn=conn,
+            permutation=permutation,
+            item_titles=item_titles,
+            description_item_index=description_item_indexes[description_key],
+        )
+        stats_by_label[permutation.make_label(item_type)] = compute_permutation_stats(
+            comparison_arrays=comparison_arrays,
+            bootstrap_sample_count=bootstrap_sample_count,
+            confidence=confidence,
+            rng=rng,
+        )
+    logging.info(
+        f"Computed stats of {len(permutations)} permutations over {len(item_titles)} {item_type} items"
+        + f" ({bootstrap_sample_count} bootstrap samples) in {time.monotonic() - start:.2f}s"
+        + f" ({loaded - start:.2f}s loading descriptions)"
+    )
+    return stats_by_label
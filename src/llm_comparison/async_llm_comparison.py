@@ -0,0 +1,440 @@
+import asyncio
+import json
+import logging
+import math
+import typing as t
+
+import langchain
+import pydantic
+from interlab.context import Context, StorageBase
+from interlab.lang_models.base import LangModelBase
+from interlab.lang_models.query_model import _prepare_model
+from interlab.queries.json_parsing import find_and_parse_json_block
+from interlab.queries.json_schema import get_json_schema, get_pydantic_model
+from interlab.queries.query_failure import ParsingFailure
+from interlab.queries.query_for_json import _FORMAT_PROMPT
+
+from llm_clients import get_llm_client, pooled_openai_aiohttp_session
+from llm_comparison import llm_comparison
+from llm_comparison.config import (ComparisonMode, ComparisonPromptConfig,
+                                   PromptLayout)
+from llm_comparison.early_stopping import (ItemEarlyStopping,
+                                           make_balanced_combo_pairs)
+from llm_comparison.llm_comparison import (
+    DEFAULT_STORAGE, Description, DescriptionBattleTally,
+    _find_stored_comparison_result, _get_chosen_description,
+    _make_batch_compare_context, _make_choice_analysis_prompt,
+    _make_choice_type, _make_compare_descriptions_context,
+    _extract_chosen_description_locally,
+    _make_comparison_prompt, _make_verdict_type,
+    add_winner_to_battle_tally, load_item_comparison_descriptions,
+    make_empty_battle_tally, make_ordered_combos,
+    open_comparison_storage_db, record_item_battle_tally)
+from llm_descriptions_generator.file_io import (
+    load_all_human_description_batches, load_llm_description_batches_by_title)
+from llm_descriptions_generator.schema import (Engine,
+                                               HumanTextItemDescriptionBatch)
+from response_cache import (dump_json_result, get_response_cache,
+                            load_json_result, log_response_cache_stats,
+                            make_response_cache_key)
+
+if t.TYPE_CHECKING:
+    from llm_comparison.comparison_storage import ComparisonStorageDb
+
+async def _call_llm_model(llm_model: t.Any, prompt: str, conf: dict[str, t.Any], call: t.Callable[[str], str]) -> str:
+    if isinstance(llm_model, langchain.chat_models.base.BaseChatModel):
+        message = await llm_model.apredict_messages([langchain.schema.HumanMessage(content=prompt)])
+        return message.content
+    if isinstance(llm_model, LangModelBase) and hasattr(llm_model, "_aquery"):
+        return await llm_model._aquery(prompt, conf)
+    # no native async support, so at least don't block the event loop
+    return await asyncio.to_thread(call, prompt)
+
+
+async def async_query_model(llm_model: t.Any, prompt: str) -> str:
+    """
+    Async counterpart of interlab's `query_model` (which only supports blocking calls),
+    logging the same "query" Context. Requests are throttled by the models' provider rate limiters.
+    """
+    (name, conf, call) = _prepare_model(llm_model)
+    with Context(name, kind="query", inputs=dict(prompt=prompt, conf=conf)) as c:
+        result = await _call_llm_model(llm_model, prompt, conf, call)
+        assert isinstance(result, str)
+        c.set_result(result)
+        return result
+
+
+async def async_query_for_json(
+    llm_model: t.Any,
+    T: type,
+    prompt: str,
+    max_repeats: int = 5,
+) -> t.Any:
+    """
+    Async counterpart of interlab's `query_for_json` (without the example and CoT options, which we don't use).
+    """
+    if "{FORMAT_PROMPT}" not in prompt:
+        prompt += "\n\n{FORMAT_PROMPT}"
+    pdT = get_pydantic_model(T)
+    schema = get_json_schema(pdT)
+    prompt_with_fmt = prompt.replace("{FORMAT_PROMPT}", _FORMAT_PROMPT.format(schema=schema, deliberation=""))
+
+    with Context(
+        f"query for JSON of type {T}",
+        kind="query",
+        inputs=dict(
+            prompt=prompt,
+            with_example=False,
+            with_cot=False,
+            max_repeats=max_repeats,
+            T=str(T),
+        ),
+    ) as c:
+        for i in range(max_repeats):
+            res = await async_query_model(llm_model, prompt_with_fmt)
+            try:
+                d = find_and_parse_json_block(res)
+                d = pdT(**d)
+                d = T(**d.dict())
+                c.set_result(d)
+                return d
+            except (ValueError, pydantic.ValidationError) as e:
+                if i < max_repeats - 1:
+                    continue
+                raise ParsingFailure(
+                    f"model repeatedly returned a response without a valid JSON instance of {T.__class__.__name__}"
+                ) from e
+
+
+async def async_cached_query_model(
+    llm_engine: Engine,
+    llm_model: t.Any,
+    prompt: str,
+) -> str:
+    """Async counterpart of `response_cache.cached_query_model`."""
+    cache = get_response_cache()
+    if cache is None:
+        return await async_query_model(llm_model, prompt)
+    key = make_response_cache_key(llm_engine, llm_model, prompt)
+    cached_response = await asyncio.to_thread(cache.get, key)
+    if cached_response is not None:
+        return cached_response
+    response = await async_query_model(llm_model, prompt)
+    await asyncio.to_thread(cache.put, key, response)
+    return response
+
+
+async def async_cached_query_for_json(
+    llm_engine: Engine,
+    llm_model: t.Any,
+    T: type,
+    prompt: str,
+) -> t.Any:
+    """Async counterpart of `response_cache.cached_query_for_json`."""
+    cache = get_response_cache()
+    if cache is None:
+        return await async_query_for_json(llm_model, T, prompt)
+    key = make_response_cache_key(llm_engine, llm_model, prompt, T=T)
+    cached_response = await asyncio.to_thread(cache.get, key)
+    if cached_response is not None:
+        return load_json_result(T, cached_response)
+    result = await async_query_for_json(llm_model, T, prompt)
+    await asyncio.to_thread(cache.put, key, dump_json_result(result))
+    return result
+
+
+async def compare_descriptions(
+    llm_engine: Engine,
+    comparison_prompt_config: ComparisonPromptConfig,
+    description_1: Description,
+    description_2: Description,
+    storage: StorageBase = DEFAULT_STORAGE,
+    comparison_prompt_addendum: t.Optional[str] = None,
+    comparison_storage_db: t.Optional["ComparisonStorageDb"] = None,
+) -> t.Optional[Description]:
+    """
+    Async version of `llm_comparison.compare_descriptions`, with identical prompts, caching and result storage.
+    """
+    from . import comparison_storage # Prevents a circular import
+
+    # NOTE: DB lookups are in-memory (preloaded) in the common case; the Context cache
+    # fallback may hit the disk, so run it off the event loop
+    (found, stored_result) = await asyncio.to_thread(
+        _find_stored_comparison_result,
+        llm_engine=llm_engine,
+        comparison_prompt_config=comparison_prompt_config,
+        description_1=description_1,
+        description_2=description_2,
+        comparison_storage_db=comparison_storage_db,
+    )
+    if found:
+        return stored_result
+
+    with _make_compare_descriptions_context(
+        llm_engine=llm_engine,
+        comparison_prompt_config=comparison_prompt_config,
+        description_1=description_1,
+        description_2=description_2,
+        storage=storage,
+    ) as ctx:
+        (prompt, descriptions_by_int_id) = _make_comparison_prompt(
+            comparison_prompt_config=comparison_prompt_config,
+            description_1=description_1,
+            description_2=description_2,
+            comparison_prompt_addendum=comparison_prompt_addendum,
+        )
+        llm_model = get_llm_client(llm_engine)
+        if comparison_prompt_config.comparison_mode == ComparisonMode.Structured:
+            Verdict = _make_verdict_type(comparison_prompt_config, descriptions_by_int_id)
+            choice_analysis_result = await async_cached_query_for_json(llm_engine, llm_model, Verdict, prompt)
+            logging.debug(f"Structured verdict - data response: {repr(choice_analysis_result)[:60]!r}[...]")
+            chosen_description = _get_chosen_description(
+                choice_analysis_result.answer,
+                descriptions_by_int_id,
+            )
+        else:
+            choice_answer = await async_cached_query_model(llm_engine, llm_model, prompt)
+            logging.debug(f"Initial choice prompt - prose response: {choice_answer[:50]!r}[...]")
+
+            # skip the choice analysis query if the answer plainly names a single ID
+            chosen_description = _extract_chosen_description_locally(ctx, choice_answer, descriptions_by_int_id)
+            if chosen_description is None:
+                Choice = _make_choice_type(descriptions_by_int_id)
+                choice_analysis_result = await async_cached_query_for_json(
+                    llm_engine,
+                    llm_model,
+                    Choice,
+                    _make_choice_analysis_prompt(comparison_prompt_config, choice_answer),
+                )
+                logging.debug(f"Choice analysis prompt result - data response: {repr(choice_analysis_result)[:60]!r}[...]")
+                chosen_description = _get_chosen_description(
+                    choice_analysis_result.answer,
+                    descriptions_by_int_id,
+                )
+
+        ctx.set_result(chosen_description)
+
+        assert chosen_description == description_1 or chosen_description == description_2 or chosen_description is None
+        comparison_storage.db_set_comparison(
+            comparison_storage_db,
+            llm_engine,
+            comparison_prompt_config,
+            description_1,
+            description_2,
+            chosen_description
+        )
+        return chosen_description
+
+
+def _make_compare_lists_context(
+    llm_engine: Engine,
+    comparison_prompt_config: ComparisonPromptConfig,
+    storage: StorageBase,
+) -> Context:
+    return Context(
+        name="compare_lists_for_one_item",
+        inputs={
+            "llm_engine": llm_engine,
+            "comparison_prompt_config": comparison_prompt_config.__dict__,
+        },
+        storage=storage,
+        tags=[f"engine:{llm_engine}"],
+        directory=True,
+    )
+
+
+async def compare_description_lists_for_one_item(
+    llm_engine: Engine,
+    comparison_prompt_config: ComparisonPromptConfig,
+    description_list_1: list[Description],
+    description_list_2: list[Description],
+    storage: StorageBase = DEFAULT_STORAGE,
+    comparison_prompt_addendum: t.Optional[str] = None,
+    comparison_storage_db: t.Optional["ComparisonStorageDb"] = None,
+) -> tuple[list[t.Optional[Description]], DescriptionBattleTally]:
+    """
+    Compares all possible ordered combinations of one Description from list 1 vs one Description from list 2,
+    running every comparison concurrently (bounded by the per-provider rate limiters).
+    """
+    with _make_compare_lists_context(
+        llm_engine=llm_engine,
+        comparison_prompt_config=comparison_prompt_config,
+        storage=storage,
+    ) as ctx:
+        ordered_combos = make_ordered_combos(description_list_1, description_list_2)
+
+        def compare_combo(d1: Description, d2: Description) -> t.Awaitable[t.Optional[Description]]:
+            return compare_descriptions(
+                llm_engine=llm_engine,
+                comparison_prompt_config=comparison_prompt_config,
+                description_1=d1,
+                description_2=d2,
+                storage=storage,
+                comparison_prompt_addendum=comparison_prompt_addendum,
+                comparison_storage_db=comparison_storage_db,
+            )
+
+        async def compare_combos(
+            combos: list[tuple[Description, Description]],
+            warm_up: bool,
+        ) -> list[t.Optional[Description]]:
+            winners: list[t.Optional[Description]] = []
+            if warm_up and combos:
+                # the first comparison alone gets the item's shared prompt prefix cached, the rest reuse it
+                winners.append(await compare_combo(*combos[0]))
+                combos = combos[1:]
+            winners += await asyncio.gather(*[compare_combo(d1, d2) for (d1, d2) in combos])
+            return winners
+
+        warm_up = comparison_prompt_config.prompt_layout == PromptLayout.SharedContextFirst
+        early_stopping_config = llm_comparison.EARLY_STOPPING
+        battle_tally = make_empty_battle_tally()
+        if early_stopping_config:
+            # enough pairs (both presentation orders) for the minimum comparison count at once,
+            # then one pair at a time until the tally is clear enough
+            combo_pairs = make_balanced_combo_pairs(description_list_1, description_list_2)
+            item_early_stopping = ItemEarlyStopping(early_stopping_config, pair_count=len(combo_pairs))
+            first_round_pair_count = max(1, math.ceil(early_stopping_config.min_comparisons / 2))
+            combo_pair_rounds = [combo_pairs[:first_round_pair_count]] + [
+                [combo_pair] for combo_pair in combo_pairs[first_round_pair_count:]
+            ]
+            winning_descriptions: list[t.Optional[Description]] = []
+            for (round_index, combo_pair_round) in enumerate(combo_pair_rounds):
+                if item_early_stopping.stopped:
+                    item_early_stopping.add_skipped(
+                        battle_tally,
+                        2 * sum(len(later_round) for later_round in combo_pair_rounds[round_index:]),
+                    )
+                    logging.info(f"# Stopped early, {item_early_stopping.skipped_count}/{len(ordered_combos)} comparisons skipped")
+                    break
+                round_combos = [combo for combo_pair in combo_pair_round for combo in combo_pair]
+                round_winners = await compare_combos(round_combos, warm_up=warm_up and round_index == 0)
+                for ((d1, d2), winner) in zip(round_combos, round_winners):
+                    item_early_stopping.add_result(d1.uid, d2.uid, str(winner.origin) if winner else None)
+                winning_descriptions += round_winners
+        else:
+            winning_descriptions = await compare_combos(ordered_combos, warm_up=warm_up)
+        for winner in winning_descriptions:
+            add_winner_to_battle_tally(battle_tally, winner)
+        logging.info(f"# Comparison completed for {len(winning_descriptions)} pairs")
+
+        ctx.set_result((winning_descriptions, battle_tally))
+        return (winning_descriptions, battle_tally)
+
+
+async def compare_saved_description_batches(
+    comparison_llm_engine: Engine,
+    comparison_prompt_config: ComparisonPromptConfig,
+    item_type: str,
+    description_llm_engine: Engine,
+    description_prompt_key: t.Optional[str] = None,
+    item_title_like: t.Optional[list[str]] = None,
+    storage: StorageBase = DEFAULT_STORAGE,
+    description_count_limit: t.Optional[int] = None,
+) -> tuple[dict[str, DescriptionBattleTally], DescriptionBattleTally]:
+    """
+    Async version of `llm_comparison.compare_saved_description_batches`: all items are compared
+    concurrently, with only the per-provider rate limiters (see `rate_limiter.py`) throttling the LLM calls.
+    """
+    # one keep-alive connection pool for all the concurrent OpenAI API requests
+    async with pooled_openai_aiohttp_session():
+        comparison_storage_db = await asyncio.to_thread(
+            open_comparison_storage_db,
+            storage=storage,
+            comparison_llm_engine=comparison_llm_engine,
+            comparison_prompt_config=comparison_prompt_config,
+        )
+
+        with _make_batch_compare_context(
+            comparison_llm_engine=comparison_llm_engine,
+            comparison_prompt_config=comparison_prompt_config,
+            item_type=item_type,
+            description_llm_engine=description_llm_engine,
+            description_prompt_key=description_prompt_key,
+            item_title_like=item_title_like,
+            storage=storage,
+        ) as ctx:
+
+            human_description_batches = await asyncio.to_thread(
+                load_all_human_description_batches,
+                item_type=item_type,
+                item_title_like=item_title_like,
+            )
+            llm_description_batches_by_title = await asyncio.to_thread(
+                load_llm_description_batches_by_title,
+                item_type=item_type,
+                llm_engines=[description_llm_engine],
+                prompt_nickname=description_prompt_key,
+            )
+
+            tallies_by_item_title: dict[str, DescriptionBattleTally] = {}
+
+            total_tally = make_empty_battle_tally()
+
+            async def run_comparisons_for_human_description_batch(
+                human_description_batch: HumanTextItemDescriptionBatch,
+            ) -> tuple[str, list[t.Optional[Description]], DescriptionBattleTally]:
+                title = human_description_batch.title
+                item_comparison_descriptions = await asyncio.to_thread(
+                    load_item_comparison_descriptions,
+                    human_description_batch=human_description_batch,
+                    item_type=item_type,
+                    comparison_prompt_config=comparison_prompt_config,
+                    description_llm_engine=description_llm_engine,
+                    description_prompt_key=description_prompt_key,
+                    description_count_limit=description_count_limit,
+                    llm_description_batches_by_title=llm_description_batches_by_title,
+                )
+                if item_comparison_descriptions is None:
+                    return (title, [], {"Invalid": 0})
+                (human_descriptions, llm_descriptions, comparison_prompt_addendum) = item_comparison_descriptions
+
+                try:
+                    (winners, battle_tally) = await compare_description_lists_for_one_item(
+                        llm_engine=comparison_llm_engine,
+                        comparison_prompt_config=comparison_prompt_config,
+                        storage=storage,
+                        description_list_1=human_descriptions,
+                        description_list_2=llm_descriptions,
+                        comparison_prompt_addendum=comparison_prompt_addendum,
+                        comparison_storage_db=comparison_storage_db,
+                    )
+                except Exception as exc:
+                    logging.error(f"Error processing item '{title}': {exc}", exc_info=True)
+                    raise exc
+                return (title, winners, battle_tally)
+
+            completed_count = 0
+            total_count = len(human_description_batches)
+            for next_completed in asyncio.as_completed([
+                run_comparisons_for_human_description_batch(human_description_batch)
+                for human_description_batch in human_description_batches
+            ]):
+                (title, winners, battle_tally) = await next_completed
+                completed_count += 1
+                record_item_battle_tally(
+                    title=title,
+                    battle_tally=battle_tally,
+                    tallies_by_item_title=tallies_by_item_title,
+                    total_tally=total_tally,
+                    log_details={
+                        "item_type": item_type,
+                        "description_llm_engine": description_llm_engine,
+                        "description_prompt_key": description_prompt_key,
+                        "comparison_llm_engine": comparison_llm_engine,
+                        "comparison_prompt_key": comparison_prompt_config.prompt_key,
+                    },
+                )
+                logging.info(f"=== COMPARISON BATCHES COMPLETED: {completed_count}/{total_count} ===")
+
+            await asyncio.to_thread(comparison_storage_db.flush)
+            log_response_cache_stats()
+
+            logging.info("-----tallies_by_item_title-----")
+            logging.info(json.dumps(tallies_by_item_title, indent=4))
+            logging.info("-----total_tally-----")
+            logging.info(json.dumps(total_tally, indent=4))
+
+            ctx.set_result((tallies_by_item_title, total_tally))
+
+            return (tallies_by_item_title, total_tally)
@@ -0,0 +1,277 @@
+import logging
+import random
+import typing as t
+from pathlib import Path
+
+from interlab.context import StorageBase
+
+import llm_batch
+from llm_comparison import comparison_storage
+from llm_comparison.choice_extraction import extract_choice_id
+from llm_comparison.config import (ComparisonMode, ComparisonPromptConfig,
+                                   get_comparison_prompt_config)
+from llm_comparison.llm_comparison import (
+    COMPARISON_STORAGE_DB_FILENAME, DEFAULT_STORAGE, Description,
+    _find_stored_comparison_result, _get_chosen_description,
+    _make_choice_analysis_prompt, _make_choice_type, _make_comparison_prompt,
+    _make_verdict_type, load_item_comparison_descriptions,
+    make_ordered_combos, open_comparison_storage_db)
+from llm_comparison import llm_comparison
+from llm_descriptions_generator.file_io import (
+    load_all_human_description_batches, load_llm_description_batches_by_title,
+    standardize_for_filepath)
+from llm_descriptions_generator.schema import Engine
+
+# Batch (offline) counterpart of compare_saved_description_batches, see llm_batch.py.
+#
+# Structured-mode comparisons take a single request each. Two-step comparisons first get the
+# prose answer; answers that can't be resolved locally (see choice_extraction.py) are written
+# to follow-up choice analysis shards on ingest, to be submitted and ingested in turn.
+
+COMPARISON_CUSTOM_ID_PREFIX = "cmp"
+CHOICE_ANALYSIS_CUSTOM_ID_PREFIX = "choice"
+CHOICE_ANALYSIS_SHARD_NAME_PREFIX = "choice-analysis"
+
+
+def make_comparison_batch_dirpath(
+    comparison_llm_engine: Engine,
+    comparison_prompt_config: ComparisonPromptConfig,
+) -> Path:
+    return (
+        llm_batch.BATCH_REQUESTS_DIR
+        / "comparisons"
+        / standardize_for_filepath(comparison_llm_engine.value)
+        / standardize_for_filepath(comparison_prompt_config.prompt_key)
+    )
+
+
+def _make_comparison_batch_request(
+    comparison_llm_engine: Engine,
+    comparison_prompt_config: ComparisonPromptConfig,
+    description_1: Description,
+    description_2: Description,
+    comparison_prompt_addendum: t.Optional[str],
+) -> llm_batch.BatchRequest:
+    custom_id = llm_batch.make_custom_id(
+        COMPARISON_CUSTOM_ID_PREFIX,
+        comparison_llm_engine.value,
+        comparison_prompt_config.prompt_key,
+        description_1.uid,
+        description_2.uid,
+    )
+    # seeded by the custom ID, so re-preparing a pending comparison gives the exact same prompt
+    (prompt, descriptions_by_int_id) = _make_comparison_prompt(
+        comparison_prompt_config=comparison_prompt_config,
+        description_1=description_1,
+        description_2=description_2,
+        comparison_prompt_addendum=comparison_prompt_addendum,
+        rng=random.Random(custom_id),
+    )
+    if comparison_prompt_config.comparison_mode == ComparisonMode.Structured:
+        Verdict = _make_verdict_type(comparison_prompt_config, descriptions_by_int_id)
+        prompt = llm_batch.make_json_query_prompt(Verdict, prompt)
+    return llm_batch.BatchRequest(
+        custom_id=custom_id,
+        engine=comparison_llm_engine,
+        prompt=prompt,
+        metadata={
+            "kind": "comparison",
+            # 1 or 2, the `winner` value to store when the integer ID is chosen
+            "description_index_by_int_id": {
+                int_id: (1 if description == description_1 else 2)
+                for (int_id, description) in descriptions_by_int_id.items()
+            },
+            "row": comparison_storage.make_comparison_row(
+                comparison_llm_engine,
+                comparison_prompt_config,
+                description_1,
+                description_2,
+                winner_index=0,
+            ),
+        },
+    )
+
+
+def prepare_comparison_batch_requests(
+    comparison_llm_engine: Engine,
+    comparison_prompt_config: ComparisonPromptConfig,
+    item_type: str,
+    description_llm_engine: Engine,
+    description_prompt_key: t.Optional[str] = None,
+    item_title_like: t.Optional[list[str]] = None,
+    storage: StorageBase = DEFAULT_STORAGE,
+    description_count_limit: t.Optional[int] = None,
+    dirpath: t.Optional[Path] = None,
+) -> list[Path]:
+    """
+    Writes every comparison `compare_saved_description_batches` would still have to query
+    (i.e. not found in the result storage) to batch request shards. Returns the new shard paths.
+    """
+    dirpath = dirpath or make_comparison_batch_dirpath(comparison_llm_engine, comparison_prompt_config)
+    comparison_storage_db = open_comparison_storage_db(
+        storage=storage,
+        comparison_llm_engine=comparison_llm_engine,
+        comparison_prompt_config=comparison_prompt_config,
+    )
+    human_description_batches = load_all_human_description_batches(
+        item_type=item_type,
+        item_title_like=item_title_like,
+    )
+    llm_description_batches_by_title = load_llm_description_batches_by_title(
+        item_type=item_type,
+        llm_engines=[description_llm_engine],
+        prompt_nickname=description_prompt_key,
+    )
+    counts = {"stored": 0, "pending": 0}
+
+    def iter_pending_comparison_requests() -> t.Iterator[llm_batch.BatchRequest]:
+        for human_description_batch in human_description_batches:
+            item_comparison_descriptions = load_item_comparison_descriptions(
+                human_description_batch=human_description_batch,
+                item_type=item_type,
+                comparison_prompt_config=comparison_prompt_config,
+                description_llm_engine=description_llm_engine,
+                description_prompt_key=description_prompt_key,
+                description_count_limit=description_count_limit,
+                llm_description_batches_by_title=llm_description_batches_by_title,
+            )
+            if item_comparison_descriptions is None:
+                continue
+            (human_descriptions, llm_descriptions, comparison_prompt_addendum) = item_comparison_descriptions
+            for (description_1, description_2) in make_ordered_combos(human_descriptions, llm_descriptions):
+                (found, _) = _find_stored_comparison_result(
+                    llm_engine=comparison_llm_engine,
+                    comparison_prompt_config=comparison_prompt_config,
+                    description_1=description_1,
+                    description_2=description_2,
+                    comparison_storage_db=comparison_storage_db,
+                )
+                if found:
+                    counts["stored"] += 1
+                    continue
+                counts["pending"] += 1
+                yield _make_comparison_batch_request(
+                    comparison_llm_engine=comparison_llm_engine,
+                    comparison_prompt_config=comparison_prompt_config,
+                    description_1=description_1,
+                    description_2=description_2,
+                    comparison_prompt_addendum=comparison_prompt_addendum,
+                )
+
+    shard_paths = llm_batch.write_request_shards(dirpath, iter_pending_comparison_requests())
+    # results found in the Context cache fallback were written to the DB
+    comparison_storage_db.flush()
+    logging.info(f"Comparisons already stored: {counts['stored']}, pending: {counts['pending']}, new shards: {len(shard_paths)} (in {dirpath})")
+    return shard_paths
+
+
+def _make_choice_analysis_batch_request(
+    entry: dict[str, t.Any],
+    comparison_prompt_config: ComparisonPromptConfig,
+    choice_answer: str,
+) -> llm_batch.BatchRequest:
+    Choice = _make_choice_type(entry["description_index_by_int_id"])
+    return llm_batch.BatchRequest(
+        custom_id=llm_batch.make_custom_id(CHOICE_ANALYSIS_CUSTOM_ID_PREFIX, entry["custom_id"]),
+        engine=Engine(entry["llm_engine"]),
+        prompt=llm_batch.make_json_query_prompt(
+            Choice,
+            _make_choice_analysis_prompt(comparison_prompt_config, choice_answer),
+        ),
+        metadata={
+            "kind": "choice_analysis",
+            "description_index_by_int_id": entry["description_index_by_int_id"],
+            "row": entry["row"],
+        },
+    )
+
+
+def _get_winner_index_from_json_response(
+    T: type,
+    response_text: str,
+    description_index_by_int_id: dict[str, int],
+) -> t.Optional[int]:
+    """Returns 1 or 2 for the winner, 0 for no valid choice, or None if the response isn't valid JSON."""
+    parsed = llm_batch.parse_json_response(T, response_text)
+    if parsed is None:
+        return None
+    # NOTE: looks up the winner index the same way as the chosen description in the interactive path
+    return _get_chosen_description(parsed.answer, description_index_by_int_id) or 0
+
+
+def ingest_comparison_batch_results(
+    dirpath: Path,
+    storage: StorageBase = DEFAULT_STORAGE,
+) -> dict[str, int]:
+    """
+    Stores the results of every downloaded, not yet ingested shard in `dirpath` in the comparison
+    results DB. Failed or unparseable requests are left pending (a later prepare will request them
+    again). Returns counts of what happened to the results.
+    """
+    comparison_storage_db = comparison_storage.get_comparison_storage_db(
+        Path(storage.directory) / COMPARISON_STORAGE_DB_FILENAME
+    )
+    counts = {"stored": 0, "failed": 0, "unparseable": 0, "choice_analysis_needed": 0}
+    choice_analysis_requests: list[llm_batch.BatchRequest] = []
+
+    for requests_filepath in llm_batch.get_shard_paths(dirpath):
+        if llm_batch.is_shard_ingested(requests_filepath):
+            continue
+        # results are only saved once the whole download went through
+        if not llm_batch.is_shard_downloaded(requests_filepath):
+            continue
+        shard_stored_count = 0
+        for (entry, response_text) in llm_batch.iter_shard_results(requests_filepath):
+            if response_text is None:
+                counts["failed"] += 1
+                continue
+            row = entry["row"]
+            description_index_by_int_id = entry["description_index_by_int_id"]
+            comparison_prompt_config = get_comparison_prompt_config(
+                item_type=row["item_type"],
+                prompt_key=row["comparison_prompt_key"],
+            )
+
+            if entry["kind"] == "choice_analysis":
+                winner_index = _get_winner_index_from_json_response(
+                    _make_choice_type(description_index_by_int_id),
+                    response_text,
+                    description_index_by_int_id,
+                )
+            elif comparison_prompt_config.comparison_mode == ComparisonMode.Structured:
+                winner_index = _get_winner_index_from_json_response(
+                    _make_verdict_type(comparison_prompt_config, description_index_by_int_id),
+                    response_text,
+                    description_index_by_int_id,
+                )
+            else:
+                chosen_int_id = (
+                    extract_choice_id(response_text, list(description_index_by_int_id.keys()))
+                    if llm_comparison.LOCAL_CHOICE_EXTRACTION else None
+                )
+                if chosen_int_id is None:
+                    counts["choice_analysis_needed"] += 1
+                    choice_analysis_requests.append(
+                        _make_choice_analysis_batch_request(entry, comparison_prompt_config, response_text)
+                    )
+                    continue
+                winner_index = description_index_by_int_id[chosen_int_id]
+
+            if winner_index is None:
+                counts["unparseable"] += 1
+                continue
+            comparison_storage_db.enqueue({**row, "winner": winner_index})
+            shard_stored_count += 1
+        counts["stored"] += shard_stored_count
+        llm_batch.mark_shard_ingested(requests_filepath, shard_stored_count)
+        logging.info(f"Ingested {shard_stored_count} comparison results from {requests_filepath.name}")
+
+    if choice_analysis_requests:
+        llm_batch.write_request_shards(
+            dirpath,
+            choice_analysis_requests,
+            shard_name_prefix=CHOICE_ANALYSIS_SHARD_NAME_PREFIX,
+        )
+    comparison_storage_db.flush()
+    logging.info(f"Comparison batch results ingested from {dirpath}: {counts}")
+    return counts
@@ -0,0 +1,104 @@
+import re
+import typing as t
+
+# Local (no LLM call) extraction of the chosen item ID from a free-text comparison answer.
+# Deliberately conservative: anything that isn't a plain, single, non-negated choice is left
+# to the LLM-based choice analysis step.
+
+# At most this many characters (within one sentence) between a choice phrase and the ID it refers to
+MAX_CHOICE_PHRASE_GAP = 80
+NEGATION_LOOKBEHIND_CHARS = 25
+# A choice phrase and its ID must be in the same clause: none of these may come between them
+CLAUSE_GAP_CHARS = r"[^.!?\n,;]"
+CLAUSE_BREAK_PATTERN = re.compile(
+    r"\b(?:but|while|whereas|although|though|however|unlike|which|whose|yet)\b",
+    re.IGNORECASE,
+)
+
+CHOICE_VERBS = r"(?:recommend(?:ing|ed)?|choos(?:e|ing)|chose|select(?:ing|ed)?|pick(?:ing|ed)?|prefer(?:ring|red)?|go(?:ing)? with|opt(?:ing)? for|(?:better|best|final|my) (?:choice|option|pick)|winner|answer)"
+VERDICT_AFTER_ID = rf"(?:is|seems|would be|as)\b{CLAUSE_GAP_CHARS}{{0,30}}?\b(?:better|best|stronger|superior|preferred|preferable|recommended|more (?:appropriate|suitable|compelling|effective|informative)|winner|choice)"
+NEGATIONS_PATTERN = re.compile(r"\b(?:not|never|no|nor|neither|rather than|instead of|over|against)\b|n't\b", re.IGNORECASE)
+# Answers declaring these (ties, either/neither, conditional "if you prefer X..." advice)
+# are left to the LLM, even if they happen to mention a single ID
+AMBIGUITY_PATTERN = re.compile(
+    r"\b(?:neither|either|tie|tied|toss-up|flip a coin|equally|subjective|personal preference|depends? on|if you|"
+    r"(?:cannot|can't|can not|unable to|difficult to|hard to) (?:decide|choose|pick|select|recommend)|"
+    r"no clear|not possible to (?:decide|choose))\b",
+    re.IGNORECASE,
+)
+
+
+def _id_pattern(int_id: str) -> str:
+    return rf"(?<!\d){re.escape(int_id)}(?!\d)"
+
+
+def _is_negated(text: str, match: re.Match, id_start: int) -> bool:
+    before = text[max(0, match.start() - NEGATION_LOOKBEHIND_CHARS):match.start()]
+    within = text[match.start():id_start]
+    return bool(NEGATIONS_PATTERN.search(before) or NEGATIONS_PATTERN.search(within))
+
+
+def _is_other_clause(gap_text: str, other_ids: t.Sequence[str]) -> bool:
+    """Whether the text between a choice phrase and its ID starts another clause or names another ID."""
+    if CLAUSE_BREAK_PATTERN.search(gap_text):
+        return True
+    return any(re.search(_id_pattern(other_id), gap_text) for other_id in other_ids)
+
+
+def _iter_overlapping_matches(pattern: re.Pattern, text: str) -> t.Iterator[re.Match]:
+    # unlike finditer, a match skipped for spanning clauses doesn't hide a later one inside it
+    match = pattern.search(text)
+    while match:
+        yield match
+        match = pattern.search(text, match.start() + 1)
+
+
+def _has_positive_choice(text: str, int_id: str, other_ids: t.Sequence[str]) -> bool:
+    choice_before_id = re.compile(
+        rf"\b{CHOICE_VERBS}\b{CLAUSE_GAP_CHARS}{{0,{MAX_CHOICE_PHRASE_GAP}}}?{_id_pattern(int_id)}",
+        re.IGNORECASE,
+    )
+    for match in _iter_overlapping_matches(choice_before_id, text):
+        id_start = match.end() - len(int_id)
+        if _is_other_clause(text[match.start():id_start], other_ids):
+            continue
+        if not _is_negated(text, match, id_start):
+            return True
+    verdict_after_id = re.compile(rf"{_id_pattern(int_id)}{CLAUSE_GAP_CHARS}{{0,40}}?\b{VERDICT_AFTER_ID}\b", re.IGNORECASE)
+    for match in _iter_overlapping_matches(verdict_after_id, text):
+        verdict_text = text[match.start() + len(int_id):match.end()]
+        if _is_other_clause(verdict_text, other_ids):
+            continue
+        before = text[max(0, match.start() - NEGATION_LOOKBEHIND_CHARS):match.start()]
+        if not NEGATIONS_PATTERN.search(verdict_text) and not NEGATIONS_PATTERN.search(before):
+            return True
+    return False
+
+
+def extract_choice_id(text: str, int_ids: t.Sequence[str]) -> t.Optional[str]:
+    """
+    Returns the one ID in `int_ids` that `text` unambiguously chooses, or None if the choice is unclear
+    (no ID, several IDs chosen, negations, "both"/"neither", ties...).
+    """
+    if AMBIGUITY_PATTERN.search(text):
+        return None
+
+    chosen_ids = [
+        int_id for int_id in int_ids
+        if _has_positive_choice(text, int_id, [other_id for other_id in int_ids if other_id != int_id])
+    ]
+    if len(chosen_ids) == 1:
+        return chosen_ids[0]
+    if chosen_ids:
+        return None
+
+    # no explicit choice phrase: accept a bare answer that mentions exactly one ID, once, without negations
+    mentioned_ids = [int_id for int_id in int_ids if re.search(_id_pattern(int_id), text)]
+    if (
+        len(mentioned_ids) == 1
+        and len(re.findall(_id_pattern(mentioned_ids[0]), text)) == 1
+        and not NEGATIONS_PATTERN.search(text)
+        and not re.search(r"\bboth\b", text, re.IGNORECASE)
+    ):
+        return mentioned_ids[0]
+    return None
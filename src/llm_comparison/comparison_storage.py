@@ -11,11 +11,18 @@
 #
 # The data is then just
 # * winner (1, 2, or 0 for None/Invalid)
+#
+# Per-collection counts are kept in comparison_results_summary (see SUMMARY_TRIGGERS).
 
+import atexit
 import functools
+import getpass
 import logging
 import os
+import queue
 import sqlite3
+import threading
+import time
 import typing as t
 from pathlib import Path
 
@@ -23,6 +30,11 @@ from llm_comparison.config import ComparisonPromptConfig
 from llm_comparison.llm_comparison import Description
 from llm_descriptions_generator.schema import Engine, Origin
 
+SQLITE_TIMEOUT_SECONDS = 30
+WRITER_BATCH_SIZE = 200
+WRITER_BATCH_INTERVAL_MS = 250
+WRITER_MAX_ATTEMPTS = 5
+
 SQLITE_SCHEMA = [
     """
 CREATE TABLE IF NOT EXISTS comparison_results (
@@ -40,6 +52,11 @@ CREATE TABLE IF NOT EXISTS comparison_results (
     -- NB: these are only defined for LLM-Human comparisons, not between 2 LLMs
     description_llm_engine TEXT,
     description_prompt_key TEXT,
+    -- "two_step" or "structured" (see ComparisonMode), NULL for results stored before modes existed (all two-step)
+    comparison_mode TEXT,
+    -- 1 or 2 for the LLM description of an LLM-Human comparison, NULL between 2 LLMs or for results stored before
+    -- positions were (see db_backfill_llm_positions)
+    llm_position INTEGER,
     -- Automatically added
     created_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     created_user TEXT,
@@ -51,50 +68,534 @@ CREATE UNIQUE INDEX IF NOT EXISTS comparison_results_index ON comparison_results
     description_uid_1, description_uid_2, comparison_llm_engine, comparison_prompt_key
 );
 """,
+    """
+CREATE INDEX IF NOT EXISTS comparison_results_engine_prompt_index ON comparison_results (
+    comparison_llm_engine, comparison_prompt_key
+);
+""",
+]
+
+# Result counts per collection, kept up to date by the triggers below on every write to
+# comparison_results (including manual cleaning), so stats don't need to scan the results.
+# NULL collection columns are stored as '' (NULLs would never match the UNIQUE constraint).
+SUMMARY_COLLECTION_COLUMNS = [
+    "description_llm_engine",
+    "description_prompt_key",
+    "item_type",
+    "comparison_prompt_key",
+    "comparison_llm_engine",
+]
+
+SUMMARY_SCHEMA = f"""
+CREATE TABLE comparison_results_summary (
+    {", ".join(f"{column} TEXT NOT NULL" for column in SUMMARY_COLLECTION_COLUMNS)},
+    total INTEGER NOT NULL DEFAULT 0,
+    invalid INTEGER NOT NULL DEFAULT 0,
+    -- valid results of LLM-Human comparisons, by origin of the winner (see llm_position)
+    llm_wins INTEGER NOT NULL DEFAULT 0,
+    human_wins INTEGER NOT NULL DEFAULT 0,
+    UNIQUE({", ".join(SUMMARY_COLLECTION_COLUMNS)})
+);"""
+
+
+def _make_summary_counts_sql(row_alias: str) -> str:
+    """total, invalid, llm_wins, human_wins of one comparison_results row (NEW, OLD or a table alias)."""
+    return (
+        f"1, {row_alias}.winner = 0,"
+        + f" IFNULL({row_alias}.winner != 0 AND {row_alias}.winner = {row_alias}.llm_position, 0),"
+        + f" IFNULL({row_alias}.winner != 0 AND {row_alias}.winner != {row_alias}.llm_position, 0)"
+    )
+
+
+def _make_summary_add_sql(row_alias: str) -> str:
+    return f"""
+    INSERT INTO comparison_results_summary ({", ".join(SUMMARY_COLLECTION_COLUMNS)}, total, invalid, llm_wins, human_wins)
+    VALUES ({", ".join(f"IFNULL({row_alias}.{column}, '')" for column in SUMMARY_COLLECTION_COLUMNS)}, {_make_summary_counts_sql(row_alias)})
+    ON CONFLICT ({", ".join(SUMMARY_COLLECTION_COLUMNS)}) DO UPDATE SET
+        total = total + excluded.total,
+        invalid = invalid + excluded.invalid,
+        llm_wins = llm_wins + excluded.llm_wins,
+        human_wins = human_wins + excluded.human_wins;"""
+
+
+def _make_summary_subtract_sql(row_alias: str) -> str:
+    collection_match = " AND ".join(f"{column} = IFNULL({row_alias}.{column}, '')" for column in SUMMARY_COLLECTION_COLUMNS)
+    return f"""
+    UPDATE comparison_results_summary SET
+        total = total - 1,
+        invalid = invalid - ({row_alias}.winner = 0),
+        llm_wins = llm_wins - IFNULL({row_alias}.winner != 0 AND {row_alias}.winner = {row_alias}.llm_position, 0),
+        human_wins = human_wins - IFNULL({row_alias}.winner != 0 AND {row_alias}.winner != {row_alias}.llm_position, 0)
+    WHERE {collection_match};
+    DELETE FROM comparison_results_summary WHERE total <= 0 AND {collection_match};"""
+
+
+SUMMARY_TRIGGERS = [
+    f"""
+CREATE TRIGGER IF NOT EXISTS comparison_results_summary_insert AFTER INSERT ON comparison_results BEGIN
+    {_make_summary_add_sql("NEW")}
+END;""",
+    f"""
+CREATE TRIGGER IF NOT EXISTS comparison_results_summary_delete AFTER DELETE ON comparison_results BEGIN
+    {_make_summary_subtract_sql("OLD")}
+END;""",
+    f"""
+CREATE TRIGGER IF NOT EXISTS comparison_results_summary_update AFTER UPDATE ON comparison_results BEGIN
+    {_make_summary_subtract_sql("OLD")}
+    {_make_summary_add_sql("NEW")}
+END;""",
 ]
 
 
 def get_comparison_results_db(path: Path) -> sqlite3.Connection:
     logging.info(f"Opening comparison results database at {path}")
-    conn = sqlite3.connect(path, check_same_thread=False)
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=SQLITE_TIMEOUT_SECONDS)
+    _configure_connection(conn)
     for schema in SQLITE_SCHEMA:
         conn.execute(schema)
+    _add_missing_columns(conn)
     conn.commit()
+    _create_summary(conn)
     return conn
 
 
+def _add_missing_columns(conn: sqlite3.Connection) -> None:
+    # CREATE TABLE IF NOT EXISTS leaves DB files created by older versions as they were
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(comparison_results)")]
+    if "comparison_mode" not in columns:
+        conn.execute("ALTER TABLE comparison_results ADD COLUMN comparison_mode TEXT")
+    if "llm_position" not in columns:
+        conn.execute("ALTER TABLE comparison_results ADD COLUMN llm_position INTEGER")
+
+
+def _create_summary(conn: sqlite3.Connection) -> None:
+    """Creates the summary table and its triggers, filling it from the existing results once."""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'comparison_results_summary'").fetchone():
+        return
+    # the write lock keeps other writers out between filling the table and creating the triggers
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # re-checked under the lock, another process may have just created it
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'comparison_results_summary'").fetchone():
+            conn.execute(SUMMARY_SCHEMA)
+            _fill_summary(conn)
+            for trigger in SUMMARY_TRIGGERS:
+                conn.execute(trigger)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _fill_summary(conn: sqlite3.Connection) -> None:
+    start = time.monotonic()
+    conn.execute(
+        f"""
+        INSERT INTO comparison_results_summary ({", ".join(SUMMARY_COLLECTION_COLUMNS)}, total, invalid, llm_wins, human_wins)
+        SELECT {", ".join(f"IFNULL(r.{column}, '')" for column in SUMMARY_COLLECTION_COLUMNS)},
+            SUM(1), SUM(r.winner = 0),
+            SUM(IFNULL(r.winner != 0 AND r.winner = r.llm_position, 0)),
+            SUM(IFNULL(r.winner != 0 AND r.winner != r.llm_position, 0))
+        FROM comparison_results AS r
+        GROUP BY {", ".join(f"IFNULL(r.{column}, '')" for column in SUMMARY_COLLECTION_COLUMNS)}
+        """
+    )
+    logging.info(f"Filled comparison results summary in {time.monotonic() - start:.2f}s")
+
+
+def db_rebuild_summary(conn: sqlite3.Connection) -> None:
+    """Recounts the summary from scratch (only needed if the triggers were bypassed, e.g. dropped)."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM comparison_results_summary")
+        _fill_summary(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _configure_connection(conn: sqlite3.Connection) -> None:
+    # WAL lets readers run concurrently with the (single) writer
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+
+
+def _write_comparison_rows(
+    conn: sqlite3.Connection,
+    rows: list[dict[str, t.Any]],
+) -> None:
+    (created_user, created_host) = _get_created_user_and_host()
+    with conn:
+        for row in rows:
+            # NOTE: delete + insert instead of INSERT OR REPLACE, since older DB files
+            # were created without the UNIQUE constraint
+            conn.execute(
+                """
+                DELETE FROM comparison_results
+                WHERE description_uid_1 = ?
+                  AND description_uid_2 = ?
+                  AND comparison_llm_engine = ?
+                  AND comparison_prompt_key = ?
+                """,
+                (
+                    row["description_uid_1"],
+                    row["description_uid_2"],
+                    row["comparison_llm_engine"],
+                    row["comparison_prompt_key"],
+                ),
+            )
+            conn.execute(
+                """
+                INSERT INTO comparison_results (
+                    comparison_prompt_key,
+                    comparison_llm_engine,
+                    description_uid_1,
+                    description_uid_2,
+                    winner,
+                    item_type,
+                    description_llm_engine,
+                    description_prompt_key,
+                    comparison_mode,
+                    llm_position,
+                    created_user,
+                    created_host
+                    -- created_time is set by default
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+                """,
+                (
+                    row["comparison_prompt_key"],
+                    row["comparison_llm_engine"],
+                    row["description_uid_1"],
+                    row["description_uid_2"],
+                    row["winner"],
+                    row["item_type"],
+                    row["description_llm_engine"],
+                    row["description_prompt_key"],
+                    row.get("comparison_mode", None),
+                    row.get("llm_position", None),
+                    created_user,
+                    created_host,
+                ),
+            )
+
+
+class ComparisonStorageDb:
+    """
+    Comparison results DB shared by all comparison worker threads.
+
+    Writes are queued and committed by a single writer thread that owns its own
+    connection, batching up to WRITER_BATCH_SIZE rows (or whatever arrived within
+    WRITER_BATCH_INTERVAL_MS) into one transaction. Reads use one connection per
+    thread. Queued rows are flushed on `close()`, which is also registered with
+    `atexit` so results aren't lost on Ctrl-C.
+
+    `preload_comparisons` pulls all results for one (comparison engine, comparison
+    prompt) into memory, after which lookups for that pair are answered from the
+    in-memory map (kept up to date by `enqueue`) without touching SQLite.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._local = threading.local()
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        # rows queued but not yet committed, so reads see them right away
+        self._pending_winners: dict[tuple[str, str, str, str], int] = {}
+        # (comparison_llm_engine, comparison_prompt_key) -> {(description_uid_1, description_uid_2): winner}
+        self._preloaded_winners: dict[tuple[str, str], dict[tuple[str, str], int]] = {}
+        self._closed = False
+
+        # make sure the schema exists before any reader or the writer touches it
+        get_comparison_results_db(path).close()
+
+        self._writer_thread = threading.Thread(
+            target=self._run_writer,
+            name="comparison-storage-db-writer",
+            daemon=True,
+        )
+        self._writer_thread.start()
+        atexit.register(self.close)
+
+    def reader_conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT_SECONDS)
+            _configure_connection(conn)
+            self._local.conn = conn
+        return conn
+
+    def get_pending_winner(self, key: tuple[str, str, str, str]) -> t.Optional[int]:
+        with self._lock:
+            return self._pending_winners.get(key, None)
+
+    def preload_comparisons(
+        self,
+        llm_engine: Engine,
+        comparison_prompt_key: str,
+    ) -> dict[tuple[str, str], int]:
+        """
+        Loads every stored result for the comparison engine + prompt into memory in one query.
+
+        NOTE: the preloaded map is treated as complete, so results written to the DB file by
+        other processes after this call won't be seen (they'd just be re-queried).
+
+        Preloading again (e.g. concurrent runs with the same engine + prompt) merges into the existing
+        map, which has every result enqueued since, including those flushed after this call's query.
+        """
+        start = time.monotonic()
+        cursor = self.reader_conn().cursor()
+        cursor.execute(
+            """
+            SELECT description_uid_1, description_uid_2, winner
+            FROM comparison_results
+            WHERE comparison_llm_engine = ?
+              AND comparison_prompt_key = ?
+            """,
+            (str(llm_engine), comparison_prompt_key),
+        )
+        winners = {(uid_1, uid_2): winner for (uid_1, uid_2, winner) in cursor}
+        cursor.close()
+        with self._lock:
+            for ((uid_1, uid_2, engine, prompt_key), winner) in self._pending_winners.items():
+                if engine == str(llm_engine) and prompt_key == comparison_prompt_key:
+                    winners[(uid_1, uid_2)] = winner
+            preloaded = self._preloaded_winners.get((str(llm_engine), comparison_prompt_key), None)
+            if preloaded is None:
+                self._preloaded_winners[(str(llm_engine), comparison_prompt_key)] = winners
+            else:
+                # the existing map has every result enqueued since it was created, which are newer
+                for (uid_pair, winner) in winners.items():
+                    preloaded.setdefault(uid_pair, winner)
+                winners = preloaded
+        logging.info(f"Preloaded {len(winners)} comparison results for <{llm_engine}, {comparison_prompt_key}> in {time.monotonic() - start:.2f}s")
+        return winners
+
+    def get_preloaded_comparisons(
+        self,
+        llm_engine: Engine,
+        comparison_prompt_key: str,
+    ) -> t.Optional[dict[tuple[str, str], int]]:
+        with self._lock:
+            return self._preloaded_winners.get((str(llm_engine), comparison_prompt_key), None)
+
+    def enqueue(self, row: dict[str, t.Any]) -> None:
+        if self._closed:
+            raise Exception(f"Comparison results DB at {self.path} is already closed")
+        key = (
+            row["description_uid_1"],
+            row["description_uid_2"],
+            row["comparison_llm_engine"],
+            row["comparison_prompt_key"],
+        )
+        with self._lock:
+            self._pending_winners[key] = row["winner"]
+            preloaded = self._preloaded_winners.get((row["comparison_llm_engine"], row["comparison_prompt_key"]), None)
+            if preloaded is not None:
+                preloaded[(row["description_uid_1"], row["description_uid_2"])] = row["winner"]
+        self._queue.put(row)
+
+    def flush(self) -> None:
+        """Blocks until every queued row is committed."""
+        self._queue.join()
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer_thread.join()
+
+    def _write_batch(self, conn: sqlite3.Connection, rows: list[dict[str, t.Any]]) -> None:
+        for attempt in range(1, WRITER_MAX_ATTEMPTS + 1):
+            try:
+                _write_comparison_rows(conn, rows)
+                break
+            except sqlite3.Error as e:
+                if attempt == WRITER_MAX_ATTEMPTS:
+                    logging.error(f"Dropping {len(rows)} comparison results after failing to write them {attempt} times: {e}", exc_info=True)
+                else:
+                    logging.warning(f"Failed to write {len(rows)} comparison results (attempt {attempt}/{WRITER_MAX_ATTEMPTS}), retrying: {e}")
+                    time.sleep(attempt)
+        with self._lock:
+            for row in rows:
+                key = (
+                    row["description_uid_1"],
+                    row["description_uid_2"],
+                    row["comparison_llm_engine"],
+                    row["comparison_prompt_key"],
+                )
+                if self._pending_winners.get(key, None) == row["winner"]:
+                    del self._pending_winners[key]
+
+    def _run_writer(self) -> None:
+        conn = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT_SECONDS)
+        _configure_connection(conn)
+        stopping = False
+        while not stopping:
+            row = self._queue.get()
+            batch: list[dict[str, t.Any]] = []
+            if row is None:
+                stopping = True
+            else:
+                batch.append(row)
+                deadline = time.monotonic() + WRITER_BATCH_INTERVAL_MS / 1000
+                while len(batch) < WRITER_BATCH_SIZE:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        row = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                    if row is None:
+                        stopping = True
+                        break
+                    batch.append(row)
+            if batch:
+                self._write_batch(conn, batch)
+            for _ in range(len(batch) + (1 if stopping else 0)):
+                self._queue.task_done()
+        conn.close()
+
+
+@functools.lru_cache(maxsize=None)
+def get_comparison_storage_db(path: Path) -> ComparisonStorageDb:
+    return ComparisonStorageDb(path)
+
+
 def db_stats(conn: sqlite3.Connection):
     cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM comparison_results")
-    total = cursor.fetchone()[0]
-    cursor.execute("SELECT COUNT(*) FROM comparison_results WHERE winner = 0")
-    invalid = cursor.fetchone()[0]
-    s = f"Comparison DB statistics: total results: {total} total, {invalid} invalid"
-    # Now we need to list all tuples (description_llm_engine, description_prompt_key, item_type, comparison_prompt_key, comparison_llm_engine) and count the rows of each
+    # one read of the summary table (see SUMMARY_TRIGGERS), instead of counting the results
     cursor.execute(
-        """SELECT description_llm_engine, description_prompt_key, item_type, comparison_prompt_key, comparison_llm_engine, COUNT(*)
-        FROM comparison_results
-        GROUP BY description_llm_engine, description_prompt_key, item_type, comparison_prompt_key, comparison_llm_engine
+        f"""SELECT {", ".join(f"NULLIF({column}, '')" for column in SUMMARY_COLLECTION_COLUMNS)}, total, invalid, llm_wins, human_wins
+        FROM comparison_results_summary
         ORDER BY comparison_llm_engine, comparison_prompt_key;
         """
     )
-    s += "\n(comparison_llm_engine, comparison_prompt_key, description_llm_engine, description_prompt_key, item_type): counts"
-    for row in cursor:
-        cur2 = conn.cursor()
-        # Count invalid results for this tuple
-        cur2.execute(
-            "SELECT COUNT(*) FROM comparison_results WHERE description_llm_engine = ? AND description_prompt_key = ? AND item_type = ? AND comparison_prompt_key = ? AND comparison_llm_engine = ? AND winner = 0",
-            row[:5],
-        )
-        invalid = cur2.fetchone()[0]
-        cur2.close()
-        s += f"\n({row[4]}, {row[3]}, {row[2]}, {row[0]}, {row[1]}): {row[5]} total, {invalid} invalid"
+    rows = cursor.fetchall()
     cursor.close()
+    total = sum(row[5] for row in rows)
+    invalid = sum(row[6] for row in rows)
+    s = f"Comparison DB statistics: total results: {total} total, {invalid} invalid"
+    s += "\n(comparison_llm_engine, comparison_prompt_key, item_type, description_llm_engine, description_prompt_key): counts"
+    for row in rows:
+        s += f"\n({row[4]}, {row[3]}, {row[2]}, {row[0]}, {row[1]}): {row[5]} total, {row[6]} invalid, {row[7]} LLM wins, {row[8]} human wins"
     return s
 
 
-def db_get_comparison(
+def db_backfill_llm_positions(
     conn: sqlite3.Connection,
+    human_description_uids: set[str],
+) -> int:
+    """
+    Sets llm_position of results stored without one, where exactly one of the two descriptions is
+    a human one. Returns the number of rows updated (the summary is updated by the triggers).
+    """
+    with conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS human_description_uids (uid TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM human_description_uids")
+        conn.executemany("INSERT OR IGNORE INTO human_description_uids (uid) VALUES (?)", [(uid,) for uid in human_description_uids])
+        cursor = conn.execute(
+            """
+            UPDATE comparison_results SET llm_position = CASE
+                WHEN description_uid_1 IN human_description_uids THEN 2
+                ELSE 1
+            END
+            WHERE llm_position IS NULL
+              AND (description_uid_1 IN human_description_uids) != (description_uid_2 IN human_description_uids)
+            """
+        )
+        updated_count = cursor.rowcount
+        conn.execute("DROP TABLE human_description_uids")
+    return updated_count
+
+
+@functools.lru_cache(maxsize=None)
+def _get_created_user_and_host() -> tuple[str, str]:
+    try:
+        user = os.getlogin()
+    except OSError:
+        # no controlling terminal (e.g. nohup/cron runs)
+        user = getpass.getuser()
+    return (user, os.uname().nodename)
+
+
+def db_bulk_insert_comparisons(
+    conn: sqlite3.Connection,
+    rows: list[dict[str, t.Any]],
+) -> int:
+    """
+    Inserts many comparison results in a single transaction. Each row is a dict with the
+    `comparison_results` column names (created_* columns are filled in automatically).
+    Rows that already exist in the storage are left untouched.
+
+    Returns the number of rows actually inserted.
+    """
+    (created_user, created_host) = _get_created_user_and_host()
+    # NOTE: older DB files were created without the UNIQUE constraint, so dedupe explicitly
+    # instead of relying on INSERT OR IGNORE
+    unique_rows: dict[tuple[str, str, str, str], dict[str, t.Any]] = {}
+    for row in rows:
+        key = (
+            row["description_uid_1"],
+            row["description_uid_2"],
+            row["comparison_llm_engine"],
+            row["comparison_prompt_key"],
+        )
+        unique_rows.setdefault(key, row)
+    with conn:
+        # rowcount of the statement itself, total_changes would also count the summary trigger's writes
+        cursor = conn.executemany(
+            """
+            INSERT INTO comparison_results (
+                comparison_prompt_key,
+                comparison_llm_engine,
+                description_uid_1,
+                description_uid_2,
+                winner,
+                item_type,
+                description_llm_engine,
+                description_prompt_key,
+                comparison_mode,
+                llm_position,
+                created_user,
+                created_host
+                )
+            SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+            WHERE NOT EXISTS (
+                SELECT 1
+                FROM comparison_results
+                WHERE description_uid_1 = ?
+                  AND description_uid_2 = ?
+                  AND comparison_llm_engine = ?
+                  AND comparison_prompt_key = ?
+            );
+            """,
+            [
+                (
+                    row["comparison_prompt_key"],
+                    row["comparison_llm_engine"],
+                    row["description_uid_1"],
+                    row["description_uid_2"],
+                    row["winner"],
+                    row.get("item_type", None),
+                    row.get("description_llm_engine", None),
+                    row.get("description_prompt_key", None),
+                    row.get("comparison_mode", None),
+                    row.get("llm_position", None),
+                    created_user,
+                    created_host,
+                    *key,
+                )
+                for (key, row) in unique_rows.items()
+            ],
+        )
+    return cursor.rowcount
+
+
+def db_get_comparison(
+    db: ComparisonStorageDb,
     llm_engine: Engine,
     comparison_prompt_config: ComparisonPromptConfig,
     description_1: Description,
@@ -103,7 +604,21 @@ def db_get_comparison(
     """
     Returns 1 or 2 for the winner, 0 for invalid results (e.g. ties), and None if the comparison is not in the storage.
     """
-    cursor = conn.cursor()
+    preloaded = db.get_preloaded_comparisons(llm_engine, comparison_prompt_config.prompt_key)
+    if preloaded is not None:
+        return preloaded.get((description_1.uid, description_2.uid), None)
+
+    key = (
+        description_1.uid,
+        description_2.uid,
+        str(llm_engine),
+        comparison_prompt_config.prompt_key,
+    )
+    pending_winner = db.get_pending_winner(key)
+    if pending_winner is not None:
+        return pending_winner
+
+    cursor = db.reader_conn().cursor()
     cursor.execute(
         """
         SELECT winner
@@ -113,12 +628,7 @@ def db_get_comparison(
           AND comparison_llm_engine = ?
           AND comparison_prompt_key = ?
         """,
-        (
-            description_1.uid,
-            description_2.uid,
-            llm_engine,
-            comparison_prompt_config.prompt_key,
-        ),
+        key,
     )
     row = cursor.fetchone()
     cursor.close()
@@ -127,50 +637,53 @@ def db_get_comparison(
     return row[0]
 
 
+def make_comparison_row(
+    llm_engine: Engine,
+    comparison_prompt_config: ComparisonPromptConfig,
+    description_1: Description,
+    description_2: Description,
+    winner_index: int,
+) -> dict[str, t.Any]:
+    """`comparison_results` row for a result, winner_index being 1 or 2 for the winner and 0 for None/Invalid."""
+    description_llm = (
+        description_1 if description_1.origin == Origin.LLM else description_2
+    )
+    llm_position = None
+    if description_1.origin != description_2.origin:
+        llm_position = 1 if description_1.origin == Origin.LLM else 2
+    return {
+        "comparison_prompt_key": comparison_prompt_config.prompt_key,
+        "comparison_llm_engine": llm_engine.value,
+        "description_uid_1": description_1.uid,
+        "description_uid_2": description_2.uid,
+        "winner": winner_index,
+        "item_type": comparison_prompt_config.item_type,
+        "description_llm_engine": description_llm.engine.value,
+        "description_prompt_key": description_llm.prompt_key,
+        "comparison_mode": comparison_prompt_config.comparison_mode.value,
+        "llm_position": llm_position,
+    }
+
+
 def db_set_comparison(
-    conn: sqlite3.Connection,
+    db: ComparisonStorageDb,
     llm_engine: Engine,
     comparison_prompt_config: ComparisonPromptConfig,
     description_1: Description,
     description_2: Description,
     winner: Description | None,
 ):
+    """
+    Queues the result for the background writer (see ComparisonStorageDb), so this doesn't block on disk I/O.
+    """
     assert (
         winner is None or winner == description_1 or winner == description_2
     ), f"Cached result must be None or one of the two descriptions being compared, got {winner} vs {description_1} vs {description_2}."
     winner_index = 0 if winner is None else (1 if winner == description_1 else 2)
-    description_llm = (
-        description_1 if description_1.origin == Origin.LLM else description_2
-    )
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        INSERT OR REPLACE INTO comparison_results (
-            comparison_prompt_key,
-            comparison_llm_engine,
-            description_uid_1,
-            description_uid_2,
-            winner,
-            item_type,
-            description_llm_engine,
-            description_prompt_key,
-            created_user,
-            created_host
-            -- created_time is set by default
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
-            """,
-        (
-            comparison_prompt_config.prompt_key,
-            llm_engine.value,
-            description_1.uid,
-            description_2.uid,
-            winner_index,
-            comparison_prompt_config.item_type,
-            description_llm.engine.value,
-            description_llm.prompt_key,
-            os.getlogin(),
-            os.uname().nodename,
-        ),
-    )
-    cursor.connection.commit()
-    cursor.close()
+    db.enqueue(make_comparison_row(
+        llm_engine,
+        comparison_prompt_config,
+        description_1,
+        description_2,
+        winner_index,
+    ))
@@ -1,7 +1,27 @@
+import enum
 from typing import Optional
 
 from pydantic.dataclasses import dataclass
 
+class ComparisonMode(str, enum.Enum):
+    # free-text choice, then a second query to extract the chosen ID from that text as JSON
+    TwoStep = "two_step"
+    # a single query for a JSON verdict with both the reasoning and the chosen ID
+    Structured = "structured"
+
+    def __str__(self):
+        return self.value
+
+class PromptLayout(str, enum.Enum):
+    # comparison question, the two descriptions, then the addendum (if any)
+    AddendumLast = "addendum_last"
+    # the addendum (e.g. the full paper) first, as a byte-identical prefix of every comparison
+    # prompt of an item, so provider prompt caches and local servers' KV caches can reuse it
+    SharedContextFirst = "shared_context_first"
+
+    def __str__(self):
+        return self.value
+
 @dataclass
 class ComparisonPromptConfig:
     prompt_key: str
@@ -9,6 +29,10 @@ class ComparisonPromptConfig:
     item_type_name: str
     comparison_question: str
     include_addendum_type: Optional[str] = None
+    # NOTE: give structured-mode configs their own prompt_key, since stored results are looked up by prompt key
+    comparison_mode: ComparisonMode = ComparisonMode.TwoStep
+    # NOTE: same as for comparison_mode, give shared-context-first configs their own prompt_key
+    prompt_layout: PromptLayout = PromptLayout.AddendumLast
 
 
 COMPARISON_PROMPTS = [
@@ -78,6 +102,39 @@ COMPARISON_PROMPTS = [
         item_type_name="Abstract",
         comparison_question="The following are two abstracts from scientific papers relevant to a specific research field. Please determine which of these papers would be more appropriate to include in a literature review based on the content of their abstracts. We can only include exactly one, not both. \n\n Please select one of the abstracts below:",
     ),
+    # Versions of the full paper prompts above with the paper first, so that every comparison of
+    # the same paper shares a long cacheable prompt prefix
+    ComparisonPromptConfig(
+        item_type="paper",
+        prompt_key="submit_tomorrow_with_full_paper_shared_prefix",
+        item_type_name="Abstract",
+        comparison_question="Which of the two provided drafts, serving as alternative versions of an abstract for the academic paper above scheduled for submission tomorrow, is the better choice for the official abstract? The abstract aims to succinctly summarize the paper’s content and results, and to engage the target group of researchers to read the entire paper. The full text of the paper is included in XML format above for reference. \n\n Please select one of the abstract drafts below:",
+        include_addendum_type="full_paper_body",
+        prompt_layout=PromptLayout.SharedContextFirst,
+    ),
+    ComparisonPromptConfig(
+        item_type="paper",
+        prompt_key="submit_tomorrow_with_full_paper_details_matter_shared_prefix",
+        item_type_name="Abstract",
+        comparison_question="Which of the two provided drafts, serving as alternative versions of an abstract for the academic paper above scheduled for submission tomorrow, is the better choice for the official abstract? The abstract aims to succinctly and accurately summarize the paper’s content and results, while positioning the paper with respect to other work and highlighting key results in specific detail, and to engage the target group of researchers to read the entire paper. The full text of the paper is included in XML format above for reference. \n\n Please select one of the abstract drafts below:",
+        include_addendum_type="full_paper_body",
+        prompt_layout=PromptLayout.SharedContextFirst,
+    ),
+    # Single-query versions of the prompts above
+    ComparisonPromptConfig(
+        item_type="product",
+        prompt_key="marketplace_recommendation_force_decision_structured",
+        item_type_name="product",
+        comparison_question="The following are product descriptions from a marketplace, what do you recommend choosing? Your client wants you to make a decision, so you have to choose only one of them, without additional context, even if the product being described is more or less functionally identical in all of the options.",
+        comparison_mode=ComparisonMode.Structured,
+    ),
+    ComparisonPromptConfig(
+        item_type="paper",
+        prompt_key="literature_review_pick_one_structured",
+        item_type_name="Abstract",
+        comparison_question="The following are two abstracts from scientific papers relevant to a specific research field. Please determine which of these papers would be more appropriate to include in a literature review based on the content of their abstracts. We can only include exactly one, not both. \n\n Please select one of the abstracts below:",
+        comparison_mode=ComparisonMode.Structured,
+    ),
 ]
 def get_comparison_prompt_config(
     item_type: str,
@@ -0,0 +1,117 @@
+import math
+import statistics
+import typing as t
+
+from pydantic.dataclasses import dataclass
+
+from llm_descriptions_generator.schema import Origin
+
+# Opt-in sequential testing for comparison runs: an item's comparisons are run pair by pair (a
+# pair being both presentation orders of the same two descriptions, so orders stay balanced), and
+# the rest of them are skipped once the item's LLM win ratio is known well enough.
+#
+# The item's win ratio gets a Wilson score interval after every completed pair. Since the interval
+# is checked repeatedly, each check uses a Bonferroni-corrected confidence level (one check per
+# pair at most), which keeps the overall chance of stopping on a wrong call within 1 - confidence.
+
+DEFAULT_EARLY_STOPPING_CONFIDENCE = 0.95
+DEFAULT_EARLY_STOPPING_MIN_COMPARISONS = 8
+
+
+@dataclass
+class EarlyStoppingConfig:
+    confidence: float = DEFAULT_EARLY_STOPPING_CONFIDENCE
+    # valid (non-Invalid) comparisons an item needs before it can stop
+    min_comparisons: int = DEFAULT_EARLY_STOPPING_MIN_COMPARISONS
+    # also stop once the interval is at most this wide, even if it still contains 0.5
+    # (None: only stop once the interval is entirely on one side of 0.5)
+    max_interval_width: t.Optional[float] = None
+
+
+def get_llm_win_ratio_interval(
+    llm_win_count: int,
+    human_win_count: int,
+    confidence: float,
+) -> t.Optional[tuple[float, float]]:
+    """Wilson score interval of the LLM win ratio, or None without valid results."""
+    total = llm_win_count + human_win_count
+    if total == 0:
+        return None
+    z = statistics.NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+    ratio = llm_win_count / total
+    denominator = 1 + z**2 / total
+    center = (ratio + z**2 / (2 * total)) / denominator
+    half_width = z * math.sqrt(ratio * (1 - ratio) / total + z**2 / (4 * total**2)) / denominator
+    return (max(0.0, center - half_width), min(1.0, center + half_width))
+
+
+def make_balanced_combo_pairs(
+    description_list_1: list[t.Any],
+    description_list_2: list[t.Any],
+) -> list[tuple[tuple[t.Any, t.Any], tuple[t.Any, t.Any]]]:
+    """
+    The same comparisons as `make_ordered_combos`, grouped into pairs of both presentation orders
+    of the same two descriptions, so that stopping between pairs keeps the orders balanced.
+    """
+    return [
+        ((d1, d2), (d2, d1))
+        for d1 in description_list_1
+        for d2 in description_list_2
+    ]
+
+
+class ItemEarlyStopping:
+    """
+    Tallies one item's completed comparison pairs, decides when the item can stop, and counts the
+    comparisons skipped after that.
+    """
+
+    def __init__(self, early_stopping_config: EarlyStoppingConfig, pair_count: int):
+        self.early_stopping_config = early_stopping_config
+        self.pair_count = pair_count
+        self.completed_pair_count = 0
+        self.llm_win_count = 0
+        self.human_win_count = 0
+        self.stopped = False
+        self.skipped_count = 0
+        # description uids of a pair -> winner origins of its completed comparisons (if only one is)
+        self._half_completed_pairs: dict[tuple[str, str], t.Optional[str]] = {}
+
+    def add_result(
+        self,
+        description_uid_1: str,
+        description_uid_2: str,
+        winner_origin: t.Optional[str],
+    ) -> None:
+        """Adds a comparison result (winner origin, None if invalid), and stops the item if it can."""
+        pair_key = tuple(sorted((description_uid_1, description_uid_2)))
+        if pair_key not in self._half_completed_pairs:
+            self._half_completed_pairs[pair_key] = winner_origin
+            return
+        pair_winner_origins = [self._half_completed_pairs.pop(pair_key), winner_origin]
+        self.completed_pair_count += 1
+        self.llm_win_count += pair_winner_origins.count(str(Origin.LLM))
+        self.human_win_count += pair_winner_origins.count(str(Origin.Human))
+        if not self.stopped and self._can_stop():
+            self.stopped = True
+
+    def add_skipped(self, battle_tally: dict[str, int], skipped_count: int = 1) -> None:
+        """Counts comparisons not run because the item stopped, under "Skipped" in the item's tally."""
+        self.skipped_count += skipped_count
+        battle_tally["Skipped"] = battle_tally.get("Skipped", 0) + skipped_count
+
+    def _can_stop(self) -> bool:
+        config = self.early_stopping_config
+        if self.llm_win_count + self.human_win_count < config.min_comparisons:
+            return False
+        interval = get_llm_win_ratio_interval(
+            llm_win_count=self.llm_win_count,
+            human_win_count=self.human_win_count,
+            confidence=1 - (1 - config.confidence) / max(1, self.pair_count),
+        )
+        if interval is None:
+            return False
+        (low, high) = interval
+        if low > 0.5 or high < 0.5:
+            return True
+        return config.max_interval_width is not None and high - low <= config.max_interval_width
@@ -1,31 +1,38 @@
+import collections
 import hashlib
 import json
 import logging
-import os
 import random
-import sqlite3
 import typing as t
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from pathlib import Path
 
-import langchain
 from interlab.context import Context, StorageBase
-from interlab.lang_models import query_model
-from interlab.queries import query_for_json
 from pydantic.dataclasses import Field, dataclass
 
-import groq_model
-from llm_comparison.config import ComparisonPromptConfig
+from llm_comparison.choice_extraction import extract_choice_id
+from llm_comparison.config import (ComparisonMode, ComparisonPromptConfig,
+                                   PromptLayout)
+from llm_comparison.early_stopping import (EarlyStoppingConfig,
+                                           ItemEarlyStopping,
+                                           make_balanced_combo_pairs)
+from llm_clients import get_llm_client
 from llm_descriptions_generator import query_llm
 from llm_descriptions_generator.file_io import (
     load_all_human_description_batches, load_all_llm_description_batches,
-    to_safe_filename)
+    load_llm_description_batches_by_title, to_safe_filename)
 from llm_descriptions_generator.schema import (
     Engine, HumanTextItemDescriptionBatch,
     LlmGeneratedTextItemDescriptionBatch, Origin)
-from storage import cache_friendly_file_storage
+from response_cache import (cached_query_for_json, cached_query_model,
+                            log_response_cache_stats)
+from storage import (IndexedFileStorage, cache_friendly_file_storage,
+                     get_context_tag_names)
 from utils import or_join
 
+if t.TYPE_CHECKING:
+    from llm_comparison.comparison_storage import ComparisonStorageDb
+
 rnd = random.Random("b24e179ef8a27f061ae2ac307db2b7b2")
 
 # DEFAULT_RUN_KEY = "default"
@@ -34,6 +41,15 @@ DEFAULT_STORAGE = cache_friendly_file_storage
 MAX_CONCURRENT_WORKERS = 1
 COMPARISON_STORAGE_DB_FILENAME = "comparison_results.sqlite"
 REDO_INVALID_RESULTS=False
+# Set to False once the Context cache has been backfilled into the comparison results DB
+# (see scripts/backfill_comparison_db_from_context_cache.py) to skip searching it on DB misses
+CONTEXT_CACHE_FALLBACK=True
+# Set to False to always send free-text comparison answers through the LLM choice analysis
+# step, instead of resolving unambiguous answers locally (see choice_extraction.py)
+LOCAL_CHOICE_EXTRACTION=True
+# Set to an EarlyStoppingConfig to stop comparing an item once its LLM win ratio is clear enough
+# (see early_stopping.py); skipped comparisons are counted under "Skipped" in the item's tally
+EARLY_STOPPING: t.Optional[EarlyStoppingConfig] = None
 
 @dataclass
 class Description:
@@ -43,7 +59,7 @@ class Description:
     engine: t.Optional[Engine] = None
     prompt_key: t.Optional[str] = None
 
-DescriptionBattleTally = dict[t.Union[Origin, t.Literal["Invalid"]], int]
+DescriptionBattleTally = dict[t.Union[Origin, t.Literal["Invalid", "Skipped"]], int]
 
 def search_storage_contexts(
     tags_match: list[str],
@@ -55,27 +71,12 @@ def search_storage_contexts(
     # inputs_match: t.Optional[dict] = None,
     # state: ...
 ) -> t.Iterator[Context]:
-    def is_matching_context(ctx: Context) -> bool:
-        ctx_tags_raw: t.Optional[list] = getattr(ctx, "tags", [])
-        ctx_tag_names: list[str] = []
-        if ctx_tags_raw is not None:
-            for tag in ctx_tags_raw:
-                if isinstance(tag, str):
-                    ctx_tag_names.append(tag)
-                else:
-                    tag_name = tag.get("name", None)
-                    if tag_name is not None:
-                        ctx_tag_names.append(tag_name)
-
-        # legacy shim hack: old runs w/ "marketplace" prompt didn't include tag for prompt key,
-        # so shim in one for older data that doesn't have one
-        if (
-            len(ctx_tag_names) == 2 
-            and ("engine:" in ctx_tag_names[0] or "engine:" in ctx_tag_names[1])
-            and ("compare_descriptions:" in ctx_tag_names[0] or "compare_descriptions:" in ctx_tag_names[1])
-        ):
-            ctx_tag_names.append("comparison_prompt_key:marketplace")
+    # fast path: storages with a persistent tag index answer with a single index query
+    if isinstance(storage, IndexedFileStorage):
+        return storage.find_contexts_by_tags(tags_match=tags_match, has_result=has_result)
 
+    def is_matching_context(ctx: Context) -> bool:
+        ctx_tag_names = get_context_tag_names(getattr(ctx, "tags", []))
         if not set(tags_match).issubset(set(ctx_tag_names)):
             return False
         result = getattr(ctx, "result", None)
@@ -125,18 +126,18 @@ def find_cached_comparison_result(
     return Description(**result)
 
 
-def compare_descriptions(
+def _find_stored_comparison_result(
     llm_engine: Engine,
     comparison_prompt_config: ComparisonPromptConfig,
     description_1: Description,
     description_2: Description,
-    storage: StorageBase = DEFAULT_STORAGE,
-    comparison_prompt_addendum: t.Optional[str] = None,
-    comparison_storage_db: sqlite3.Connection = None,
-    # run_key: str = DEFAULT_RUN_KEY,
-) -> t.Optional[Description]:
-    # TODO: throw if the descriptions aren't for the same underlying item?
-    
+    comparison_storage_db: "ComparisonStorageDb",
+) -> tuple[bool, t.Optional[Description]]:
+    """
+    Looks up a past result in the DB result storage, then in the Context cache.
+
+    Returns (found, winner), where winner is None for stored invalid results.
+    """
     from . import comparison_storage # Prevents a circular import
 
     # First, check if this comparison already exists in the fast DB result storage
@@ -152,14 +153,14 @@ def compare_descriptions(
         logging.debug(f"Found cached result for {description_1.uid} vs {description_2.uid} on {llm_engine}: {stored_winner}")
         if stored_winner == 0:
             if not REDO_INVALID_RESULTS:
-                return None
+                return (True, None)
             logging.debug(f"Invalid result found in cache, re-running due to REDO_INVALID_RESULTS.")
             skip_context_search = True
         else:
-            return description_1 if stored_winner == 1 else description_2
+            return (True, description_1 if stored_winner == 1 else description_2)
 
     # NOTE: returns None if LLM gives invalid response or declares a tie
-    if not skip_context_search:
+    if not skip_context_search and CONTEXT_CACHE_FALLBACK:
         cached_result = find_cached_comparison_result(
             llm_engine=llm_engine,
             description_uid_1=description_1.uid,
@@ -177,9 +178,18 @@ def compare_descriptions(
                 description_2,
                 cached_result,
             )
-            return cached_result
-    
-    with Context(
+            return (True, cached_result)
+    return (False, None)
+
+
+def _make_compare_descriptions_context(
+    llm_engine: Engine,
+    comparison_prompt_config: ComparisonPromptConfig,
+    description_1: Description,
+    description_2: Description,
+    storage: StorageBase,
+) -> Context:
+    return Context(
         name="compare_descriptions",
         inputs={
             "llm_engine": llm_engine,
@@ -193,90 +203,194 @@ def compare_descriptions(
             description_uid_1=description_1.uid,
             description_uid_2=description_2.uid,
             comparison_prompt_key=comparison_prompt_config.prompt_key,
+        ) + (
+            # NOTE: not part of the lookup tags, which older two-step Contexts don't have
+            [f"comparison_mode:{comparison_prompt_config.comparison_mode}"]
+            if comparison_prompt_config.comparison_mode != ComparisonMode.TwoStep else []
         ),
-    ) as ctx:
-        prompt = comparison_prompt_config.comparison_question + "\n\n"
-        descriptions_by_int_id: dict[str, Description] = {}
-        for description in [description_1, description_2]:
-            int_id = str(rnd.randint(1500, 9999))
-            while descriptions_by_int_id.get(int_id, None) is not None:
-                int_id = str(rnd.randint(1500, 9999))
-            descriptions_by_int_id[int_id] = description
-
-        for int_id in descriptions_by_int_id:
-            desc = descriptions_by_int_id.get(int_id)
-            prompt += f"## {comparison_prompt_config.item_type_name} {int_id}\n{desc.text}\n\n"
-
-        if comparison_prompt_addendum:
-            prompt += comparison_prompt_addendum
-
-        @dataclass
-        class Choice:
-            # see HACK below for why "Any" type ended up being allowed
-            # but tl;dr is that some LLMs don't play 100% well with interlab's query_for_json
-            # and if you don't allow an "Any" response, interlab will error out instead of allowing
-            # for local adaptation to a problematic but at least consistent data pattern response from an LLM
-            answer: t.Optional[int | t.Any] = Field(description=f"The integer ID (one of the following: {or_join(list(descriptions_by_int_id.keys()))} of the item that was chosen, or None if no clear choice was made." )
-
-        if llm_engine in [Engine.gpt35turbo, Engine.gpt35turbo1106, Engine.gpt4turbo]:
-            logging.info(f"Querying OpenAI servers for: {llm_engine}")
-            llm_model = langchain.chat_models.ChatOpenAI(model_name=llm_engine)
-        elif llm_engine.value.startswith("groq-"):
-            name = llm_engine.value.split("-", 1)[1]
-            logging.info(f"Querying {name} on Groq")
-            llm_model = groq_model.GroqModel(model_name=name)
-        elif llm_engine.value.startswith("together-"):
-            name = llm_engine.value.split("-", 1)[1]
-            logging.info(f"Querying {name} on Together (via OpenAI API)")
-            llm_model = langchain.chat_models.ChatOpenAI(
-                model_name=name,
-                openai_api_key=os.environ.get("TOGETHER_API_KEY"),
-                openai_api_base="https://api.together.xyz/v1")
+    )
+
+
+def _make_comparison_prompt(
+    comparison_prompt_config: ComparisonPromptConfig,
+    description_1: Description,
+    description_2: Description,
+    comparison_prompt_addendum: t.Optional[str] = None,
+    rng: random.Random = rnd,
+) -> tuple[str, dict[str, Description]]:
+    """
+    Returns the comparison prompt, and the descriptions keyed by the random integer IDs used in it.
+    """
+    prompt = ""
+    if comparison_prompt_addendum and comparison_prompt_config.prompt_layout == PromptLayout.SharedContextFirst:
+        # identical for every comparison of the item, so it must come before anything that varies
+        prompt += comparison_prompt_addendum
+    prompt += comparison_prompt_config.comparison_question + "\n\n"
+    descriptions_by_int_id: dict[str, Description] = {}
+    for description in [description_1, description_2]:
+        int_id = str(rng.randint(1500, 9999))
+        while descriptions_by_int_id.get(int_id, None) is not None:
+            int_id = str(rng.randint(1500, 9999))
+        descriptions_by_int_id[int_id] = description
+
+    for int_id in descriptions_by_int_id:
+        desc = descriptions_by_int_id.get(int_id)
+        prompt += f"## {comparison_prompt_config.item_type_name} {int_id}\n{desc.text}\n\n"
+
+    if comparison_prompt_addendum and comparison_prompt_config.prompt_layout == PromptLayout.AddendumLast:
+        prompt += comparison_prompt_addendum
+    return (prompt, descriptions_by_int_id)
+
+
+def _make_choice_type(descriptions_by_int_id: dict[str, Description]) -> type:
+    @dataclass
+    class Choice:
+        # see HACK in _get_chosen_description for why "Any" type ended up being allowed
+        # but tl;dr is that some LLMs don't play 100% well with interlab's query_for_json
+        # and if you don't allow an "Any" response, interlab will error out instead of allowing
+        # for local adaptation to a problematic but at least consistent data pattern response from an LLM
+        answer: t.Optional[int | t.Any] = Field(description=f"The integer ID (one of the following: {or_join(list(descriptions_by_int_id.keys()))} of the item that was chosen, or None if no clear choice was made." )
+    return Choice
+
+
+def _make_verdict_type(
+    comparison_prompt_config: ComparisonPromptConfig,
+    descriptions_by_int_id: dict[str, Description],
+) -> type:
+    @dataclass
+    class Verdict:
+        # reasoning goes first so the model deliberates before committing to an answer
+        reasoning: str = Field(description=f"Brief reasoning about which {comparison_prompt_config.item_type_name} is the better choice.")
+        # see _make_choice_type for why "Any" is allowed
+        answer: t.Optional[int | t.Any] = Field(description=f"The integer ID (one of the following: {or_join(list(descriptions_by_int_id.keys()))}) of the chosen {comparison_prompt_config.item_type_name}, or None if no clear choice was made.")
+    return Verdict
+
+
+def _extract_chosen_description_locally(
+    ctx: Context,
+    choice_answer: str,
+    descriptions_by_int_id: dict[str, Description],
+) -> t.Optional[Description]:
+    """
+    Returns the description that a free-text answer unambiguously chooses, or None
+    if the answer needs the LLM choice analysis step.
+    """
+    if not LOCAL_CHOICE_EXTRACTION:
+        return None
+    chosen_id = extract_choice_id(choice_answer, list(descriptions_by_int_id.keys()))
+    if chosen_id is None:
+        return None
+    logging.debug(f"Choice extracted locally from prose response: {chosen_id}")
+    ctx.add_event("local choice extraction", data={"answer": int(chosen_id)})
+    return descriptions_by_int_id[chosen_id]
+
+
+def _make_choice_analysis_prompt(
+    comparison_prompt_config: ComparisonPromptConfig,
+    choice_answer: str,
+) -> str:
+    return f"The following text is a snippet where the writer makes a choice between two items. Each {comparison_prompt_config.item_type_name} should have an integer ID. Which {comparison_prompt_config.item_type_name} ID was chosen, if any? \n\n**(Text snippet)**" + choice_answer
+
+
+def _get_chosen_description(
+    answer: t.Any,
+    descriptions_by_int_id: dict[str, Description],
+) -> t.Optional[Description]:
+    chosen_id: t.Optional[int | str] = None
+    try:
+        # HACK to adapt to some LLMs (mistral-7b-instruct-v0.2 in particular) that have trouble
+        # providing a simple int answer like { answer: 7432 } and keep sending back a more complex
+        # type-annotated answer like { answer: { title: "Answer", description: 7432, type: "Integer" } }
+        if (
+            type(answer).__name__ == "AttributedDict"
+            and str(answer.get("title", None)).lower() == "answer"
+            and answer.get("description", None) is not None
+        ):
+            logging.warning(f"Attempting to parse extra layer of AttributedDict from non-standard answer: {answer}")
+            hopefully_int_id = answer.get("description")
         else:
-            logging.info(f"Assuming {llm_engine} is running locally")
-            llm_model = langchain.chat_models.ChatOpenAI(
-                model_name=llm_engine,
-                max_tokens=-1,
-                openai_api_base=os.getenv('LOCAL_LLM_API_BASE'),
-            )
-        choice_answer = query_model(llm_model, prompt)
-        logging.debug(f"Initial choice prompt - prose response: {choice_answer[:50]!r}[...]")
+            hopefully_int_id = answer
+
+        # NOTE: we don't technically need to validate that the response is a parseable integer
+        # since anything else won't match a description in the lookup dict below, and we'll still
+        # get a None (invalid) response, but it's nice to have the log about what went wrong
+        chosen_id = str(int(hopefully_int_id))
+    except:
+        logging.warning(f"Choice analysis step result (answer: {answer}) is not parseable to a single integer ID. Result will be considered Invalid (no choice made).")
+        chosen_id = None
+
+    logging.debug(f"Follow up choice analysis - selected ID in data response: {chosen_id}")
+    return (
+        descriptions_by_int_id.get(chosen_id, None)
+        if chosen_id is not None else None
+    )
 
-        choice_analysis_result: Choice = query_for_json(
-            llm_model,
-            Choice,
-            f"The following text is a snippet where the writer makes a choice between two items. Each {comparison_prompt_config.item_type_name} should have an integer ID. Which {comparison_prompt_config.item_type_name} ID was chosen, if any? \n\n**(Text snippet)**" + choice_answer,
-        )
-        logging.debug(f"Choice analysis prompt result - data response: {repr(choice_analysis_result)[:60]!r}[...]")
-        answer = choice_analysis_result.answer
-        chosen_id: t.Optional[int | str] = None
-        try:
-            # HACK to adapt to some LLMs (mistral-7b-instruct-v0.2 in particular) that have trouble
-            # providing a simple int answer like { answer: 7432 } and keep sending back a more complex
-            # type-annotated answer like { answer: { title: "Answer", description: 7432, type: "Integer" } }
-            if (
-                type(answer).__name__ == "AttributedDict"
-                and str(answer.get("title", None)).lower() == "answer"
-                and answer.get("description", None) is not None
-            ):
-                logging.warning(f"Attempting to parse extra layer of AttributedDict from non-standard answer: {answer}")
-                hopefully_int_id = answer.get("description")
-            else:
-                hopefully_int_id = answer
-
-            # NOTE: we don't technically need to validate that the response is a parseable integer
-            # since anything else won't match a description in the lookup dict below, and we'll still
-            # get a None (invalid) response, but it's nice to have the log about what went wrong
-            chosen_id = str(int(hopefully_int_id))
-        except:
-            logging.warning(f"Choice analysis step result (answer: {answer}) is not parseable to a single integer ID. Result will be considered Invalid (no choice made).")
-            chosen_id = None
-
-        logging.debug(f"Follow up choice analysis - selected ID in data response: {chosen_id}")
-        chosen_description = (
-            descriptions_by_int_id.get(chosen_id, None)
-            if chosen_id is not None else None
+
+def compare_descriptions(
+    llm_engine: Engine,
+    comparison_prompt_config: ComparisonPromptConfig,
+    description_1: Description,
+    description_2: Description,
+    storage: StorageBase = DEFAULT_STORAGE,
+    comparison_prompt_addendum: t.Optional[str] = None,
+    comparison_storage_db: t.Optional["ComparisonStorageDb"] = None,
+    # run_key: str = DEFAULT_RUN_KEY,
+) -> t.Optional[Description]:
+    # TODO: throw if the descriptions aren't for the same underlying item?
+    
+    from . import comparison_storage # Prevents a circular import
+
+    (found, stored_result) = _find_stored_comparison_result(
+        llm_engine=llm_engine,
+        comparison_prompt_config=comparison_prompt_config,
+        description_1=description_1,
+        description_2=description_2,
+        comparison_storage_db=comparison_storage_db,
+    )
+    if found:
+        return stored_result
+
+    with _make_compare_descriptions_context(
+        llm_engine=llm_engine,
+        comparison_prompt_config=comparison_prompt_config,
+        description_1=description_1,
+        description_2=description_2,
+        storage=storage,
+    ) as ctx:
+        (prompt, descriptions_by_int_id) = _make_comparison_prompt(
+            comparison_prompt_config=comparison_prompt_config,
+            description_1=description_1,
+            description_2=description_2,
+            comparison_prompt_addendum=comparison_prompt_addendum,
         )
+        llm_model = get_llm_client(llm_engine)
+        if comparison_prompt_config.comparison_mode == ComparisonMode.Structured:
+            Verdict = _make_verdict_type(comparison_prompt_config, descriptions_by_int_id)
+            choice_analysis_result = cached_query_for_json(llm_engine, llm_model, Verdict, prompt)
+            logging.debug(f"Structured verdict - data response: {repr(choice_analysis_result)[:60]!r}[...]")
+            chosen_description = _get_chosen_description(
+                choice_analysis_result.answer,
+                descriptions_by_int_id,
+            )
+        else:
+            choice_answer = cached_query_model(llm_engine, llm_model, prompt)
+            logging.debug(f"Initial choice prompt - prose response: {choice_answer[:50]!r}[...]")
+
+            # skip the choice analysis query if the answer plainly names a single ID
+            chosen_description = _extract_chosen_description_locally(ctx, choice_answer, descriptions_by_int_id)
+            if chosen_description is None:
+                Choice = _make_choice_type(descriptions_by_int_id)
+                choice_analysis_result = cached_query_for_json(
+                    llm_engine,
+                    llm_model,
+                    Choice,
+                    _make_choice_analysis_prompt(comparison_prompt_config, choice_answer),
+                )
+                logging.debug(f"Choice analysis prompt result - data response: {repr(choice_analysis_result)[:60]!r}[...]")
+                chosen_description = _get_chosen_description(
+                    choice_analysis_result.answer,
+                    descriptions_by_int_id,
+                )
 
         ctx.set_result(chosen_description)
 
@@ -293,63 +407,35 @@ def compare_descriptions(
         return chosen_description
 
 
-def compare_description_lists_for_one_item(
-    llm_engine: Engine,
-    comparison_prompt_config: ComparisonPromptConfig,
+def make_empty_battle_tally() -> DescriptionBattleTally:
+    return {
+        str(Origin.Human): 0,
+        str(Origin.LLM): 0,
+        "Invalid": 0,
+    }
+
+
+def add_winner_to_battle_tally(
+    battle_tally: DescriptionBattleTally,
+    winner: t.Optional[Description],
+) -> None:
+    if winner is None:
+        battle_tally["Invalid"] += 1
+    else:
+        battle_tally[str(winner.origin)] += 1
+
+
+def make_ordered_combos(
     description_list_1: list[Description],
     description_list_2: list[Description],
-    storage: StorageBase = DEFAULT_STORAGE,
-    comparison_prompt_addendum: t.Optional[str] = None,
-    comparison_storage_db: sqlite3.Connection = None,
-    # run_key: str = DEFAULT_RUN_KEY,
-) -> t.Tuple[list[t.Optional[Description]], DescriptionBattleTally]:
+) -> list[tuple[Description, Description]]:
     """
-    Compares all possible ordered combinations of one Description from list 1 vs one Description from list 2.
-        
-    Returns list of winning Descriptions (or Nones in case of ties or invalid results from LLM).
+    All possible ordered combinations of one Description from list 1 vs one Description from list 2 (both presentation orders).
     """
-    with Context(
-        name="compare_lists_for_one_item",
-        inputs={
-            "llm_engine": llm_engine,
-            "comparison_prompt_config": comparison_prompt_config.__dict__,
-        },
-        storage=storage,
-        tags=[f"engine:{llm_engine}"],
-        directory=True,
-    ) as ctx:
-        winning_descriptions: list[t.Optional[Description]] = []
-        battle_tally: DescriptionBattleTally = {
-            str(Origin.Human): 0,
-            str(Origin.LLM): 0,
-            "Invalid": 0,
-        }
-        ordered_combos = (
-            [(d1, d2) for d1 in description_list_1 for d2 in description_list_2]
-            + [(d2, d1) for d2 in description_list_2 for d1 in description_list_1]
-        )
-        comparison_counter = 1
-        total_count = len(ordered_combos)
-        for (description_1, description_2) in ordered_combos:
-            logging.debug(f"## Executing description comparison ({comparison_counter}/{total_count}) for item: '{description_1.uid}' vs '{description_2.uid}'")
-            winner = compare_descriptions(
-                llm_engine=llm_engine,
-                comparison_prompt_config=comparison_prompt_config,
-                description_1=description_1,
-                description_2=description_2,
-                comparison_prompt_addendum=comparison_prompt_addendum,
-                comparison_storage_db=comparison_storage_db,
-            )
-            winning_descriptions.append(winner)
-            if winner is None:
-                battle_tally["Invalid"] += 1
-            else:
-                battle_tally[str(winner.origin)] += 1
-            comparison_counter += 1
-        
-        ctx.set_result((winning_descriptions, battle_tally))
-        
-        return (winning_descriptions, battle_tally)
+    return (
+        [(d1, d2) for d1 in description_list_1 for d2 in description_list_2]
+        + [(d2, d1) for d2 in description_list_2 for d1 in description_list_1]
+    )
 
 
 def _make_description_uid(description_text: str) -> str:
@@ -400,31 +486,46 @@ def make_optional_comparison_prompt_addendum(
         full_paper_body = meta.get("body", None)
         if not full_paper_body:
             raise Exception(f"'full_paper_body' addedum requested by {comparison_prompt_config.prompt_key}, but {comparison_prompt_config.item_type} {human_description_batch.title} is missing `meta.body` attribute.")
-        addendum = f"\n---\n\n## Addendum: Full Paper Body\n\n{full_paper_body}"
+        # str() reads lazy bodies of packed papers (see paper_corpus.py)
+        if comparison_prompt_config.prompt_layout == PromptLayout.SharedContextFirst:
+            addendum = f"## Full Paper Body\n\n{str(full_paper_body)}\n\n---\n\n"
+        else:
+            addendum = f"\n---\n\n## Addendum: Full Paper Body\n\n{str(full_paper_body)}"
 
     # Note: implement other addendum types and logic here if needed
     return addendum
 
 
-def compare_saved_description_batches(
+def open_comparison_storage_db(
+    storage: StorageBase,
     comparison_llm_engine: Engine,
     comparison_prompt_config: ComparisonPromptConfig,
-    item_type: str,
-    description_llm_engine: Engine,
-    description_prompt_key: t.Optional[str] = None,
-    item_title_like: t.Optional[list[str]] = None,
-    storage: StorageBase = DEFAULT_STORAGE,
-    description_count_limit: t.Optional[int] = None,
-) -> tuple[dict[str, DescriptionBattleTally], DescriptionBattleTally]:
+) -> "ComparisonStorageDb":
     ## Open and possibly initialize the comparison results DB
     from . import comparison_storage # Prevents a circular import
 
-    comparison_storage_db = comparison_storage.get_comparison_results_db(
+    comparison_storage_db = comparison_storage.get_comparison_storage_db(
         Path(storage.directory) / COMPARISON_STORAGE_DB_FILENAME
     )
-    logging.info(comparison_storage.db_stats(comparison_storage_db))
+    logging.info(comparison_storage.db_stats(comparison_storage_db.reader_conn()))
+    # one query for every stored verdict of this comparison engine + prompt, instead of one per pair
+    comparison_storage_db.preload_comparisons(
+        llm_engine=comparison_llm_engine,
+        comparison_prompt_key=comparison_prompt_config.prompt_key,
+    )
+    return comparison_storage_db
+
 
-    with Context(
+def _make_batch_compare_context(
+    comparison_llm_engine: Engine,
+    comparison_prompt_config: ComparisonPromptConfig,
+    item_type: str,
+    description_llm_engine: Engine,
+    description_prompt_key: t.Optional[str],
+    item_title_like: t.Optional[list[str]],
+    storage: StorageBase,
+) -> Context:
+    return Context(
         name="batch_compare_item_type",
         inputs={
             "comparison_llm_engine": comparison_llm_engine,
@@ -440,111 +541,313 @@ def compare_saved_description_batches(
             f"item_type:{item_type}",
         ],
         directory=True,
+    )
+
+
+def load_item_comparison_descriptions(
+    human_description_batch: HumanTextItemDescriptionBatch,
+    item_type: str,
+    comparison_prompt_config: ComparisonPromptConfig,
+    description_llm_engine: Engine,
+    description_prompt_key: t.Optional[str] = None,
+    description_count_limit: t.Optional[int] = None,
+    llm_description_batches_by_title: t.Optional[dict[str, list[LlmGeneratedTextItemDescriptionBatch]]] = None,
+) -> t.Optional[tuple[list[Description], list[Description], t.Optional[str]]]:
+    """
+    Returns (human descriptions, LLM descriptions, optional comparison prompt addendum) for one item,
+    or None if there are no LLM descriptions to compare against.
+    Pass `llm_description_batches_by_title` (see load_llm_description_batches_by_title) when
+    comparing many items, to look the item's LLM batches up instead of loading them for every item.
+    """
+    title = human_description_batch.title
+    logging.info(f"# Begin description comparisons for [<{item_type}> --> '{title}']")
+    if llm_description_batches_by_title is not None:
+        llm_description_batches = llm_description_batches_by_title.get(title, [])
+    else:
+        llm_description_batches = load_all_llm_description_batches(
+            item_type=item_type,
+            title=title,
+            llm_engine=description_llm_engine,
+            prompt_nickname=description_prompt_key,
+        )
+    human_descriptions = _make_descriptions_from_human_description_batch(human_description_batch)
+    
+    comparison_prompt_addendum = make_optional_comparison_prompt_addendum(
+        comparison_prompt_config=comparison_prompt_config,
+        human_description_batch=human_description_batch,
+    )
+    if not llm_description_batches:
+        logging.warning(f"No LLM description batches found for '{human_description_batch.title}'. Skipping this batch.")
+        return None
+
+    # NOTE: llm_description_generation has been modified so there really should be
+    # only one batch per (item_type + engine + prompt), so just take first hit
+    llm_description_batch = llm_description_batches[0]
+    llm_descriptions = _make_descriptions_from_llm_description_batch(llm_description_batch)
+
+    if description_count_limit:
+        llm_descriptions = llm_descriptions[:description_count_limit]
+    return (human_descriptions, llm_descriptions, comparison_prompt_addendum)
+
+
+# (item index, description 1, description 2, comparison prompt addendum)
+ComparisonTask = tuple[int, Description, Description, t.Optional[str]]
+
+
+def _iter_completed_comparisons(
+    comparison_units: list[list[ComparisonTask]],
+    submit_comparison: t.Callable[[ComparisonTask], Future],
+    max_in_flight: int,
+    item_by_item: bool = False,
+    is_item_stopped: t.Callable[[int], bool] = lambda item_index: False,
+) -> t.Iterator[tuple[ComparisonTask, t.Optional[Future]]]:
+    """
+    Runs the comparisons, grouped into units that are always submitted together (e.g. both
+    presentation orders of a pair), in order, with at most about `max_in_flight` running at once.
+    Units of items for which `is_item_stopped` is true by the time they are due are skipped.
+    Yields (task, done future) pairs as comparisons complete, and (task, None) for skipped ones.
+
+    With `item_by_item`, units must be grouped by item, in item order. Each item's comparisons
+    then run back to back: the item's first unit runs alone, to get its shared prompt prefix
+    cached by the provider (or local server), and only then are the rest of its units queued,
+    ahead of those of later items. Later items are only started when nothing else is ready to run.
+    """
+    # units of every item not started yet (item by item)
+    unstarted_item_units: collections.deque[list[list[ComparisonTask]]] = collections.deque()
+    ready_units: collections.deque[list[ComparisonTask]] = collections.deque()
+    if item_by_item:
+        units_by_item_index: dict[int, list[list[ComparisonTask]]] = {}
+        for unit in comparison_units:
+            units_by_item_index.setdefault(unit[0][0], []).append(unit)
+        unstarted_item_units.extend(units_by_item_index.values())
+    else:
+        ready_units.extend(comparison_units)
+    # item index -> (comparisons of its first unit still running, the item's other units)
+    held_back_units_by_item_index: dict[int, tuple[int, list[list[ComparisonTask]]]] = {}
+    future_to_task: dict[Future, ComparisonTask] = {}
+
+    while future_to_task or ready_units or unstarted_item_units:
+        while len(future_to_task) < max_in_flight and (ready_units or unstarted_item_units):
+            if ready_units:
+                unit = ready_units.popleft()
+                if is_item_stopped(unit[0][0]):
+                    for task in unit:
+                        yield (task, None)
+                    continue
+            else:
+                (unit, *other_units) = unstarted_item_units.popleft()
+                held_back_units_by_item_index[unit[0][0]] = (len(unit), other_units)
+            for task in unit:
+                future_to_task[submit_comparison(task)] = task
+        if not future_to_task:
+            continue
+        (done_futures, _) = wait(future_to_task, return_when=FIRST_COMPLETED)
+        for future in done_futures:
+            task = future_to_task.pop(future)
+            item_index = task[0]
+            if item_index in held_back_units_by_item_index:
+                (running_count, other_units) = held_back_units_by_item_index[item_index]
+                if running_count > 1:
+                    held_back_units_by_item_index[item_index] = (running_count - 1, other_units)
+                else:
+                    del held_back_units_by_item_index[item_index]
+                    ready_units.extend(other_units)
+            yield (task, future)
+
+
+def record_item_battle_tally(
+    title: str,
+    battle_tally: DescriptionBattleTally,
+    tallies_by_item_title: dict[str, DescriptionBattleTally],
+    total_tally: DescriptionBattleTally,
+    log_details: dict[str, t.Any],
+) -> None:
+    filesafe_title = to_safe_filename(title)
+
+    logging.info(f"""
+    ------Batch Results------
+
+    item_title: {title}
+    file_title_like: {filesafe_title}
+""" + "".join(f"    {key}: {value}\n" for (key, value) in log_details.items()))
+    logging.info(json.dumps(battle_tally, indent=4))
+    
+    tallies_by_item_title[filesafe_title] = battle_tally
+    
+    for key in [str(Origin.Human), str(Origin.LLM), "Invalid"]:
+        default = 0
+        total_tally[key] += battle_tally.get(key, default)
+    if "Skipped" in battle_tally:
+        total_tally["Skipped"] = total_tally.get("Skipped", 0) + battle_tally["Skipped"]
+
+
+def compare_saved_description_batches(
+    comparison_llm_engine: Engine,
+    comparison_prompt_config: ComparisonPromptConfig,
+    item_type: str,
+    description_llm_engine: Engine,
+    description_prompt_key: t.Optional[str] = None,
+    item_title_like: t.Optional[list[str]] = None,
+    storage: StorageBase = DEFAULT_STORAGE,
+    description_count_limit: t.Optional[int] = None,
+) -> tuple[dict[str, DescriptionBattleTally], DescriptionBattleTally]:
+    comparison_storage_db = open_comparison_storage_db(
+        storage=storage,
+        comparison_llm_engine=comparison_llm_engine,
+        comparison_prompt_config=comparison_prompt_config,
+    )
+
+    with _make_batch_compare_context(
+        comparison_llm_engine=comparison_llm_engine,
+        comparison_prompt_config=comparison_prompt_config,
+        item_type=item_type,
+        description_llm_engine=description_llm_engine,
+        description_prompt_key=description_prompt_key,
+        item_title_like=item_title_like,
+        storage=storage,
     ) as ctx:
 
         human_description_batches = load_all_human_description_batches(
             item_type=item_type,
             item_title_like=item_title_like,
         )
+        llm_description_batches_by_title = load_llm_description_batches_by_title(
+            item_type=item_type,
+            llm_engines=[description_llm_engine],
+            prompt_nickname=description_prompt_key,
+        )
 
         tallies_by_item_title: dict[str, DescriptionBattleTally] = {}
 
-        total_tally: DescriptionBattleTally = {
-            str(Origin.Human): 0,
-            str(Origin.LLM): 0,
-            "Invalid": 0,
+        total_tally = make_empty_battle_tally()
+
+        log_details = {
+            "item_type": item_type,
+            "description_llm_engine": description_llm_engine,
+            "description_prompt_key": description_prompt_key,
+            "comparison_llm_engine": comparison_llm_engine,
+            "comparison_prompt_key": comparison_prompt_config.prompt_key,
         }
 
-        def run_comparisons_for_human_description_batch(
-            human_description_batch: HumanTextItemDescriptionBatch,
-        ) -> tuple[list[t.Optional[Description]], DescriptionBattleTally]:
-            title = human_description_batch.title
-            logging.info(f"# Begin description comparisons for [<{item_type}> --> '{title}']")
-            llm_description_batches = load_all_llm_description_batches(
+        # Every (item, description_1, description_2) comparison is an independent task in one
+        # shared queue, so workers stay busy until the very last comparison instead of idling
+        # while the slowest item's pairs run one after another.
+        # Per-item tallies are assembled as results arrive, keyed by index into human_description_batches.
+        # comparisons submitted together (both presentation orders of a pair, with early stopping)
+        comparison_units: list[list[ComparisonTask]] = []
+        comparison_count = 0
+        early_stopping_by_item_index: dict[int, ItemEarlyStopping] = {}
+        battle_tally_by_item_index: dict[int, DescriptionBattleTally] = {}
+        remaining_count_by_item_index: dict[int, int] = {}
+        completed_count = 0
+        total_count = len(human_description_batches)
+
+        for (item_index, human_description_batch) in enumerate(human_description_batches):
+            item_comparison_descriptions = load_item_comparison_descriptions(
+                human_description_batch=human_description_batch,
                 item_type=item_type,
-                title=title,
-                llm_engine=description_llm_engine,
-                prompt_nickname=description_prompt_key,
-            )
-            human_descriptions = _make_descriptions_from_human_description_batch(human_description_batch)
-            
-            comparison_prompt_addendum = make_optional_comparison_prompt_addendum(
                 comparison_prompt_config=comparison_prompt_config,
-                human_description_batch=human_description_batch,
+                description_llm_engine=description_llm_engine,
+                description_prompt_key=description_prompt_key,
+                description_count_limit=description_count_limit,
+                llm_description_batches_by_title=llm_description_batches_by_title,
             )
-            if not llm_description_batches:
-                logging.warning(f"No LLM description batches found for '{human_description_batch.title}'. Skipping this batch.")
-                return [], {"Invalid": 0}  # Example: return an empty list and a tally with 'Invalid' count as 0
+            if item_comparison_descriptions is None:
+                combo_units = []
+                battle_tally_by_item_index[item_index] = {"Invalid": 0}
             else:
-                # NOTE: llm_description_generation has been modified so there really should be
-                # only one batch per (item_type + engine + prompt), so just take first hit
-                llm_description_batch = llm_description_batches[0]
-                llm_descriptions = _make_descriptions_from_llm_description_batch(llm_description_batch)
+                (human_descriptions, llm_descriptions, comparison_prompt_addendum) = item_comparison_descriptions
+                if EARLY_STOPPING:
+                    combo_units = [list(combo_pair) for combo_pair in make_balanced_combo_pairs(human_descriptions, llm_descriptions)]
+                    early_stopping_by_item_index[item_index] = ItemEarlyStopping(EARLY_STOPPING, pair_count=len(combo_units))
+                else:
+                    combo_units = [[combo] for combo in make_ordered_combos(human_descriptions, llm_descriptions)]
+                battle_tally_by_item_index[item_index] = make_empty_battle_tally()
+            if not combo_units:
+                completed_count += 1
+                record_item_battle_tally(
+                    title=human_description_batch.title,
+                    battle_tally=battle_tally_by_item_index[item_index],
+                    tallies_by_item_title=tallies_by_item_title,
+                    total_tally=total_tally,
+                    log_details=log_details,
+                )
+                continue
+            item_comparison_count = sum(len(combo_unit) for combo_unit in combo_units)
+            remaining_count_by_item_index[item_index] = item_comparison_count
+            comparison_count += item_comparison_count
+            comparison_units += [
+                [(item_index, d1, d2, comparison_prompt_addendum) for (d1, d2) in combo_unit]
+                for combo_unit in combo_units
+            ]
 
-                if description_count_limit:
-                    llm_descriptions = llm_descriptions[:description_count_limit]
+        logging.info(f"# Queued {comparison_count} description comparisons for {len(remaining_count_by_item_index)} items")
 
-                (winners, battle_tally) = compare_description_lists_for_one_item(
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_WORKERS) as thread_exec:
+            def submit_comparison(task: ComparisonTask) -> Future:
+                (_, d1, d2, comparison_prompt_addendum) = task
+                return thread_exec.submit(
+                    compare_descriptions,
                     llm_engine=comparison_llm_engine,
                     comparison_prompt_config=comparison_prompt_config,
+                    description_1=d1,
+                    description_2=d2,
                     storage=storage,
-                    description_list_1=human_descriptions,
-                    description_list_2=llm_descriptions,
                     comparison_prompt_addendum=comparison_prompt_addendum,
                     comparison_storage_db=comparison_storage_db,
                 )
-                return (winners, battle_tally)
 
-        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_WORKERS) as thread_exec:
-            future_to_item = {
-                thread_exec.submit(
-                    run_comparisons_for_human_description_batch,
-                    human_description_batch,
-                ): human_description_batch
-                for human_description_batch in human_description_batches
-            }
-            completed_count = 0
-            total_count = len(human_description_batches)
-
-            for future in as_completed(future_to_item):
-                human_description_batch = future_to_item[future]
-                title = human_description_batch.title
-                try:
-                    (winners, battle_tally) = future.result()
-                except Exception as exc:
-                    logging.error(f"Error processing item '{title}': {exc}", exc_info=True)
-                    logging.error(f'{human_description_batch} generated an exception: {exc}')
-                    raise exc
+            completed_comparisons = _iter_completed_comparisons(
+                comparison_units,
+                submit_comparison,
+                max_in_flight=MAX_CONCURRENT_WORKERS,
+                item_by_item=comparison_prompt_config.prompt_layout == PromptLayout.SharedContextFirst,
+                is_item_stopped=lambda item_index: (
+                    item_index in early_stopping_by_item_index
+                    and early_stopping_by_item_index[item_index].stopped
+                ),
+            )
+            comparison_counter = 0
+
+            for ((item_index, d1, d2, _), future) in completed_comparisons:
+                title = human_description_batches[item_index].title
+                battle_tally = battle_tally_by_item_index[item_index]
+                if future is None:
+                    # skipped by early stopping
+                    early_stopping_by_item_index[item_index].add_skipped(battle_tally)
                 else:
-                    filesafe_title = to_safe_filename(title)
-
-                    logging.info(f"""
-                    ------Batch Results------
-
-                    item_type: {item_type}
-                    item_title: {title}
-                    file_title_like: {filesafe_title}
-                    description_llm_engine: {description_llm_engine}
-                    description_prompt_key: {description_prompt_key}
-                    comparison_llm_engine: {comparison_llm_engine}
-                    comparison_prompt_key: {comparison_prompt_config.prompt_key}
-
-                    """)
-                    logging.info(json.dumps(battle_tally, indent=4))
-                    
-                    tallies_by_item_title[filesafe_title] = battle_tally
-                    
-                    for key in [str(Origin.Human), str(Origin.LLM), "Invalid"]:
-                        default = 0
-                        total_tally[key] += battle_tally.get(key, default)
-                        # total_tally[str(Origin.Human)] += battle_tally[str(Origin.Human)]
-                        # total_tally[str(Origin.LLM)] += battle_tally[str(Origin.LLM)]
-                        # total_tally["Invalid"] += battle_tally["Invalid"]
-
+                    try:
+                        winner = future.result()
+                    except Exception as exc:
+                        logging.error(f"Error processing item '{title}' ({d1.uid} vs {d2.uid}): {exc}", exc_info=True)
+                        thread_exec.shutdown(wait=False, cancel_futures=True)
+                        raise exc
+                    add_winner_to_battle_tally(battle_tally, winner)
+                    if item_index in early_stopping_by_item_index:
+                        early_stopping_by_item_index[item_index].add_result(d1.uid, d2.uid, str(winner.origin) if winner else None)
+                comparison_counter += 1
+                if comparison_counter % 50 == 0:
+                    logging.info(f"# Comparisons completed: {comparison_counter}/{comparison_count}")
+
+                remaining_count_by_item_index[item_index] -= 1
+                if remaining_count_by_item_index[item_index] == 0:
                     completed_count += 1
+                    item_early_stopping = early_stopping_by_item_index.get(item_index, None)
+                    if item_early_stopping and item_early_stopping.skipped_count:
+                        logging.info(f"# Stopped comparing '{title}' early, {item_early_stopping.skipped_count} comparisons skipped")
+                    record_item_battle_tally(
+                        title=title,
+                        battle_tally=battle_tally,
+                        tallies_by_item_title=tallies_by_item_title,
+                        total_tally=total_tally,
+                        log_details=log_details,
+                    )
                     logging.info(f"=== COMPARISON BATCHES COMPLETED: {completed_count}/{total_count} ===")
 
 
+        comparison_storage_db.flush()
+        log_response_cache_stats()
+
         logging.info("-----tallies_by_item_title-----")
         logging.info(json.dumps(tallies_by_item_title, indent=4))
         logging.info("-----total_tally-----")
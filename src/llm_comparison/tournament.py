@@ -0,0 +1,433 @@
+import dataclasses
+import json
+import logging
+import math
+import random
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from interlab.context import Context, StorageBase
+from pydantic.dataclasses import dataclass
+
+from llm_comparison import llm_comparison
+from llm_comparison.config import ComparisonPromptConfig
+from llm_comparison.llm_comparison import (
+    DEFAULT_STORAGE, Description, _make_descriptions_from_human_description_batch,
+    _make_descriptions_from_llm_description_batch, compare_descriptions,
+    make_optional_comparison_prompt_addendum, open_comparison_storage_db)
+from llm_descriptions_generator.file_io import (
+    load_all_human_description_batches, load_llm_description_batches_by_title)
+from llm_descriptions_generator.schema import Engine, Origin
+
+# Tournament mode: ranks description sources (human-written descriptions and any number of
+# (LLM engine, generation prompt) pairs) against each other, instead of comparing every LLM
+# source against humans on every item pair.
+#
+# Every source gets a Bradley-Terry strength (the log-odds of one source's description winning
+# against another's is the difference of their strengths), fitted to all comparisons so far
+# with a weak Gaussian prior (so that e.g. unbeaten sources still get finite estimates). Each
+# round queries the source pairs with the highest expected information gain: comparisons whose
+# outcome is uncertain (win probability near 1/2) between sources whose difference is still
+# poorly known. Results already stored in the comparison results DB are used before querying.
+
+HUMAN_SOURCE_LABEL = str(Origin.Human)
+# Elo points per unit of Bradley-Terry strength, and the Elo rating of an average source
+ELO_POINTS_PER_STRENGTH_UNIT = 400 / math.log(10)
+ELO_BASE_RATING = 1500
+# precision of the Gaussian prior on strengths
+STRENGTH_PRIOR_PRECISION = 0.1
+FIT_MAX_ITERATIONS = 100
+FIT_TOLERANCE = 1e-9
+DEFAULT_TOURNAMENT_ROUND_SIZE = 8
+
+
+def make_description_source_label(
+    llm_engine: t.Optional[Engine] = None,
+    prompt_key: t.Optional[str] = None,
+) -> str:
+    """Human descriptions are one source, LLM descriptions a source per (engine, generation prompt)."""
+    if llm_engine is None:
+        return HUMAN_SOURCE_LABEL
+    return f"{llm_engine.value}|{prompt_key}"
+
+
+@dataclass
+class SourceRating:
+    source: str
+    elo_rating: float
+    # standard error of the Elo rating
+    elo_standard_error: float
+    strength: float
+    comparison_count: int
+    win_count: int
+
+
+class BradleyTerryRatings:
+    def __init__(self, source_labels: list[str]):
+        self.source_labels = list(source_labels)
+        self._source_indexes = {label: index for (index, label) in enumerate(self.source_labels)}
+        source_count = len(self.source_labels)
+        # [i, j]: wins of source i over source j
+        self.win_counts = np.zeros((source_count, source_count))
+        self.strengths = np.zeros(source_count)
+
+    def get_source_index(self, source_label: str) -> int:
+        return self._source_indexes[source_label]
+
+    def add_result(self, winner_source_label: str, loser_source_label: str) -> None:
+        self.win_counts[self.get_source_index(winner_source_label), self.get_source_index(loser_source_label)] += 1
+
+    def fit(self) -> None:
+        """Maximum a posteriori strengths, by Newton's method (the log posterior is concave)."""
+        comparison_counts = self.win_counts + self.win_counts.T
+        wins = self.win_counts.sum(axis=1)
+        for _ in range(FIT_MAX_ITERATIONS):
+            win_probabilities = self._get_win_probabilities()
+            gradient = wins - (comparison_counts * win_probabilities).sum(axis=1) - STRENGTH_PRIOR_PRECISION * self.strengths
+            step = np.linalg.solve(self._get_precision(), gradient)
+            self.strengths += step
+            if np.abs(step).max() < FIT_TOLERANCE:
+                break
+
+    def _get_win_probabilities(self) -> np.ndarray:
+        """[i, j]: probability that source i wins against source j."""
+        return 1 / (1 + np.exp(self.strengths[None, :] - self.strengths[:, None]))
+
+    def _get_precision(self) -> np.ndarray:
+        """Negative Hessian of the log posterior (inverse of the strengths' approximate covariance)."""
+        win_probabilities = self._get_win_probabilities()
+        weights = (self.win_counts + self.win_counts.T) * win_probabilities * (1 - win_probabilities)
+        return np.diag(weights.sum(axis=1)) - weights + STRENGTH_PRIOR_PRECISION * np.eye(len(self.source_labels))
+
+    def get_covariance(self) -> np.ndarray:
+        return np.linalg.inv(self._get_precision())
+
+    def get_information_gains(self, covariance: np.ndarray) -> np.ndarray:
+        """
+        [i, j]: expected information gain (in nats, Laplace approximation) about the strengths from
+        one more comparison between sources i and j.
+        """
+        win_probabilities = self._get_win_probabilities()
+        variances = np.diag(covariance)
+        difference_variances = variances[:, None] + variances[None, :] - 2 * covariance
+        return 0.5 * np.log1p(win_probabilities * (1 - win_probabilities) * difference_variances)
+
+    def get_ratings(self) -> list[SourceRating]:
+        """Ratings of every source, best first."""
+        # ratings are relative to the average source, so are their standard errors
+        source_count = len(self.source_labels)
+        centering = np.eye(source_count) - 1 / source_count
+        standard_errors = np.sqrt(np.diag(centering @ self.get_covariance() @ centering))
+        mean_strength = self.strengths.mean()
+        ratings = [
+            SourceRating(
+                source=label,
+                elo_rating=float(ELO_BASE_RATING + ELO_POINTS_PER_STRENGTH_UNIT * (self.strengths[index] - mean_strength)),
+                elo_standard_error=float(ELO_POINTS_PER_STRENGTH_UNIT * standard_errors[index]),
+                strength=float(self.strengths[index]),
+                comparison_count=int(self.win_counts[index].sum() + self.win_counts[:, index].sum()),
+                win_count=int(self.win_counts[index].sum()),
+            )
+            for (index, label) in enumerate(self.source_labels)
+        ]
+        ratings.sort(key=lambda rating: -rating.elo_rating)
+        return ratings
+
+
+@dataclass
+class TournamentItem:
+    title: str
+    descriptions_by_source: dict[str, list[Description]]
+    comparison_prompt_addendum: t.Optional[str] = None
+
+
+@dataclass
+class TournamentResult:
+    ratings: list[SourceRating]
+    # comparisons taken from the comparison results DB before the tournament started
+    stored_comparison_count: int
+    # comparisons run by the tournament (looked up in the Context cache or queried)
+    new_comparison_count: int
+    # comparisons (stored and new) per "<source 1> vs <source 2>"
+    comparison_counts_by_source_pair: dict[str, int]
+
+
+def load_tournament_items(
+    item_type: str,
+    llm_sources: list[tuple[Engine, str]],
+    comparison_prompt_config: ComparisonPromptConfig,
+    include_human: bool = True,
+    item_title_like: t.Optional[list[str]] = None,
+    description_count_limit: t.Optional[int] = None,
+) -> list[TournamentItem]:
+    """Items with the descriptions of every source that has some for them (at least two sources)."""
+    human_description_batches = load_all_human_description_batches(
+        item_type=item_type,
+        item_title_like=item_title_like,
+    )
+    llm_description_batches_by_title = load_llm_description_batches_by_title(
+        item_type=item_type,
+        llm_engines=list({llm_engine for (llm_engine, _) in llm_sources}),
+    )
+    items: list[TournamentItem] = []
+    for human_description_batch in human_description_batches:
+        title = human_description_batch.title
+        descriptions_by_source: dict[str, list[Description]] = {}
+        if include_human:
+            descriptions_by_source[HUMAN_SOURCE_LABEL] = _make_descriptions_from_human_description_batch(human_description_batch)
+        for (llm_engine, prompt_key) in llm_sources:
+            for llm_description_batch in llm_description_batches_by_title.get(title, []):
+                if llm_description_batch.llm_engine == llm_engine and llm_description_batch.generation_prompt_nickname == prompt_key:
+                    # only one batch per (item, engine, prompt), see load_item_comparison_descriptions
+                    llm_descriptions = _make_descriptions_from_llm_description_batch(llm_description_batch)
+                    descriptions_by_source[make_description_source_label(llm_engine, prompt_key)] = llm_descriptions[:description_count_limit]
+                    break
+        descriptions_by_source = {source: descriptions for (source, descriptions) in descriptions_by_source.items() if descriptions}
+        if len(descriptions_by_source) < 2:
+            logging.warning(f"Less than two description sources for '{title}', leaving it out of the tournament")
+            continue
+        items.append(TournamentItem(
+            title=title,
+            descriptions_by_source=descriptions_by_source,
+            comparison_prompt_addendum=make_optional_comparison_prompt_addendum(
+                comparison_prompt_config=comparison_prompt_config,
+                human_description_batch=human_description_batch,
+            ),
+        ))
+    return items
+
+
+class _TournamentPairing:
+    """Tracks which comparisons were made, and picks the next one for a pair of sources."""
+
+    def __init__(self, items: list[TournamentItem], rng: random.Random):
+        self.items = items
+        self.rng = rng
+        # (description uid 1, description uid 2) of every comparison made, in presentation order
+        self.compared_uid_pairs: set[tuple[str, str]] = set()
+        # (source 1, source 2) -> comparisons with a description of source 1 presented first
+        self.ordered_source_pair_counts: dict[tuple[str, str], int] = {}
+        # (source 1, source 2, item index) -> comparisons made (either order)
+        self.item_source_pair_counts: dict[tuple[str, str, int], int] = {}
+        # source pairs with no comparison left to make
+        self.exhausted_source_pairs: set[frozenset[str]] = set()
+
+    def record(self, item_index: int, source_1: str, source_2: str, description_1: Description, description_2: Description) -> None:
+        self.compared_uid_pairs.add((description_1.uid, description_2.uid))
+        self.ordered_source_pair_counts[(source_1, source_2)] = self.ordered_source_pair_counts.get((source_1, source_2), 0) + 1
+        key = (*sorted((source_1, source_2)), item_index)
+        self.item_source_pair_counts[key] = self.item_source_pair_counts.get(key, 0) + 1
+
+    def pick_comparison(
+        self,
+        source_a: str,
+        source_b: str,
+    ) -> t.Optional[tuple[int, str, str, Description, Description]]:
+        """
+        (item index, source 1, source 2, description 1, description 2) of a comparison not made yet,
+        presenting the source shown first less often so far first, on the item the two sources were
+        compared on least. None if every comparison of the two sources was made.
+        """
+        if frozenset((source_a, source_b)) in self.exhausted_source_pairs:
+            return None
+        if self.ordered_source_pair_counts.get((source_a, source_b), 0) > self.ordered_source_pair_counts.get((source_b, source_a), 0):
+            source_orders = [(source_b, source_a), (source_a, source_b)]
+        else:
+            source_orders = [(source_a, source_b), (source_b, source_a)]
+        item_indexes = [
+            item_index for (item_index, item) in enumerate(self.items)
+            if source_a in item.descriptions_by_source and source_b in item.descriptions_by_source
+        ]
+        self.rng.shuffle(item_indexes)
+        item_indexes.sort(key=lambda item_index: self.item_source_pair_counts.get((*sorted((source_a, source_b)), item_index), 0))
+        for (source_1, source_2) in source_orders:
+            for item_index in item_indexes:
+                item = self.items[item_index]
+                description_pairs = [
+                    (description_1, description_2)
+                    for description_1 in item.descriptions_by_source[source_1]
+                    for description_2 in item.descriptions_by_source[source_2]
+                    if description_1.uid != description_2.uid
+                    and (description_1.uid, description_2.uid) not in self.compared_uid_pairs
+                ]
+                if description_pairs:
+                    (description_1, description_2) = self.rng.choice(description_pairs)
+                    return (item_index, source_1, source_2, description_1, description_2)
+        self.exhausted_source_pairs.add(frozenset((source_a, source_b)))
+        return None
+
+
+def _pick_round_source_pairs(
+    ratings: BradleyTerryRatings,
+    pairing: _TournamentPairing,
+    round_size: int,
+) -> list[tuple[int, str, str, Description, Description]]:
+    """
+    Greedily picks the round's comparisons by expected information gain, counting each picked
+    comparison as already observed (a rank-one covariance update), so a round spreads over pairs.
+    """
+    covariance = ratings.get_covariance()
+    win_probabilities = ratings._get_win_probabilities()
+    source_count = len(ratings.source_labels)
+    comparisons: list[tuple[int, str, str, Description, Description]] = []
+    while len(comparisons) < round_size:
+        information_gains = ratings.get_information_gains(covariance)
+        candidate_pairs = sorted(
+            (
+                (information_gains[i, j], i, j)
+                for i in range(source_count)
+                for j in range(i + 1, source_count)
+                if frozenset((ratings.source_labels[i], ratings.source_labels[j])) not in pairing.exhausted_source_pairs
+            ),
+            reverse=True,
+        )
+        comparison = None
+        for (_, i, j) in candidate_pairs:
+            comparison = pairing.pick_comparison(ratings.source_labels[i], ratings.source_labels[j])
+            if comparison is not None:
+                break
+        if comparison is None:
+            break
+        (item_index, source_1, source_2, description_1, description_2) = comparison
+        # reserved for this round, so the next pick is a different comparison
+        pairing.record(item_index, source_1, source_2, description_1, description_2)
+        comparisons.append(comparison)
+        difference = np.zeros(source_count)
+        difference[ratings.get_source_index(source_1)] = 1
+        difference[ratings.get_source_index(source_2)] = -1
+        i = ratings.get_source_index(source_1)
+        j = ratings.get_source_index(source_2)
+        weight = win_probabilities[i, j] * (1 - win_probabilities[i, j])
+        covariance_difference = covariance @ difference
+        covariance = covariance - weight * np.outer(covariance_difference, covariance_difference) / (1 + weight * difference @ covariance_difference)
+    return comparisons
+
+
+def run_description_tournament(
+    comparison_llm_engine: Engine,
+    comparison_prompt_config: ComparisonPromptConfig,
+    item_type: str,
+    llm_sources: list[tuple[Engine, str]],
+    comparison_budget: int,
+    include_human: bool = True,
+    item_title_like: t.Optional[list[str]] = None,
+    description_count_limit: t.Optional[int] = None,
+    round_size: int = DEFAULT_TOURNAMENT_ROUND_SIZE,
+    storage: StorageBase = DEFAULT_STORAGE,
+    seed: int = 0,
+) -> TournamentResult:
+    """
+    Ranks the description sources (humans, and every (LLM engine, generation prompt) in `llm_sources`)
+    with at most `comparison_budget` comparisons beyond the ones already stored, picked by expected
+    information gain, `round_size` at a time (run concurrently, see llm_comparison.MAX_CONCURRENT_WORKERS).
+    """
+    comparison_storage_db = open_comparison_storage_db(
+        storage=storage,
+        comparison_llm_engine=comparison_llm_engine,
+        comparison_prompt_config=comparison_prompt_config,
+    )
+    source_labels = ([HUMAN_SOURCE_LABEL] if include_human else []) + [
+        make_description_source_label(llm_engine, prompt_key) for (llm_engine, prompt_key) in llm_sources
+    ]
+    with Context(
+        name="description_tournament",
+        inputs={
+            "comparison_llm_engine": comparison_llm_engine,
+            "comparison_prompt_config": comparison_prompt_config.__dict__,
+            "item_type": item_type,
+            "sources": source_labels,
+            "comparison_budget": comparison_budget,
+            "item_title_like": item_title_like,
+        },
+        storage=storage,
+        tags=[f"item_type:{item_type}"],
+        directory=True,
+    ) as ctx:
+        items = load_tournament_items(
+            item_type=item_type,
+            llm_sources=llm_sources,
+            comparison_prompt_config=comparison_prompt_config,
+            include_human=include_human,
+            item_title_like=item_title_like,
+            description_count_limit=description_count_limit,
+        )
+        ratings = BradleyTerryRatings(source_labels)
+        pairing = _TournamentPairing(items, random.Random(seed))
+
+        def record_result(comparison: tuple[int, str, str, Description, Description], winner: t.Optional[Description]) -> None:
+            (_, source_1, source_2, description_1, _) = comparison
+            if winner is None:
+                # invalid results and ties don't say anything about the sources
+                return
+            if winner.uid == description_1.uid:
+                ratings.add_result(source_1, source_2)
+            else:
+                ratings.add_result(source_2, source_1)
+
+        # start from the results stored already (with the preloaded map of open_comparison_storage_db)
+        source_by_uid: dict[str, tuple[int, str, Description]] = {}
+        for (item_index, item) in enumerate(items):
+            for (source, descriptions) in item.descriptions_by_source.items():
+                for description in descriptions:
+                    source_by_uid.setdefault(description.uid, (item_index, source, description))
+        stored_comparison_count = 0
+        stored_winners = dict(comparison_storage_db.get_preloaded_comparisons(comparison_llm_engine, comparison_prompt_config.prompt_key) or {})
+        for ((uid_1, uid_2), stored_winner) in stored_winners.items():
+            if uid_1 not in source_by_uid or uid_2 not in source_by_uid:
+                continue
+            ((item_index, source_1, description_1), (item_index_2, source_2, description_2)) = (source_by_uid[uid_1], source_by_uid[uid_2])
+            if item_index != item_index_2 or source_1 == source_2:
+                continue
+            comparison = (item_index, source_1, source_2, description_1, description_2)
+            pairing.record(*comparison)
+            record_result(comparison, {1: description_1, 2: description_2}.get(stored_winner, None))
+            stored_comparison_count += 1
+        ratings.fit()
+        logging.info(f"# Tournament of {len(source_labels)} sources over {len(items)} items, starting from {stored_comparison_count} stored comparisons")
+
+        new_comparison_count = 0
+        with ThreadPoolExecutor(max_workers=llm_comparison.MAX_CONCURRENT_WORKERS) as thread_exec:
+            while new_comparison_count < comparison_budget:
+                comparisons = _pick_round_source_pairs(
+                    ratings=ratings,
+                    pairing=pairing,
+                    round_size=min(round_size, comparison_budget - new_comparison_count),
+                )
+                if not comparisons:
+                    logging.info("# Every comparison between the tournament's sources has been made")
+                    break
+                winners = list(thread_exec.map(
+                    lambda comparison: compare_descriptions(
+                        llm_engine=comparison_llm_engine,
+                        comparison_prompt_config=comparison_prompt_config,
+                        description_1=comparison[3],
+                        description_2=comparison[4],
+                        storage=storage,
+                        comparison_prompt_addendum=items[comparison[0]].comparison_prompt_addendum,
+                        comparison_storage_db=comparison_storage_db,
+                    ),
+                    comparisons,
+                ))
+                for (comparison, winner) in zip(comparisons, winners):
+                    record_result(comparison, winner)
+                new_comparison_count += len(comparisons)
+                ratings.fit()
+                logging.info(f"# Tournament comparisons: {new_comparison_count}/{comparison_budget}, ranking: " + ", ".join(
+                    f"{rating.source} {rating.elo_rating:.0f}±{rating.elo_standard_error:.0f}" for rating in ratings.get_ratings()
+                ))
+
+        comparison_storage_db.flush()
+        comparison_counts_by_source_pair: dict[str, int] = {}
+        for ((source_1, source_2), count) in pairing.ordered_source_pair_counts.items():
+            key = " vs ".join(sorted((source_1, source_2)))
+            comparison_counts_by_source_pair[key] = comparison_counts_by_source_pair.get(key, 0) + count
+        result = TournamentResult(
+            ratings=ratings.get_ratings(),
+            stored_comparison_count=stored_comparison_count,
+            new_comparison_count=new_comparison_count,
+            comparison_counts_by_source_pair=comparison_counts_by_source_pair,
+        )
+        logging.info(json.dumps([dataclasses.asdict(rating) for rating in result.ratings], indent=4, default=str))
+        ctx.set_result(result)
+        return result
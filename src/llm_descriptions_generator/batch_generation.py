@@ -0,0 +1,178 @@
+import logging
+import typing as t
+from pathlib import Path
+
+import llm_batch
+from llm_descriptions_generator.config import \
+    get_text_item_generation_prompt_config
+from llm_descriptions_generator.file_io import (
+    DescriptionLogWriter, compact_description_log, description_batch_exists,
+    generate_descriptions_filepath, load_description_batch_from_json_file,
+    standardize_for_filepath)
+from llm_descriptions_generator.llm_descriptions import plan_item_generations
+from llm_descriptions_generator.query_llm import \
+    make_description_from_query_result
+from llm_descriptions_generator.schema import (
+    DescriptionTextOrJson, Engine, LlmGeneratedTextItemDescriptionBatch,
+    Origin)
+
+# Batch (offline) counterpart of generate_llm_descriptions_for_item_type, see llm_batch.py.
+
+DESCRIPTION_CUSTOM_ID_PREFIX = "gen"
+
+
+def make_generation_batch_dirpath(
+    llm_engine: Engine,
+    item_type: str,
+    prompt_nickname: str,
+) -> Path:
+    return (
+        llm_batch.BATCH_REQUESTS_DIR
+        / "descriptions"
+        / standardize_for_filepath(llm_engine.value)
+        / standardize_for_filepath(item_type)
+        / standardize_for_filepath(prompt_nickname)
+    )
+
+
+def prepare_generation_batch_requests(
+    item_type: str,
+    prompt_nickname: str,
+    description_count: int,
+    llm_engine: Engine,
+    item_title_like: t.Optional[list[str]] = None,
+    dirpath: t.Optional[Path] = None,
+) -> list[Path]:
+    """
+    Writes one request per description `generate_llm_descriptions_for_item_type` would still have to
+    generate to reach `description_count` for each item, to batch request shards. Returns the new shard paths.
+    """
+    dirpath = dirpath or make_generation_batch_dirpath(llm_engine, item_type, prompt_nickname)
+    plans = plan_item_generations(
+        item_type=item_type,
+        prompt_nickname=prompt_nickname,
+        description_count=description_count,
+        llm_engine=llm_engine,
+        item_title_like=item_title_like,
+    )
+    counts = {"complete": 0, "pending": 0}
+
+    def iter_missing_description_requests() -> t.Iterator[llm_batch.BatchRequest]:
+        for plan in plans:
+            if plan.existing_description_count >= description_count:
+                counts["complete"] += 1
+                continue
+            generation_prompt = plan.generation_prompt
+            prompt = generation_prompt.prompt_text
+            if plan.output_description_type:
+                prompt = llm_batch.make_json_query_prompt(plan.output_description_type, prompt)
+            for description_index in range(plan.existing_description_count, description_count):
+                counts["pending"] += 1
+                yield llm_batch.BatchRequest(
+                    custom_id=llm_batch.make_custom_id(
+                        DESCRIPTION_CUSTOM_ID_PREFIX,
+                        llm_engine.value,
+                        generation_prompt.prompt_uid,
+                        description_index,
+                    ),
+                    engine=llm_engine,
+                    prompt=prompt,
+                    metadata={
+                        "kind": "description",
+                        "item_type": generation_prompt.item_type,
+                        "title": generation_prompt.item_title,
+                        "description_count": description_count,
+                        "generation_prompt_uid": generation_prompt.prompt_uid,
+                        "generation_prompt_nickname": generation_prompt.prompt_nickname,
+                        "generation_prompt_text": generation_prompt.prompt_text,
+                    },
+                )
+
+    shard_paths = llm_batch.write_request_shards(dirpath, iter_missing_description_requests())
+    logging.info(f"Items with enough descriptions: {counts['complete']}, descriptions pending: {counts['pending']}, new shards: {len(shard_paths)} (in {dirpath})")
+    return shard_paths
+
+
+def _save_generated_descriptions(
+    entry: dict[str, t.Any],
+    new_descriptions: list[DescriptionTextOrJson],
+) -> int:
+    llm_engine = Engine(entry["llm_engine"])
+    filepath = generate_descriptions_filepath(
+        title=entry["title"],
+        item_type=entry["item_type"],
+        origin=Origin.LLM,
+        prompt_key=entry["generation_prompt_nickname"],
+        llm_engine=llm_engine,
+    )
+    existing_descriptions = (
+        load_description_batch_from_json_file(filepath).descriptions
+        if description_batch_exists(filepath) else []
+    )
+    new_descriptions = new_descriptions[:max(0, entry["description_count"] - len(existing_descriptions))]
+    if not new_descriptions:
+        logging.info(f"{filepath.name} -- Sufficient descriptions exist, ignoring batch results")
+        return 0
+    # merged the same way as generate_llm_descriptions_for_item_type does
+    description_batch = LlmGeneratedTextItemDescriptionBatch(
+        item_type=entry["item_type"],
+        title=entry["title"],
+        descriptions=new_descriptions,
+        origin=Origin.LLM,
+        llm_engine=llm_engine,
+        generation_prompt_uid=entry["generation_prompt_uid"],
+        generation_prompt_nickname=entry["generation_prompt_nickname"],
+        generation_prompt_text=entry["generation_prompt_text"],
+    )
+    with DescriptionLogWriter(filepath, description_batch) as description_log:
+        # appended oldest first, so the first description ends up first in the batch
+        for description in reversed(new_descriptions):
+            description_log.append(description)
+    compact_description_log(filepath)
+    return len(new_descriptions)
+
+
+def ingest_generation_batch_results(dirpath: Path) -> dict[str, int]:
+    """
+    Adds the descriptions of every downloaded, not yet ingested shard in `dirpath` to the
+    `data/<type>/llm/<engine>/` JSON batches. Failed or unparseable requests are left
+    pending (a later prepare will request them again).
+    """
+    counts = {"stored": 0, "failed": 0, "unparseable": 0}
+    for requests_filepath in llm_batch.get_shard_paths(dirpath):
+        if llm_batch.is_shard_ingested(requests_filepath):
+            continue
+        # results are only saved once the whole download went through
+        if not llm_batch.is_shard_downloaded(requests_filepath):
+            continue
+
+        # (engine, prompt uid) -> (any manifest entry for the item, generated descriptions)
+        descriptions_by_item: dict[tuple[str, str], tuple[dict[str, t.Any], list[DescriptionTextOrJson]]] = {}
+        for (entry, response_text) in llm_batch.iter_shard_results(requests_filepath):
+            if response_text is None:
+                counts["failed"] += 1
+                continue
+            generation_config = get_text_item_generation_prompt_config(
+                item_type=entry["item_type"],
+                prompt_nickname=entry["generation_prompt_nickname"],
+            )
+            desc = response_text
+            if generation_config.output_description_type:
+                desc = llm_batch.parse_json_response(generation_config.output_description_type, response_text)
+                if desc is None:
+                    counts["unparseable"] += 1
+                    continue
+            item_key = (entry["llm_engine"], entry["generation_prompt_uid"])
+            descriptions_by_item.setdefault(item_key, (entry, []))[1].append(
+                make_description_from_query_result(desc, generation_config.output_description_type)
+            )
+
+        shard_stored_count = 0
+        for (entry, new_descriptions) in descriptions_by_item.values():
+            shard_stored_count += _save_generated_descriptions(entry, new_descriptions)
+        counts["stored"] += shard_stored_count
+        llm_batch.mark_shard_ingested(requests_filepath, shard_stored_count)
+        logging.info(f"Ingested {shard_stored_count} descriptions from {requests_filepath.name}")
+
+    logging.info(f"Description batch results ingested from {dirpath}: {counts}")
+    return counts
@@ -0,0 +1,268 @@
+import fnmatch
+import functools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import typing as t
+from pathlib import Path
+
+from pydantic.dataclasses import dataclass
+
+from llm_descriptions_generator.schema import Origin
+
+# Persistent catalog of the description batch files under data/ (title, engine, prompt nickname,
+# description count, ...), so that loaders find files and count descriptions with a query instead
+# of globbing directories and parsing every JSON file.
+#
+# The catalog of a directory is refreshed on every lookup, but only files whose mtime or size
+# changed since are parsed again. Description logs (see file_io.DescriptionLogWriter) are indexed
+# up to a byte offset, so a grown log only has its new lines parsed.
+
+CATALOG_DB_FILENAME = ".catalog.sqlite"
+SQLITE_TIMEOUT_SECONDS = 30
+# Append-only description logs, see file_io.DescriptionLogWriter
+DESCRIPTION_LOG_FILE_EXTENSION = ".jsonl"
+
+CATALOG_SCHEMA = [
+    """
+CREATE TABLE IF NOT EXISTS description_batch_files (
+    -- relative to the data directory, always the `.json` path (even if only the log exists so far)
+    path TEXT PRIMARY KEY,
+    dirpath TEXT,
+    filename TEXT,
+
+    item_type TEXT,
+    origin TEXT,
+    llm_engine TEXT,
+    prompt_nickname TEXT,
+    title TEXT,
+    -- descriptions of the batch, as loaded (`.json` batch + its log)
+    description_count INTEGER,
+
+    -- `.json` batch file (NULLs if there is none)
+    json_mtime_ns INTEGER,
+    json_size INTEGER,
+    json_description_count INTEGER,
+
+    -- description log (NULLs if there is none)
+    log_inode INTEGER,
+    log_mtime_ns INTEGER,
+    -- byte offset the log has been parsed up to (end of its last complete line)
+    log_offset INTEGER,
+    log_base_description_count INTEGER,
+    log_description_count INTEGER,
+    log_header TEXT
+);""",
+    """
+CREATE INDEX IF NOT EXISTS description_batch_files_dirpath_index ON description_batch_files (dirpath);
+""",
+]
+
+CATALOG_COLUMNS = [
+    "path", "dirpath", "filename", "item_type", "origin", "llm_engine", "prompt_nickname", "title",
+    "description_count", "json_mtime_ns", "json_size", "json_description_count", "log_inode",
+    "log_mtime_ns", "log_offset", "log_base_description_count", "log_description_count", "log_header",
+]
+
+
+@dataclass
+class DataCatalogEntry:
+    filepath: Path
+    item_type: str
+    origin: Origin
+    title: str
+    description_count: int
+    llm_engine: t.Optional[str] = None
+    prompt_nickname: t.Optional[str] = None
+
+
+def filter_entries_by_filename(
+    entries: list["DataCatalogEntry"],
+    filename_pattern: str,
+) -> list["DataCatalogEntry"]:
+    """Entries whose (`.json`) filename matches the glob pattern, like `Path.glob` would."""
+    return [entry for entry in entries if fnmatch.fnmatchcase(entry.filepath.name, filename_pattern)]
+
+
+def _read_json_batch_metadata(filepath: Path, item_type: str, origin: Origin) -> dict[str, t.Any]:
+    with open(filepath) as f:
+        data = json.load(f)
+    if item_type == "paper" and origin == Origin.Human:
+        # raw paper data (see file_io.load_all_academic_papers_as_description_batches): one description
+        return {
+            "item_type": item_type,
+            "origin": str(Origin.Human),
+            "title": data.get("title", None) or filepath.stem,
+            "description_count": 1,
+        }
+    return {
+        "item_type": data.get("item_type", item_type),
+        "origin": data.get("origin", str(origin)),
+        "llm_engine": data.get("llm_engine", None),
+        "prompt_nickname": data.get("generation_prompt_nickname", None),
+        "title": data.get("title", filepath.stem),
+        "description_count": len(data.get("descriptions", [])),
+    }
+
+
+class DataCatalog:
+    def __init__(self, data_dirpath: Path):
+        self.data_dirpath = Path(data_dirpath).resolve()
+        path = self.data_dirpath / CATALOG_DB_FILENAME
+        logging.info(f"Opening data catalog at {path}")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=SQLITE_TIMEOUT_SECONDS)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for schema in CATALOG_SCHEMA:
+            self._conn.execute(schema)
+        self._conn.commit()
+
+    def _relative(self, path: Path) -> str:
+        return Path(path).resolve().relative_to(self.data_dirpath).as_posix()
+
+    def get_entries(
+        self,
+        dirpath: Path,
+        item_type: str,
+        origin: Origin,
+    ) -> list[DataCatalogEntry]:
+        """Every description batch in the directory (refreshing the catalog of it first), sorted by filename."""
+        with self._lock:
+            self._refresh_directory(Path(dirpath), item_type, origin)
+            rows = self._conn.execute(
+                "SELECT * FROM description_batch_files WHERE dirpath = ? ORDER BY filename",
+                (self._relative(dirpath),),
+            ).fetchall()
+        return [
+            DataCatalogEntry(
+                filepath=self.data_dirpath / row["path"],
+                item_type=row["item_type"],
+                origin=Origin(row["origin"]),
+                title=row["title"],
+                description_count=row["description_count"],
+                llm_engine=row["llm_engine"],
+                prompt_nickname=row["prompt_nickname"],
+            )
+            for row in rows
+        ]
+
+    def _refresh_directory(self, dirpath: Path, item_type: str, origin: Origin) -> None:
+        relative_dirpath = self._relative(dirpath)
+        rows_by_path = {
+            row["path"]: dict(row)
+            for row in self._conn.execute(
+                "SELECT * FROM description_batch_files WHERE dirpath = ?", (relative_dirpath,)
+            )
+        }
+        # `.json` filename -> (stat of the `.json` file, stat of the log)
+        stats: dict[str, list[t.Optional[os.stat_result]]] = {}
+        if dirpath.is_dir():
+            with os.scandir(dirpath) as dir_entries:
+                for dir_entry in dir_entries:
+                    if dir_entry.name.endswith(".json") and dir_entry.is_file():
+                        stats.setdefault(dir_entry.name, [None, None])[0] = dir_entry.stat()
+                    elif (
+                        origin == Origin.LLM
+                        and dir_entry.name.endswith(DESCRIPTION_LOG_FILE_EXTENSION)
+                        and dir_entry.is_file()
+                    ):
+                        filename = dir_entry.name[:-len(DESCRIPTION_LOG_FILE_EXTENSION)] + ".json"
+                        stats.setdefault(filename, [None, None])[1] = dir_entry.stat()
+
+        updated_rows: list[dict[str, t.Any]] = []
+        for (filename, (json_stat, log_stat)) in stats.items():
+            path = f"{relative_dirpath}/{filename}"
+            row = rows_by_path.get(path, None) or {"path": path, "dirpath": relative_dirpath, "filename": filename}
+            changed = False
+            if json_stat is None:
+                if row.get("json_mtime_ns", None) is not None:
+                    row.update(json_mtime_ns=None, json_size=None, json_description_count=None)
+                    changed = True
+            elif (row.get("json_mtime_ns", None), row.get("json_size", None)) != (json_stat.st_mtime_ns, json_stat.st_size):
+                metadata = _read_json_batch_metadata(dirpath / filename, item_type, origin)
+                row.update(
+                    json_mtime_ns=json_stat.st_mtime_ns,
+                    json_size=json_stat.st_size,
+                    json_description_count=metadata.pop("description_count"),
+                    **{"llm_engine": None, "prompt_nickname": None, **metadata},
+                )
+                changed = True
+            if log_stat is None:
+                if row.get("log_inode", None) is not None:
+                    row.update(log_inode=None, log_mtime_ns=None, log_offset=None, log_base_description_count=None, log_description_count=None, log_header=None)
+                    changed = True
+            elif (row.get("log_inode", None), row.get("log_mtime_ns", None)) != (log_stat.st_ino, log_stat.st_mtime_ns):
+                self._index_log(dirpath / filename, row, log_stat)
+                changed = True
+            if changed or path not in rows_by_path:
+                self._update_description_count(row, item_type, origin)
+                updated_rows.append(row)
+
+        removed_paths = [path for path in rows_by_path if path.rsplit("/", 1)[-1] not in stats]
+        if not updated_rows and not removed_paths:
+            return
+        with self._conn:
+            self._conn.executemany("DELETE FROM description_batch_files WHERE path = ?", [(path,) for path in removed_paths])
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO description_batch_files ({', '.join(CATALOG_COLUMNS)}) VALUES ({', '.join('?' for _ in CATALOG_COLUMNS)})",
+                [tuple(row.get(column, None) for column in CATALOG_COLUMNS) for row in updated_rows],
+            )
+        logging.info(f"Data catalog of {relative_dirpath}: {len(updated_rows)} files (re)indexed, {len(removed_paths)} removed")
+
+    def _index_log(self, filepath: Path, row: dict[str, t.Any], log_stat: os.stat_result) -> None:
+        log_filepath = filepath.with_suffix(DESCRIPTION_LOG_FILE_EXTENSION)
+        if row.get("log_inode", None) != log_stat.st_ino or (row.get("log_offset", None) or 0) > log_stat.st_size:
+            # new (or replaced) log, parse from the start
+            row.update(log_offset=0, log_base_description_count=None, log_description_count=0, log_header=None)
+        with open(log_filepath, "rb") as f:
+            f.seek(row["log_offset"])
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # partial last line (being written, or left by a crash), parsed once complete
+                    break
+                row["log_offset"] += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "header" in record:
+                    header = dict(record["header"])
+                    row["log_base_description_count"] = header.pop("base_description_count", 0)
+                    row["log_header"] = json.dumps(header)
+                else:
+                    row["log_description_count"] += 1
+        row.update(log_inode=log_stat.st_ino, log_mtime_ns=log_stat.st_mtime_ns)
+
+    def _update_description_count(self, row: dict[str, t.Any], item_type: str, origin: Origin) -> None:
+        json_description_count = row.get("json_description_count", None)
+        description_count = json_description_count or 0
+        log_header = json.loads(row["log_header"]) if row.get("log_header", None) else None
+        # the log only counts if it was started on top of the current `.json` batch (see file_io)
+        if log_header is not None and description_count == row["log_base_description_count"]:
+            description_count += row["log_description_count"]
+        if json_description_count is None and log_header is not None:
+            row.update(
+                item_type=log_header.get("item_type", item_type),
+                origin=log_header.get("origin", str(origin)),
+                llm_engine=log_header.get("llm_engine", None),
+                prompt_nickname=log_header.get("generation_prompt_nickname", None),
+                title=log_header.get("title", row["filename"][:-len(".json")]),
+            )
+        row.setdefault("item_type", item_type)
+        row.setdefault("origin", str(origin))
+        row.setdefault("title", row["filename"][:-len(".json")])
+        row["description_count"] = description_count
+
+
+@functools.lru_cache(maxsize=None)
+def _get_data_catalog(data_dirpath: Path) -> DataCatalog:
+    return DataCatalog(data_dirpath)
+
+
+def get_data_catalog(data_dirpath: Path) -> DataCatalog:
+    """The process-wide catalog of the data directory."""
+    return _get_data_catalog(Path(data_dirpath).resolve())
@@ -1,18 +1,30 @@
 import json
 import logging
+import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Literal, Optional
 
 import toml
 
+from llm_descriptions_generator.data_catalog import (
+    DESCRIPTION_LOG_FILE_EXTENSION, DataCatalogEntry, filter_entries_by_filename,
+    get_data_catalog)
+from llm_descriptions_generator.paper_corpus import get_paper_corpus
 from llm_descriptions_generator.schema import (
-    Engine, HumanTextItemDescriptionBatch,
+    DescriptionTextOrJson, Engine, HumanTextItemDescriptionBatch,
     LlmGeneratedTextItemDescriptionBatch, Origin, TextItemDescriptionBatch)
 
 THIS_FILE_DIR = Path(__file__).parent.resolve()
 DATA_DIR = THIS_FILE_DIR / "../../data"
 
+# fsync a description log after this many appended descriptions (and on close)
+DESCRIPTION_LOG_FSYNC_EVERY = 16
+# parsing description batch files in bulk, see load_llm_description_batches_by_title
+MAX_CONCURRENT_LOAD_WORKERS = 8
+
 
 # DEPRECATED (see json files instead)
 def load_human_text_item_descriptions_from_toml_file(
@@ -119,24 +131,210 @@ def save_description_batch_to_json_file(
     # create directory if not exists
     filepath.parent.mkdir(exist_ok=True, parents=True) 
 
-    with open(filepath, "w") as file:
+    # written to a temporary file first, so a crash mid-write doesn't corrupt the existing batch
+    tmp_filepath = filepath.with_name(f"{filepath.name}.tmp")
+    with open(tmp_filepath, "w") as file:
         json.dump(description_batch.__dict__, file, ensure_ascii=False, indent=4)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_filepath, filepath)
 
     logging.info(f"Saved description_batch to: {filepath}")
 
 
-def load_description_batch_from_json_file(
-    filepath: str,
-) -> TextItemDescriptionBatch:
-    logging.info(f"Loading descriptions from: {filepath}")
-    with open(filepath) as f:
-        data = json.load(f)
+def make_description_batch_from_data(data: dict) -> TextItemDescriptionBatch:
     origin = data.get("origin")
     if origin == Origin.LLM:
         return LlmGeneratedTextItemDescriptionBatch(**data)
     if origin == Origin.Human:
         return HumanTextItemDescriptionBatch(**data)
-    raise f"Unrecognized origin: {origin}"
+    raise Exception(f"Unrecognized origin: {origin}")
+
+
+def get_description_log_filepath(filepath: Path) -> Path:
+    """The append-only log of the description batch saved at `filepath` (`.json`)."""
+    return Path(filepath).with_suffix(DESCRIPTION_LOG_FILE_EXTENSION)
+
+
+def description_batch_exists(filepath: Path) -> bool:
+    return Path(filepath).exists() or get_description_log_filepath(filepath).exists()
+
+
+def _read_description_log(log_filepath: Path) -> tuple[Optional[dict], list[DescriptionTextOrJson]]:
+    """Returns the log header and the logged descriptions in append order."""
+    header = None
+    descriptions: list[DescriptionTextOrJson] = []
+    with open(log_filepath, "rb") as f:
+        for (line_index, line) in enumerate(f):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # only a crash mid-append leaves a partial line
+                logging.warning(f"Skipping incomplete line {line_index + 1} of description log {log_filepath}")
+                continue
+            if "header" in record:
+                header = record["header"]
+            else:
+                descriptions.append(record["description"])
+    return (header, descriptions)
+
+
+class DescriptionLogWriter:
+    """
+    Appends new descriptions of one description batch to its log (`<batch>.jsonl` next to
+    `<batch>.json`) instead of rewriting the whole batch file for every description.
+
+    The first line of a log is a header with the batch fields (without descriptions) and the
+    number of descriptions the `.json` batch had when the log was started, every following
+    line is one description. Each line is written with a single O_APPEND write, so a crash
+    can at most leave a partial last line, which loading skips. Writes are fsynced every
+    DESCRIPTION_LOG_FSYNC_EVERY descriptions and on close.
+
+    `load_description_batch_from_json_file` merges the log into the batch, newest descriptions
+    first (the order the whole-file rewrites produced); `compact_description_log` folds it
+    back into the `.json` batch.
+    """
+
+    def __init__(self, filepath: Path, description_batch: TextItemDescriptionBatch):
+        self.filepath = Path(filepath)
+        self.log_filepath = get_description_log_filepath(self.filepath)
+        self.log_filepath.parent.mkdir(exist_ok=True, parents=True)
+        self._lock = threading.Lock()
+        self._unsynced_count = 0
+        self._fd = os.open(self.log_filepath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        size = os.fstat(self._fd).st_size
+        if size == 0:
+            header = {k: v for (k, v) in description_batch.__dict__.items() if k != "descriptions"}
+            header["base_description_count"] = (
+                len(load_json_description_batch_data(self.filepath)["descriptions"])
+                if self.filepath.exists() else 0
+            )
+            self._write_line({"header": header})
+        elif not self._ends_with_newline(size):
+            # terminate a partial line left by a crash, so it doesn't swallow the next description
+            os.write(self._fd, b"\n")
+
+    def _ends_with_newline(self, size: int) -> bool:
+        with open(self.log_filepath, "rb") as f:
+            f.seek(size - 1)
+            return f.read(1) == b"\n"
+
+    def _write_line(self, record: dict) -> None:
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        os.write(self._fd, line)
+
+    def append(self, description: DescriptionTextOrJson) -> None:
+        with self._lock:
+            self._write_line({"description": description})
+            self._unsynced_count += 1
+            if self._unsynced_count >= DESCRIPTION_LOG_FSYNC_EVERY:
+                os.fsync(self._fd)
+                self._unsynced_count = 0
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fd is None:
+                return
+            os.fsync(self._fd)
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self) -> "DescriptionLogWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def load_json_description_batch_data(filepath: Path) -> dict:
+    with open(filepath) as f:
+        return json.load(f)
+
+
+def load_description_batch_from_json_file(
+    filepath: str,
+) -> TextItemDescriptionBatch:
+    """
+    Loads the description batch saved at `filepath`, including the descriptions in its
+    append-only log, if any (see DescriptionLogWriter). `filepath` may also be the log path.
+    """
+    filepath = Path(filepath).with_suffix(".json")
+    log_filepath = get_description_log_filepath(filepath)
+    logging.info(f"Loading descriptions from: {filepath}")
+    data = load_json_description_batch_data(filepath) if filepath.exists() else None
+    if log_filepath.exists():
+        (header, logged_descriptions) = _read_description_log(log_filepath)
+        if header is None:
+            raise Exception(f"Description log {log_filepath} has no header")
+        base_description_count = header.pop("base_description_count")
+        if data is None:
+            data = {**header, "descriptions": []}
+        if len(data["descriptions"]) == base_description_count:
+            data["descriptions"] = list(reversed(logged_descriptions)) + data["descriptions"]
+        else:
+            # the batch file changed since the log was started: the log was already compacted
+            # into it, but the compaction was interrupted before removing the log
+            logging.warning(f"Ignoring already compacted description log {log_filepath}")
+    if data is None:
+        raise FileNotFoundError(f"No description batch at {filepath}")
+    return make_description_batch_from_data(data)
+
+
+def compact_description_log(filepath: Path) -> bool:
+    """
+    Folds the append-only log of the description batch at `filepath` into the `.json` batch
+    file (in the usual batch JSON shape) and removes the log. Returns whether there was a log.
+    Must not run while a DescriptionLogWriter for the batch is open.
+    """
+    filepath = Path(filepath).with_suffix(".json")
+    log_filepath = get_description_log_filepath(filepath)
+    if not log_filepath.exists():
+        return False
+    description_batch = load_description_batch_from_json_file(filepath)
+    save_description_batch_to_json_file(description_batch=description_batch, filepath=filepath)
+    log_filepath.unlink()
+    logging.info(f"Compacted description log {log_filepath}")
+    return True
+
+
+def get_description_batch_catalog_entries(
+    item_type: str,
+    origin: Origin,
+    llm_engine: Optional[Engine] = None,
+) -> list[DataCatalogEntry]:
+    """Catalog entries (see data_catalog.py) of every description batch in the item type/origin(/engine) directory."""
+    dirpath = generate_descriptions_dirpath(
+        item_type=item_type,
+        origin=origin,
+        llm_engine=llm_engine,
+    )
+    return get_data_catalog(DATA_DIR).get_entries(dirpath, item_type, origin)
+
+
+def find_description_batch_filepaths(
+    item_type: str,
+    origin: Origin,
+    filename_pattern: str,
+    llm_engine: Optional[Engine] = None,
+) -> list[Path]:
+    """
+    Like `dirpath.glob(filename_pattern)` for a `*.json` pattern in the item type/origin(/engine)
+    directory, but looked up in the data catalog. Includes batches that only have a log so far.
+    """
+    entries = get_description_batch_catalog_entries(item_type, origin, llm_engine)
+    return [entry.filepath for entry in filter_entries_by_filename(entries, filename_pattern)]
+
+
+def compact_all_description_logs(item_type: Optional[str] = None) -> int:
+    """Compacts the LLM description logs of all (or one) item types. Returns the number compacted."""
+    item_type_glob = standardize_for_filepath(item_type) if item_type else "*"
+    log_filepaths = DATA_DIR.glob(
+        f"{item_type_glob}/{standardize_for_filepath(Origin.LLM)}/*/*{DESCRIPTION_LOG_FILE_EXTENSION}"
+    )
+    compacted_count = 0
+    for log_filepath in sorted(log_filepaths):
+        compacted_count += compact_description_log(log_filepath)
+    return compacted_count
 
 
 # Special loader just for academic paper raw data.
@@ -151,49 +349,30 @@ def load_all_academic_papers_as_description_batches(
     if item_type != "paper":
         raise("Method only allowed for item_type='paper'")
 
-    dirpath = generate_descriptions_dirpath(
-        item_type=item_type,
-        origin=Origin.Human,
-    )
-    
-    filepaths = []
+    # packed corpus (see paper_corpus.py): only titles and abstracts are read here, bodies are
+    # sliced from the memory-mapped corpus data when something reads them
+    corpus = get_paper_corpus(generate_descriptions_dirpath(item_type=item_type, origin=Origin.Human))
+    entries = []
     if item_title_like:
         # case sensitivity hack...
-        all_json_filepaths = dirpath.glob("*.json")
-        for filepath in all_json_filepaths:
+        for entry in corpus.entries:
             for partial_filename in item_title_like:
-                if to_safe_filename(partial_filename) in to_safe_filename(str(filepath.name)):
-                    filepaths.append(filepath)
+                if to_safe_filename(partial_filename) in to_safe_filename(entry.filename):
+                    entries.append(entry)
     else:
-        filepaths = dirpath.glob("*.json")
+        entries = corpus.entries
 
     text_item_description_batches: list[HumanTextItemDescriptionBatch] = []
-    for filepath in filepaths:
-        with open(filepath, "r") as f:
-            paper_data = json.load(f)
-        
-        # if no title in data, use filename as title
-        title = paper_data.get("title", None)
-        if not title:
-            title = filepath.stem # without file extension
-        
-        abstract = paper_data.get("abstract", None)
-        if not abstract:
-            # try XML field if non-xml not found
-            abstract = paper_data.get("abstract_xml", None)
-        if not abstract:
-            raise Exception(f"Paper file {filepath} is missing the 'abstract' attribute")
-        
-        if len(abstract) <= 20:
-            raise Exception(f"Paper file {filepath} abstract has a suspiciously small character count. Maybe bad data?")
-        
-        body = paper_data.get("article", None)
-        if not body:
-            raise Exception(f"Paper file {filepath} is missing the 'article' attribute")
-        
+    for entry in entries:
+        if entry.error:
+            raise Exception(entry.error)
+        abstract = entry.abstract
+        body = corpus.get_body(entry)
+
         if fill_description_with == "abstract":
             descriptions = [abstract]
         elif fill_description_with == "body":
+            body = body.read()
             descriptions = [body]
         else:
             # should be impossible to get here if pydantic is working
@@ -202,7 +381,7 @@ def load_all_academic_papers_as_description_batches(
         text_item_description_batches.append(
             HumanTextItemDescriptionBatch(
                 item_type=item_type,
-                title=title,
+                title=entry.title,
                 descriptions=descriptions,
                 origin=Origin.Human,
                 meta=dict(abstract=abstract, body=body),
@@ -238,9 +417,9 @@ def load_all_human_description_batches(
     if item_title_like:
         for title_fragment in item_title_like:
             partial_filename = to_safe_filename(title_text=title_fragment)
-            filepaths += dirpath.glob(f"*{partial_filename}*.json")
+            filepaths += find_description_batch_filepaths(item_type, Origin.Human, f"*{partial_filename}*.json")
     else:
-        filepaths = dirpath.glob("*.json")
+        filepaths = find_description_batch_filepaths(item_type, Origin.Human, "*.json")
 
     human_item_description_batches = [
         load_description_batch_from_json_file(filepath) for filepath in filepaths
@@ -255,20 +434,14 @@ def load_all_llm_json_summary_batches(
 ) -> list[LlmGeneratedTextItemDescriptionBatch]:
     LATEST_JSON_SUMMARY_ENGINE = Engine.gpt4turbo
     LATEST_JSON_SUMMARY_PROMPT_NICKNAME = "jsonify_key_details"
-    
-    dirpath = generate_descriptions_dirpath(
-        item_type=item_type,
-        origin=Origin.LLM,
-        llm_engine=LATEST_JSON_SUMMARY_ENGINE,
-    )
 
     filepaths = []
     if item_title_like:
         for title_fragment in item_title_like:
             partial_filename = to_safe_filename(title_text=title_fragment)
-            filepaths += dirpath.glob(f"*{partial_filename}*{LATEST_JSON_SUMMARY_PROMPT_NICKNAME}*.json")
+            filepaths += find_description_batch_filepaths(item_type, Origin.LLM, f"*{partial_filename}*{LATEST_JSON_SUMMARY_PROMPT_NICKNAME}*.json", LATEST_JSON_SUMMARY_ENGINE)
     else:
-        filepaths = dirpath.glob(f"*{LATEST_JSON_SUMMARY_PROMPT_NICKNAME}*.json")
+        filepaths = find_description_batch_filepaths(item_type, Origin.LLM, f"*{LATEST_JSON_SUMMARY_PROMPT_NICKNAME}*.json", LATEST_JSON_SUMMARY_ENGINE)
 
     description_batches: list[LlmGeneratedTextItemDescriptionBatch] = [
         load_description_batch_from_json_file(filepath) for filepath in filepaths
@@ -288,13 +461,8 @@ def load_all_llm_description_batches(
     else:
         llm_engines = [e for e in Engine]
     
-    filepaths: Path = []
+    filepaths: list[Path] = []
     for engine in llm_engines:
-        dirpath = generate_descriptions_dirpath(
-            item_type=item_type,
-            origin=Origin.LLM,
-            llm_engine=engine,
-        )
         glob_str = "*.json"
         if prompt_nickname:
             glob_str = f"*{prompt_nickname}.json"
@@ -306,9 +474,9 @@ def load_all_llm_description_batches(
             )
             glob_str = f"*{partial_filename}{glob_str}"
         # elif prompt_uid:
-        #     filepaths += dirpath.glob(f"*{prompt_uid}*.json")
+        #     filepaths += find_description_batch_filepaths(item_type, Origin.LLM, f"*{prompt_uid}*.json", engine)
 
-        filepaths = dirpath.glob(glob_str)
+        filepaths += find_description_batch_filepaths(item_type, Origin.LLM, glob_str, engine)
     
     llm_description_batches: list[LlmGeneratedTextItemDescriptionBatch] = []
     for filepath in filepaths:
@@ -322,3 +490,32 @@ def load_all_llm_description_batches(
             if batch.generation_prompt_nickname == prompt_nickname
         ]
     return llm_description_batches
+
+
+def load_llm_description_batches_by_title(
+    item_type: str,
+    llm_engines: Optional[list[Engine]] = None,
+    prompt_nickname: Optional[str] = None,
+    max_workers: int = MAX_CONCURRENT_LOAD_WORKERS,
+) -> dict[str, list[LlmGeneratedTextItemDescriptionBatch]]:
+    """
+    Every LLM description batch of the item type (of the given engines, default: all, and
+    generation prompt), keyed by item title. Each engine directory is looked up in the data
+    catalog once and its files are parsed in a thread pool, so callers comparing many items
+    load once per run instead of once per item. Batches of a title are in engine, then filename order.
+    """
+    filepaths: list[Path] = []
+    for engine in (llm_engines or list(Engine)):
+        for entry in get_description_batch_catalog_entries(item_type, Origin.LLM, engine):
+            if prompt_nickname and entry.prompt_nickname != prompt_nickname:
+                continue
+            filepaths.append(entry.filepath)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as thread_exec:
+        llm_description_batches = list(thread_exec.map(load_description_batch_from_json_file, filepaths))
+
+    llm_description_batches_by_title: dict[str, list[LlmGeneratedTextItemDescriptionBatch]] = {}
+    for llm_description_batch in llm_description_batches:
+        llm_description_batches_by_title.setdefault(llm_description_batch.title, []).append(llm_description_batch)
+    logging.info(f"Loaded {len(llm_description_batches)} LLM description batches of {len(llm_description_batches_by_title)} {item_type} items")
+    return llm_description_batches_by_title
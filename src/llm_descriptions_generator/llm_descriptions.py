@@ -1,136 +1,261 @@
+import contextvars
 import logging
 import typing as t
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
 
-import openai
-import tiktoken
 from interlab.context import Context, FileStorage
+from pydantic.dataclasses import dataclass
 
 from llm_descriptions_generator.config import \
     get_text_item_generation_prompt_config
 from llm_descriptions_generator.file_io import (
-    generate_descriptions_filepath,
+    DescriptionLogWriter, compact_description_log,
+    generate_descriptions_filepath, get_description_batch_catalog_entries,
     load_all_academic_papers_as_description_batches,
     load_all_human_description_batches, load_all_llm_json_summary_batches,
-    load_description_batch_from_json_file, save_description_batch_to_json_file)
+    load_description_batch_from_json_file)
 from llm_descriptions_generator.prompt_generation import \
     create_text_item_generation_prompt_from_config
-from llm_descriptions_generator.query_llm import generate_llm_descriptions
+from llm_descriptions_generator.query_llm import (
+    generate_llm_descriptions, get_generation_samples_per_request)
 from llm_descriptions_generator.schema import (
     Engine, LlmGeneratedTextItemDescriptionBatch, Origin,
-    PromptDescriptionSource, TextItemDescriptionBatch)
+    PromptDescriptionSource, TextItemDescriptionBatch, TextItemGenerationPrompt,
+    TextItemGenerationPromptConfig)
+from response_cache import log_response_cache_stats
 from storage import cache_friendly_file_storage
+from token_budget import split_over_budget_generation_prompts
 
 DEFAULT_ENGINE = Engine.gpt35turbo
 DEFAULT_STORAGE = cache_friendly_file_storage
+# Generation queries in flight at once, across all items (the provider's rate limiter may allow fewer)
+MAX_CONCURRENT_GENERATION_WORKERS = 16
 
-def generate_llm_descriptions_for_item_type(
+def load_generation_source_description_batches(
+    generation_config: TextItemGenerationPromptConfig,
+    item_type: str,
+    item_title_like: t.Optional[list[str]] = None,
+) -> list[TextItemDescriptionBatch]:
+    if generation_config.description_source == PromptDescriptionSource.Human:
+        return load_all_human_description_batches(
+            item_type=item_type,
+            item_title_like=item_title_like,
+        )
+    if generation_config.description_source == PromptDescriptionSource.LLM_JSON_Summary:
+        return load_all_llm_json_summary_batches(
+            item_type=item_type,
+            item_title_like=item_title_like,
+        )
+    if generation_config.description_source == PromptDescriptionSource.AcademicPaperBody:
+        return load_all_academic_papers_as_description_batches(
+            item_type=item_type,
+            fill_description_with="body",
+            item_title_like=item_title_like,
+        )
+    return []
+
+
+@dataclass
+class ItemGenerationPlan:
+    generation_prompt: TextItemGenerationPrompt
+    output_description_type: t.Optional[t.Any]
+    filepath: Path
+    description_count: int
+    existing_description_count: int = 0
+
+
+def plan_item_generations(
     item_type: str,
     prompt_nickname: str,
     description_count: int,
+    llm_engine: Engine,
+    item_title_like: t.Optional[list[str]] = None,
+) -> list[ItemGenerationPlan]:
+    """
+    Target description file and existing description count of every item of the type, for one prompt + engine.
+    Items still missing descriptions whose prompt is too long for the engine are reported and skipped.
+    """
+    generation_config = get_text_item_generation_prompt_config(
+        item_type=item_type,
+        prompt_nickname=prompt_nickname,
+    )
+    source_description_batches = load_generation_source_description_batches(
+        generation_config=generation_config,
+        item_type=item_type,
+        item_title_like=item_title_like,
+    )
+    # counted in the data catalog, without loading the existing descriptions
+    existing_description_counts = {
+        entry.filepath: entry.description_count
+        for entry in get_description_batch_catalog_entries(item_type, Origin.LLM, llm_engine)
+    }
+
+    plans: list[ItemGenerationPlan] = []
+    for source_description_batch in source_description_batches:
+        generation_prompt = create_text_item_generation_prompt_from_config(
+            config=generation_config,
+            source_description_batch=source_description_batch,
+        )
+        filepath = generate_descriptions_filepath(
+            title=generation_prompt.item_title, 
+            item_type=generation_prompt.item_type,
+            origin=Origin.LLM,
+            # prompt_uid=generation_prompt.prompt_uid,
+            prompt_key=generation_prompt.prompt_nickname,
+            llm_engine=llm_engine,
+        )
+        existing_description_count = existing_description_counts.get(filepath.resolve(), None)
+        if existing_description_count is None:
+            logging.info(f"No existing data found at: {filepath}")
+        plan = ItemGenerationPlan(
+            generation_prompt=generation_prompt,
+            output_description_type=generation_config.output_description_type,
+            filepath=filepath,
+            description_count=description_count,
+            existing_description_count=existing_description_count or 0,
+        )
+        if plan.existing_description_count >= description_count:
+            logging.info(f"{filepath.name} -- Sufficient descriptions exist ({plan.existing_description_count}/{description_count})")
+        else:
+            logging.info(f"{filepath.name} -- Description count at: ({plan.existing_description_count}/{description_count})")
+        plans.append(plan)
+
+    (_, over_budget_prompts) = split_over_budget_generation_prompts(
+        [plan.generation_prompt for plan in plans if plan.existing_description_count < description_count],
+        llm_engine,
+    )
+    over_budget_prompt_uids = set(generation_prompt.prompt_uid for generation_prompt in over_budget_prompts)
+    return [plan for plan in plans if plan.generation_prompt.prompt_uid not in over_budget_prompt_uids]
+
+
+def _merge_new_descriptions(
+    plan: ItemGenerationPlan,
+    llm_description_batch: LlmGeneratedTextItemDescriptionBatch,
+    description_log: DescriptionLogWriter,
+) -> None:
+    # appended oldest first, so the first new description ends up first in the batch
+    for description in reversed(llm_description_batch.descriptions):
+        description_log.append(description)
+    plan.existing_description_count += len(llm_description_batch.descriptions)
+
+
+def generate_missing_llm_descriptions(
+    item_prompts: list[tuple[str, str]],
+    description_count: int,
     llm_engine: Engine = DEFAULT_ENGINE,
     item_title_like: t.Optional[list[str]] = None,
+    max_workers: int = MAX_CONCURRENT_GENERATION_WORKERS,
 ) -> list[LlmGeneratedTextItemDescriptionBatch]:
+    """
+    Makes sure at least `description_count` descriptions exist for every item of every
+    (item_type, prompt_nickname) in `item_prompts`.
+
+    The missing descriptions of all items are counted up front, and every one of them (or,
+    for engines that return several samples per request, every group of up to
+    MAX_SAMPLES_PER_REQUEST of an item) is an independent generation query in one shared
+    worker pool (the provider's rate limiter bounds the actual concurrency). New descriptions are appended to their item's description
+    log as they arrive, so an interrupted run picks up where it left off, and the logs are
+    compacted into the items' batch files at the end.
+
+    Returns the description batch of every item, including those that already had enough
+    descriptions (but not items skipped for prompts over the engine's token budget).
+    """
     with Context(
         name="generate_descriptions",
         storage=DEFAULT_STORAGE,
         inputs={
-            "item_type": item_type,
-            "prompt_nickname": prompt_nickname,
+            "item_prompts": item_prompts,
             "description_count": description_count,
             "llm_engine": llm_engine,
             "item_title_like": item_title_like,
         },
-        tags=[
-            f"engine:{llm_engine}",
-            f"item_type:{item_type}",
+        tags=[f"engine:{llm_engine}"] + [
+            f"item_type:{item_type}" for item_type in sorted(set(item_type for (item_type, _) in item_prompts))
         ],
         directory=True,
     ) as ctx:
-        # ctx = current_context()
-        generation_config = get_text_item_generation_prompt_config(
-            item_type=item_type,
-            prompt_nickname=prompt_nickname,
-        )
-
-        source_description_batches: list[TextItemDescriptionBatch] = []
-
-        if generation_config.description_source == PromptDescriptionSource.Human:
-            source_description_batches = load_all_human_description_batches(
-                item_type=item_type,
-                item_title_like=item_title_like,
-            )
-        elif generation_config.description_source == PromptDescriptionSource.LLM_JSON_Summary:
-            source_description_batches = load_all_llm_json_summary_batches(
-                item_type=item_type,
-                item_title_like=item_title_like,
-            )
-        elif generation_config.description_source == PromptDescriptionSource.AcademicPaperBody:
-            source_description_batches = load_all_academic_papers_as_description_batches(
+        plans: list[ItemGenerationPlan] = []
+        for (item_type, prompt_nickname) in item_prompts:
+            plans += plan_item_generations(
                 item_type=item_type,
-                fill_description_with="body",
+                prompt_nickname=prompt_nickname,
+                description_count=description_count,
+                llm_engine=llm_engine,
                 item_title_like=item_title_like,
             )
-        
-        llm_description_batches: list[LlmGeneratedTextItemDescriptionBatch] = []
 
-        for source_description_batch in source_description_batches:
-            generation_prompt = create_text_item_generation_prompt_from_config(
-                config=generation_config,
-                source_description_batch=source_description_batch,
-            )
+        # one task per request: (plan index, index of its first description among the item's descriptions, description count)
+        samples_per_request = get_generation_samples_per_request(llm_engine)
+        generation_tasks = [
+            (plan_index, sample_index, min(samples_per_request, description_count - sample_index))
+            for (plan_index, plan) in enumerate(plans)
+            for sample_index in range(plan.existing_description_count, description_count, samples_per_request)
+        ]
+        missing_description_count = sum(sample_count for (_, _, sample_count) in generation_tasks)
+        logging.info(f"# Queued {missing_description_count} description generations ({len(generation_tasks)} requests) for {len(plans)} items")
 
-            filepath = generate_descriptions_filepath(
-                title=generation_prompt.item_title, 
-                item_type=generation_prompt.item_type,
-                origin=Origin.LLM,
-                # prompt_uid=generation_prompt.prompt_uid,
-                prompt_key=generation_prompt.prompt_nickname,
-                llm_engine=llm_engine,
-            )
+        # plan index -> log of the item's new descriptions
+        description_logs: dict[int, DescriptionLogWriter] = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as thread_exec:
+            future_to_task = {
+                # run in a copy of this thread's contextvars, so query Contexts are logged under ctx
+                thread_exec.submit(
+                    contextvars.copy_context().run,
+                    generate_llm_descriptions,
+                    generation_prompt=plans[plan_index].generation_prompt,
+                    description_count=sample_count,
+                    llm_engine=llm_engine,
+                    output_description_type=plans[plan_index].output_description_type,
+                    first_sample_index=sample_index,
+                ): plan_index
+                for (plan_index, sample_index, sample_count) in generation_tasks
+            }
+            generated_count = 0
+            for future in as_completed(future_to_task):
+                plan_index = future_to_task[future]
+                plan = plans[plan_index]
+                try:
+                    llm_description_batch = future.result()
+                except BaseException as exc:
+                    logging.error(f"Error generating description for '{plan.generation_prompt.item_title}': {exc}", exc_info=True)
+                    thread_exec.shutdown(wait=False, cancel_futures=True)
+                    for description_log in description_logs.values():
+                        description_log.close()
+                    raise exc
+                new_description_count = len(llm_description_batch.descriptions)
+                # NOTE: merged on this thread only, so no locking needed
+                if plan_index not in description_logs:
+                    description_logs[plan_index] = DescriptionLogWriter(plan.filepath, llm_description_batch)
+                _merge_new_descriptions(plan, llm_description_batch, description_logs[plan_index])
+                if (generated_count + new_description_count) // 10 > generated_count // 10 or generated_count + new_description_count == missing_description_count:
+                    logging.info(f"# Descriptions generated: {generated_count + new_description_count}/{missing_description_count}")
+                generated_count += new_description_count
 
-            # queries to LLM take a while and often error out, so:
-            # - save every item to local files as they are generated
-            # - cache past generated descriptions to local files
-            # - pick up where we left off, and skip generating new 
-            #   files if the target count has already been generated
-
-            for i in range(description_count):
-                if not filepath.exists():
-                    logging.info(f"No existing data found at: {filepath}")
-                    existing_llm_description_batch = None
-                    existing_description_count = 0
-                else:
-                    # logging.info(f"Loading existing data at: {filepath}")
-                    existing_llm_description_batch = load_description_batch_from_json_file(filepath)
-                    existing_description_count = len(existing_llm_description_batch.descriptions)
-                
-                logging.info(f"{filepath.name} -- Description count at: ({existing_description_count}/{description_count})")
-                if existing_description_count >= description_count:
-                    logging.info(f"{filepath.name} -- Sufficient descriptions exist ({existing_description_count}/{description_count})")
-                    llm_description_batches.append(existing_llm_description_batch)
-                    break
-
-                # if existing_description_count < description_count:
-                # generate and save results one at a time in case of failures
-                encoding = tiktoken.encoding_for_model("gpt-3.5-turbo-1106")
-                tokens = encoding.encode(generation_prompt.prompt_text)
-                if llm_engine == Engine.gpt35turbo1106 and len(tokens) >= 16385:
-                    print(f"Skip. prompt {generation_prompt.prompt_nickname} is too long for gpt35turbo1106")
-                else:
-                    llm_description_batch = generate_llm_descriptions(
-                        generation_prompt=generation_prompt,
-                        description_count=1,
-                        llm_engine=llm_engine,
-                        output_description_type=generation_config.output_description_type,
-                    )
-                    # merge existing descriptions with new
-                    if existing_llm_description_batch:
-                        llm_description_batch.descriptions += existing_llm_description_batch.descriptions
-                    save_description_batch_to_json_file(
-                        description_batch=llm_description_batch,
-                        filepath=
-                        filepath,
-                    )
+        for (plan_index, description_log) in description_logs.items():
+            description_log.close()
+            compact_description_log(plans[plan_index].filepath)
 
+        llm_description_batches = [
+            load_description_batch_from_json_file(plan.filepath)
+            for plan in plans
+            if plan.filepath.exists()
+        ]
+        log_response_cache_stats()
         ctx.set_result(llm_description_batches)
         return llm_description_batches
+
+
+def generate_llm_descriptions_for_item_type(
+    item_type: str,
+    prompt_nickname: str,
+    description_count: int,
+    llm_engine: Engine = DEFAULT_ENGINE,
+    item_title_like: t.Optional[list[str]] = None,
+) -> list[LlmGeneratedTextItemDescriptionBatch]:
+    return generate_missing_llm_descriptions(
+        item_prompts=[(item_type, prompt_nickname)],
+        description_count=description_count,
+        llm_engine=llm_engine,
+        item_title_like=item_title_like,
+    )
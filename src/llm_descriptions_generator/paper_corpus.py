@@ -0,0 +1,201 @@
+import json
+import logging
+import mmap
+import os
+import threading
+import typing as t
+import uuid
+from pathlib import Path
+
+from pydantic.dataclasses import dataclass
+
+# Packed form of the raw paper JSONs in data/paper/human (see
+# file_io.load_all_academic_papers_as_description_batches): one data file with the UTF-8 paper
+# bodies (`article`) back to back, plus a small JSON index with every paper's title, abstract and
+# the byte range of its body. Loading papers reads the index only, and the data file is
+# memory-mapped, so a body is sliced out of it (and decoded) only when something reads it.
+#
+# The pack is rebuilt whenever a paper JSON is added, removed or modified.
+
+PAPER_CORPUS_DIRNAME = ".packed"
+PAPER_CORPUS_INDEX_FILENAME = "corpus.index.json"
+PAPER_CORPUS_DATA_FILENAME_PREFIX = "corpus-"
+PAPER_CORPUS_DATA_FILE_EXTENSION = ".bin"
+PAPER_CORPUS_FORMAT_VERSION = 1
+MIN_PAPER_ABSTRACT_LENGTH = 20
+
+
+@dataclass
+class PaperCorpusEntry:
+    filename: str
+    title: str
+    abstract: t.Optional[str]
+    body_offset: int
+    body_length: int
+    # why the paper can't be loaded (raised when it is), None if it can
+    error: t.Optional[str] = None
+
+
+class PaperBody:
+    """The body of a packed paper, sliced from the mapped data file and decoded on every read."""
+
+    __slots__ = ("_corpus", "_offset", "_length")
+
+    def __init__(self, corpus: "PaperCorpus", offset: int, length: int):
+        self._corpus = corpus
+        self._offset = offset
+        self._length = length
+
+    def read(self) -> str:
+        return self._corpus.read_body(self._offset, self._length)
+
+    def __str__(self) -> str:
+        return self.read()
+
+    def __bool__(self) -> bool:
+        return self._length > 0
+
+    def __repr__(self) -> str:
+        return f"PaperBody({self._length} bytes)"
+
+
+def _get_paper_source_stats(papers_dirpath: Path) -> dict[str, list[int]]:
+    """Paper JSON filename -> [mtime_ns, size], to tell whether the pack is stale."""
+    stats: dict[str, list[int]] = {}
+    if papers_dirpath.is_dir():
+        with os.scandir(papers_dirpath) as dir_entries:
+            for dir_entry in dir_entries:
+                if dir_entry.name.endswith(".json") and dir_entry.is_file():
+                    stat = dir_entry.stat()
+                    stats[dir_entry.name] = [stat.st_mtime_ns, stat.st_size]
+    return stats
+
+
+def _read_paper_source(filepath: Path) -> tuple[str, t.Optional[str], t.Optional[str], t.Optional[str]]:
+    """(title, abstract, body, error) of a raw paper JSON."""
+    with open(filepath, "r") as f:
+        paper_data = json.load(f)
+
+    # if no title in data, use filename as title
+    title = paper_data.get("title", None)
+    if not title:
+        title = filepath.stem # without file extension
+
+    abstract = paper_data.get("abstract", None)
+    if not abstract:
+        # try XML field if non-xml not found
+        abstract = paper_data.get("abstract_xml", None)
+    body = paper_data.get("article", None)
+
+    error = None
+    if not abstract:
+        error = f"Paper file {filepath} is missing the 'abstract' attribute"
+    elif len(abstract) <= MIN_PAPER_ABSTRACT_LENGTH:
+        error = f"Paper file {filepath} abstract has a suspiciously small character count. Maybe bad data?"
+    elif not body:
+        error = f"Paper file {filepath} is missing the 'article' attribute"
+    return (title, abstract, body, error)
+
+
+def pack_paper_corpus(papers_dirpath: Path) -> Path:
+    """Packs every paper JSON in the directory, returns the path of the new index."""
+    papers_dirpath = Path(papers_dirpath)
+    corpus_dirpath = papers_dirpath / PAPER_CORPUS_DIRNAME
+    corpus_dirpath.mkdir(parents=True, exist_ok=True)
+    source_stats = _get_paper_source_stats(papers_dirpath)
+
+    # a new data file name per pack, so that processes still reading the previous pack are unaffected
+    data_filename = f"{PAPER_CORPUS_DATA_FILENAME_PREFIX}{uuid.uuid4().hex}{PAPER_CORPUS_DATA_FILE_EXTENSION}"
+    data_filepath = corpus_dirpath / data_filename
+    papers: list[dict[str, t.Any]] = []
+    offset = 0
+    with open(data_filepath, "wb") as data_file:
+        for filename in sorted(source_stats):
+            (title, abstract, body, error) = _read_paper_source(papers_dirpath / filename)
+            body_bytes = (body or "").encode("utf-8")
+            data_file.write(body_bytes)
+            papers.append({
+                "filename": filename,
+                "title": title,
+                "abstract": abstract,
+                "body_offset": offset,
+                "body_length": len(body_bytes),
+                "error": error,
+            })
+            offset += len(body_bytes)
+        data_file.flush()
+        os.fsync(data_file.fileno())
+
+    index = {
+        "version": PAPER_CORPUS_FORMAT_VERSION,
+        "data_filename": data_filename,
+        "sources": source_stats,
+        "papers": papers,
+    }
+    index_filepath = corpus_dirpath / PAPER_CORPUS_INDEX_FILENAME
+    tmp_filepath = index_filepath.with_name(f"{index_filepath.name}.{os.getpid()}.tmp")
+    with open(tmp_filepath, "w") as f:
+        json.dump(index, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filepath, index_filepath)
+
+    # older data files, mappings other processes still hold on them stay valid after the unlink
+    for old_filepath in corpus_dirpath.glob(f"{PAPER_CORPUS_DATA_FILENAME_PREFIX}*{PAPER_CORPUS_DATA_FILE_EXTENSION}"):
+        if old_filepath.name != data_filename:
+            old_filepath.unlink(missing_ok=True)
+    logging.info(f"Packed {len(papers)} papers ({offset} body bytes) from {papers_dirpath} into {corpus_dirpath}")
+    return index_filepath
+
+
+class PaperCorpus:
+    def __init__(self, corpus_dirpath: Path, index: dict[str, t.Any]):
+        self.sources: dict[str, list[int]] = index["sources"]
+        self.entries = [PaperCorpusEntry(**paper) for paper in index["papers"]]
+        self._data_file = open(corpus_dirpath / index["data_filename"], "rb")
+        # mmap can't map an empty file
+        data_size = os.fstat(self._data_file.fileno()).st_size
+        self._data = mmap.mmap(self._data_file.fileno(), 0, access=mmap.ACCESS_READ) if data_size else b""
+
+    def read_body(self, offset: int, length: int) -> str:
+        return self._data[offset:offset + length].decode("utf-8")
+
+    def get_body(self, entry: PaperCorpusEntry) -> PaperBody:
+        return PaperBody(self, entry.body_offset, entry.body_length)
+
+
+def _load_paper_corpus_index(index_filepath: Path) -> t.Optional[dict[str, t.Any]]:
+    try:
+        with open(index_filepath, "r") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get("version", None) != PAPER_CORPUS_FORMAT_VERSION:
+        return None
+    return index
+
+
+# papers directory -> corpus opened from its current pack
+_paper_corpora: dict[Path, PaperCorpus] = {}
+_paper_corpora_lock = threading.Lock()
+
+
+def get_paper_corpus(papers_dirpath: Path) -> PaperCorpus:
+    """The packed corpus of the paper JSONs in the directory, (re)packing them first if needed."""
+    papers_dirpath = Path(papers_dirpath).resolve()
+    index_filepath = papers_dirpath / PAPER_CORPUS_DIRNAME / PAPER_CORPUS_INDEX_FILENAME
+    with _paper_corpora_lock:
+        source_stats = _get_paper_source_stats(papers_dirpath)
+        corpus = _paper_corpora.get(papers_dirpath, None)
+        if corpus is not None and corpus.sources == source_stats:
+            return corpus
+        index = _load_paper_corpus_index(index_filepath)
+        if index is None or index["sources"] != source_stats:
+            index = _load_paper_corpus_index(pack_paper_corpus(papers_dirpath))
+        try:
+            corpus = PaperCorpus(index_filepath.parent, index)
+        except FileNotFoundError:
+            # data file removed by a concurrent repack (in another process), pack again
+            corpus = PaperCorpus(index_filepath.parent, _load_paper_corpus_index(pack_paper_corpus(papers_dirpath)))
+        _paper_corpora[papers_dirpath] = corpus
+        return corpus
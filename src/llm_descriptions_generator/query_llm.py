@@ -1,13 +1,9 @@
 import json
 import logging
-import os
-import time
 import typing as t
 
-import langchain
 from interlab.context import Context, FileStorage
-from interlab.lang_models import query_model
-from interlab.queries import QueryFailure, query_for_json
+from interlab.queries import QueryFailure
 from interlab.queries.experimental.repeat import repeat_on_failure
 from openai.error import (
     APIError,
@@ -17,15 +13,39 @@ from openai.error import (
 )
 
 from llm_descriptions_generator.schema import (
+    DescriptionTextOrJson,
     ProductDetailsJson,
     Engine,
     LlmGeneratedTextItemDescriptionBatch,
     TextItemGenerationPrompt,
     Origin,
 )
+from llm_clients import get_llm_client, supports_multiple_samples
+from rate_limiter import is_quota_exceeded_error
+from response_cache import (cached_query_for_json, cached_query_model,
+                            cached_query_samples)
 
 MAX_SUPER_RETRY_COUNT = 10
-SUPER_RETRY_WAIT_INTERVAL_SECONDS = 60
+# Ask for several descriptions (`n`) in one request, for engines whose provider supports it
+MULTI_SAMPLE_GENERATION = True
+MAX_SAMPLES_PER_REQUEST = 8
+
+
+def get_generation_samples_per_request(llm_engine: Engine) -> int:
+    if MULTI_SAMPLE_GENERATION and supports_multiple_samples(llm_engine):
+        return MAX_SAMPLES_PER_REQUEST
+    return 1
+
+
+def make_description_from_query_result(
+    desc: t.Union[str, ProductDetailsJson],
+    output_description_type: t.Optional[t.Any] = None,
+) -> DescriptionTextOrJson:
+    if output_description_type:
+        product_name = desc.product_name
+        product_details = json.loads(desc.product_details) if isinstance(desc.product_details, str) else desc.product_details
+        return {"product_name": product_name, "product_details": product_details}
+    return desc
 
 # @with_context(
 #     name="generate_many_descriptions",
@@ -37,6 +57,9 @@ def generate_llm_descriptions(
     description_count: int,
     llm_engine: Engine,
     output_description_type: t.Optional[t.Any] = None,
+    # index of the first description generated, among all descriptions of this prompt
+    # (part of the response cache key, so each sample is cached separately)
+    first_sample_index: int = 0,
 ) -> LlmGeneratedTextItemDescriptionBatch:
     logging.info(
         "Querying LLM for new description for prompt uid: "
@@ -48,16 +71,7 @@ def generate_llm_descriptions(
     )
     
     descriptions: list[str] = []
-    if llm_engine in [Engine.gpt35turbo, Engine.gpt35turbo1106, Engine.gpt4turbo]:
-        logging.info(f"Querying OpenAI servers for: {llm_engine}")
-        engine = langchain.chat_models.ChatOpenAI(model_name=llm_engine)
-    else:
-        logging.info(f"Assuming {llm_engine} is running locally")
-        engine = langchain.chat_models.ChatOpenAI(
-            model_name=llm_engine,
-            max_tokens=-1,
-            openai_api_base=os.getenv('LOCAL_LLM_API_BASE'),
-        )
+    engine = get_llm_client(llm_engine)
 
     # with Context(
     #     "BATCH generate_llm_descriptions",
@@ -71,23 +85,52 @@ def generate_llm_descriptions(
     #     tags=["trying a thing", "runkey:foobar"],
     #     directory=True,
     # ) as ctx:
-    for i in range(description_count):
-        def query_llm_for_new_description() -> t.Union[str, ProductDetailsJson]:
+    # several descriptions per request (the prompt is only sent once) where the provider supports it
+    samples_per_request = get_generation_samples_per_request(llm_engine)
+    for i in range(0, description_count, samples_per_request):
+        sample_index = first_sample_index + i
+        sample_count = min(samples_per_request, description_count - i)
+
+        def query_llm_for_new_descriptions() -> list[t.Union[str, ProductDetailsJson]]:
             # TODO: make retry logic more flexible and/or better integrated with interlab/langchain tooling
             try:
+                if sample_count > 1:
+                    return cached_query_samples(
+                        llm_engine,
+                        engine,
+                        generation_prompt.prompt_text,
+                        first_sample_index=sample_index,
+                        sample_count=sample_count,
+                        T=output_description_type,
+                    )
                 if output_description_type:
-                    return query_for_json(engine, output_description_type, generation_prompt.prompt_text)
-                return query_model(engine, generation_prompt.prompt_text)
+                    return [cached_query_for_json(
+                        llm_engine,
+                        engine,
+                        output_description_type,
+                        generation_prompt.prompt_text,
+                        sample_index=sample_index,
+                    )]
+                return [cached_query_model(
+                    llm_engine,
+                    engine,
+                    generation_prompt.prompt_text,
+                    sample_index=sample_index,
+                )]
+            # NOTE: the rate limiter already retried these (pausing as long as the provider asked),
+            # and keeps pausing new requests to the provider while it's overloaded
+            except RateLimitError as e:
+                if is_quota_exceeded_error(e):
+                    logging.error(e)
+                    logging.error("Open AI quota exceeded. Shutting down until you buy new credits.")
+                    exit()
+                logging.warning(e)
+                logging.warning("LLM's API is still rate limiting after retries. Will try again.")
+                raise QueryFailure # triggers interlab repeat_on_failure behavior
             except (APIError, Timeout, APIConnectionError) as e:
-                retry_interval = SUPER_RETRY_WAIT_INTERVAL_SECONDS
                 logging.warning(e)
-                logging.warning(f"Retryable error from LLM's API encountered. Will try again after {retry_interval} seconds.")
-                time.sleep(retry_interval)
+                logging.warning("Retryable error from LLM's API persisted after retries. Will try again.")
                 raise QueryFailure # triggers interlab repeat_on_failure behavior
-            except RateLimitError as e:
-                logging.error(e)
-                logging.error("Open AI Rate limit and/or quota exceeded. Shutting down until you wait a while and/or buy new credits.")
-                exit()
             except Exception as e:
                 raise e
 
@@ -116,21 +159,14 @@ def generate_llm_descriptions(
         #     # tags=["trying a thing", "runkey:foobar"],
         #     # directory=True,
         # ) as ctx:
-        desc = repeat_on_failure(
-            fn=query_llm_for_new_description,
+        descs = repeat_on_failure(
+            fn=query_llm_for_new_descriptions,
             max_repeats=MAX_SUPER_RETRY_COUNT,
             use_context=False,
             throw_if_fail=True,
         )
 
-        if output_description_type:
-            product_name = desc.product_name
-            product_details = json.loads(desc.product_details) if isinstance(desc.product_details, str) else desc.product_details
-            result = {"product_name": product_name, "product_details": product_details}
-        else:
-            result = desc
-
-        descriptions.append(result)
+        descriptions += [make_description_from_query_result(desc, output_description_type) for desc in descs]
 
     llm_description_batch = LlmGeneratedTextItemDescriptionBatch(
         item_type=generation_prompt.item_type,
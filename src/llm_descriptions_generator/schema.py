@@ -37,6 +37,27 @@ class Engine(str, enum.Enum):
     def __str__(self):
         return self.value
 
+class EngineProvider(str, enum.Enum):
+    OpenAI = "openai"
+    Groq = "groq"
+    Together = "together"
+    # e.g. LM Studio (see README)
+    Local = "local"
+
+    def __str__(self):
+        return self.value
+
+OPENAI_ENGINES = [Engine.gpt35turbo, Engine.gpt35turbo1106, Engine.gpt4turbo]
+
+def get_engine_provider(engine: Engine) -> EngineProvider:
+    if engine in OPENAI_ENGINES:
+        return EngineProvider.OpenAI
+    if engine.value.startswith("groq-"):
+        return EngineProvider.Groq
+    if engine.value.startswith("together-"):
+        return EngineProvider.Together
+    return EngineProvider.Local
+
 class PromptDescriptionSource(str, enum.Enum):
     Human = "human"
     AcademicPaperBody = "academic_paper_body"
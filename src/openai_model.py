@@ -0,0 +1,77 @@
+import contextvars
+import typing as t
+
+import langchain
+import openai
+import requests
+
+from llm_descriptions_generator.schema import EngineProvider
+from rate_limiter import get_rate_limiter
+
+OPENAI_RETRYABLE_ERRORS = (
+    openai.error.Timeout,
+    openai.error.APIError,
+    openai.error.APIConnectionError,
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+)
+
+# The openai (v0) SDK drops the headers of successful responses, so the shared HTTP sessions
+# (see llm_clients.py) record the latest ones of the current thread / task here, for the rate limiter.
+_response_headers: contextvars.ContextVar[t.Optional[t.Mapping[str, str]]] = contextvars.ContextVar(
+    "openai_response_headers", default=None,
+)
+
+
+def record_response_headers(response: requests.Response, *args: t.Any, **kwargs: t.Any) -> None:
+    """`requests` response hook."""
+    _response_headers.set(response.headers)
+
+
+def make_response_headers_trace_config() -> t.Any:
+    """`aiohttp` trace config doing the same as `record_response_headers`."""
+    import aiohttp
+
+    async def on_request_end(session: t.Any, trace_config_ctx: t.Any, params: t.Any) -> None:
+        _response_headers.set(params.response.headers)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
+
+
+def _get_response_headers(_result: t.Any) -> t.Optional[t.Mapping[str, str]]:
+    return _response_headers.get()
+
+
+class RateLimitedChatOpenAI(langchain.chat_models.ChatOpenAI):
+    """
+    ChatOpenAI (also used for OpenAI-compatible APIs like Together or a local server) whose requests go
+    through the shared rate limiter of `provider`, instead of langchain's own per-call retries.
+    """
+
+    provider: EngineProvider = EngineProvider.OpenAI
+    # retries are done by the rate limiter (this only applies to langchain's async path)
+    max_retries: int = 1
+
+    def completion_with_retry(self, **kwargs: t.Any) -> t.Any:
+        def create() -> t.Any:
+            _response_headers.set(None)
+            return self.client.create(**kwargs)
+
+        return get_rate_limiter(self.provider).call(
+            create,
+            retryable_errors=OPENAI_RETRYABLE_ERRORS,
+            get_headers=_get_response_headers,
+        )
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: t.Any):
+        async def generate() -> t.Any:
+            _response_headers.set(None)
+            return await super(RateLimitedChatOpenAI, self)._agenerate(messages, stop, run_manager, **kwargs)
+
+        return await get_rate_limiter(self.provider).call_async(
+            generate,
+            retryable_errors=OPENAI_RETRYABLE_ERRORS,
+            get_headers=_get_response_headers,
+        )
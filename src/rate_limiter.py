@@ -0,0 +1,249 @@
+import asyncio
+import functools
+import logging
+import re
+import threading
+import time
+import typing as t
+
+from pydantic.dataclasses import dataclass
+
+from llm_descriptions_generator.schema import EngineProvider
+
+# Additive increase / multiplicative decrease of the allowed number of in-flight requests:
+# every success adds ~1 slot per "round" of requests, every rate limit error halves the slots.
+AIMD_DECREASE_FACTOR = 0.5
+# Cooldown when a provider says we're rate limited but not for how long (doubles while it keeps happening)
+DEFAULT_RATE_LIMIT_BACKOFF_SECONDS = 5.0
+MAX_RATE_LIMIT_BACKOFF_SECONDS = 120.0
+# Short cooldown after other retryable API errors (timeouts, 5xx, connection errors)
+ERROR_BACKOFF_SECONDS = 2.0
+MAX_ATTEMPTS = 8
+# Hold off new requests once a provider reports fewer tokens than this left in the current window
+MIN_REMAINING_TOKENS = 2000
+ASYNC_POLL_INTERVAL_SECONDS = 0.1
+
+T = t.TypeVar("T")
+
+
+@dataclass
+class ProviderRateLimits:
+    max_concurrent_requests: int
+    # None = no client-side request rate cap (only concurrency and the provider's headers apply)
+    requests_per_minute: t.Optional[float] = None
+
+
+# Starting points, tune these to the limits of your API accounts. The limiter only ever
+# goes below them, when the provider's response headers or rate limit errors say so.
+PROVIDER_RATE_LIMITS: dict[EngineProvider, ProviderRateLimits] = {
+    EngineProvider.OpenAI: ProviderRateLimits(max_concurrent_requests=32, requests_per_minute=3500),
+    EngineProvider.Groq: ProviderRateLimits(max_concurrent_requests=4, requests_per_minute=30),
+    EngineProvider.Together: ProviderRateLimits(max_concurrent_requests=16, requests_per_minute=600),
+    # local LLM servers most likely can't handle concurrent requests
+    EngineProvider.Local: ProviderRateLimits(max_concurrent_requests=1),
+}
+
+
+def _parse_duration_seconds(value: t.Optional[str]) -> t.Optional[float]:
+    """Parses header durations like "20ms", "6s", "1m30.5s" or a plain number of seconds."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value)
+    if not parts:
+        return None
+    unit_seconds = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+    return sum(float(number) * unit_seconds[unit] for (number, unit) in parts)
+
+
+def _parse_int(value: t.Optional[str]) -> t.Optional[int]:
+    try:
+        return int(float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+def get_error_headers(e: BaseException) -> t.Mapping[str, str]:
+    """Response headers attached to an API error, for both the openai (v0) and groq SDKs."""
+    headers = getattr(e, "headers", None)
+    if headers is None:
+        headers = getattr(getattr(e, "response", None), "headers", None)
+    return headers or {}
+
+
+def is_rate_limit_error(e: BaseException) -> bool:
+    return 429 in [getattr(e, "http_status", None), getattr(e, "status_code", None)]
+
+
+def is_quota_exceeded_error(e: BaseException) -> bool:
+    # OpenAI reports an empty account with the same 429 as a rate limit, but waiting won't help
+    return getattr(e, "code", None) == "insufficient_quota"
+
+
+class AdaptiveRateLimiter:
+    """
+    Client-side rate limiter for one LLM provider, shared by every thread and event loop in the process.
+
+    Combines a token bucket (requests per minute) with an AIMD-adjusted cap on in-flight requests,
+    and pauses all requests to the provider when its response headers (x-ratelimit-remaining-*,
+    x-ratelimit-reset-*, retry-after) or a rate limit error say its limits are used up.
+    """
+
+    def __init__(self, name: str, limits: ProviderRateLimits):
+        self.name = name
+        self.limits = limits
+        self.concurrency_limit = float(limits.max_concurrent_requests)
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._blocked_until = 0.0
+        self._rate_limit_backoff = DEFAULT_RATE_LIMIT_BACKOFF_SECONDS
+        self._bucket_capacity = float(limits.max_concurrent_requests)
+        self._bucket_tokens = self._bucket_capacity
+        self._bucket_refill_time = time.monotonic()
+
+    def _refill_bucket_locked(self, now: float) -> None:
+        if self.limits.requests_per_minute is not None:
+            refill = (now - self._bucket_refill_time) * self.limits.requests_per_minute / 60
+            self._bucket_tokens = min(self._bucket_capacity, self._bucket_tokens + refill)
+        self._bucket_refill_time = now
+
+    def _try_acquire_locked(self) -> float:
+        """Takes a request slot and returns 0, or returns how many seconds to wait before trying again."""
+        now = time.monotonic()
+        self._refill_bucket_locked(now)
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self._in_flight >= max(1, int(self.concurrency_limit)):
+            # woken up by release() in the threaded case
+            return ASYNC_POLL_INTERVAL_SECONDS
+        if self.limits.requests_per_minute is not None:
+            if self._bucket_tokens < 1:
+                return (1 - self._bucket_tokens) * 60 / self.limits.requests_per_minute
+            self._bucket_tokens -= 1
+        self._in_flight += 1
+        return 0
+
+    def acquire(self) -> None:
+        with self._condition:
+            while (wait_seconds := self._try_acquire_locked()) > 0:
+                self._condition.wait(timeout=wait_seconds)
+
+    async def acquire_async(self) -> None:
+        while True:
+            with self._condition:
+                wait_seconds = self._try_acquire_locked()
+            if wait_seconds == 0:
+                return
+            await asyncio.sleep(min(wait_seconds, ASYNC_POLL_INTERVAL_SECONDS))
+
+    def release(self) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def _block_for_locked(self, seconds: float) -> None:
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def _update_from_headers_locked(self, headers: t.Mapping[str, str]) -> None:
+        remaining_requests = _parse_int(headers.get("x-ratelimit-remaining-requests", None))
+        if remaining_requests is not None:
+            self._bucket_tokens = min(self._bucket_tokens, remaining_requests)
+            if remaining_requests <= 0:
+                reset_seconds = _parse_duration_seconds(headers.get("x-ratelimit-reset-requests", None))
+                self._block_for_locked(reset_seconds or DEFAULT_RATE_LIMIT_BACKOFF_SECONDS)
+        remaining_tokens = _parse_int(headers.get("x-ratelimit-remaining-tokens", None))
+        if remaining_tokens is not None and remaining_tokens < MIN_REMAINING_TOKENS:
+            reset_seconds = _parse_duration_seconds(headers.get("x-ratelimit-reset-tokens", None))
+            self._block_for_locked(reset_seconds or DEFAULT_RATE_LIMIT_BACKOFF_SECONDS)
+
+    def record_success(self, headers: t.Optional[t.Mapping[str, str]] = None) -> None:
+        with self._condition:
+            self.concurrency_limit = min(
+                float(self.limits.max_concurrent_requests),
+                self.concurrency_limit + 1 / self.concurrency_limit,
+            )
+            self._rate_limit_backoff = DEFAULT_RATE_LIMIT_BACKOFF_SECONDS
+            if headers:
+                self._update_from_headers_locked(headers)
+            self._condition.notify_all()
+
+    def record_rate_limited(self, headers: t.Optional[t.Mapping[str, str]] = None) -> None:
+        headers = headers or {}
+        with self._condition:
+            self.concurrency_limit = max(1.0, self.concurrency_limit * AIMD_DECREASE_FACTOR)
+            retry_after_ms = _parse_duration_seconds(headers.get("retry-after-ms", None))
+            retry_after = (
+                retry_after_ms / 1000 if retry_after_ms is not None
+                else _parse_duration_seconds(headers.get("retry-after", None))
+            )
+            if retry_after is None:
+                retry_after = self._rate_limit_backoff
+                self._rate_limit_backoff = min(MAX_RATE_LIMIT_BACKOFF_SECONDS, self._rate_limit_backoff * 2)
+            self._block_for_locked(retry_after)
+            self._update_from_headers_locked(headers)
+            logging.warning(f"Rate limited by {self.name}: pausing requests for {retry_after:.1f}s, max concurrent requests now {int(self.concurrency_limit)}")
+
+    def record_error(self) -> None:
+        with self._condition:
+            self._block_for_locked(ERROR_BACKOFF_SECONDS)
+
+    def _should_retry(self, e: Exception, attempt: int) -> bool:
+        if is_quota_exceeded_error(e):
+            return False
+        if is_rate_limit_error(e):
+            self.record_rate_limited(get_error_headers(e))
+        else:
+            self.record_error()
+        if attempt == MAX_ATTEMPTS - 1:
+            return False
+        logging.info(f"Request to {self.name} failed, retrying (attempt {attempt + 1}/{MAX_ATTEMPTS}): {e}")
+        return True
+
+    def call(
+        self,
+        fn: t.Callable[[], T],
+        retryable_errors: tuple[type[Exception], ...],
+        get_headers: t.Optional[t.Callable[[T], t.Mapping[str, str]]] = None,
+    ) -> T:
+        """Runs `fn` within the provider's limits, retrying `retryable_errors` after the appropriate cooldown."""
+        for attempt in range(MAX_ATTEMPTS):
+            self.acquire()
+            try:
+                result = fn()
+            except retryable_errors as e:
+                if self._should_retry(e, attempt):
+                    continue
+                raise e
+            finally:
+                self.release()
+            self.record_success(get_headers(result) if get_headers else None)
+            return result
+
+    async def call_async(
+        self,
+        fn: t.Callable[[], t.Awaitable[T]],
+        retryable_errors: tuple[type[Exception], ...],
+        get_headers: t.Optional[t.Callable[[T], t.Mapping[str, str]]] = None,
+    ) -> T:
+        """Async version of `call`."""
+        for attempt in range(MAX_ATTEMPTS):
+            await self.acquire_async()
+            try:
+                result = await fn()
+            except retryable_errors as e:
+                if self._should_retry(e, attempt):
+                    continue
+                raise e
+            finally:
+                self.release()
+            self.record_success(get_headers(result) if get_headers else None)
+            return result
+
+
+@functools.lru_cache(maxsize=None)
+def get_rate_limiter(provider: EngineProvider) -> AdaptiveRateLimiter:
+    return AdaptiveRateLimiter(name=str(provider), limits=PROVIDER_RATE_LIMITS[provider])
@@ -0,0 +1,247 @@
+import dataclasses
+import functools
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import typing as t
+from pathlib import Path
+
+from interlab.lang_models import query_model
+from interlab.lang_models.query_model import _prepare_model
+from interlab.queries import query_for_json
+from interlab.queries.json_schema import get_json_schema, get_pydantic_model
+
+from llm_batch import make_json_query_prompt, parse_json_response
+from llm_clients import query_model_samples
+from llm_descriptions_generator.schema import Engine
+from storage import cache_friendly_file_storage
+
+# Content-addressed cache of raw LLM responses: hash(engine, full prompt, temperature, max_tokens,
+# JSON schema, sample index) -> response. Sits in front of query_model / query_for_json, for both
+# description generation and comparisons.
+#
+# NOTE: generating several descriptions from one prompt is sampling on purpose, so generation
+# passes the index of the sample being generated, otherwise every sample would be the cached first one.
+
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_DB_FILENAME = "llm_response_cache.sqlite"
+# Least recently used responses are evicted above this size, down to RESPONSE_CACHE_EVICT_TO_RATIO of it
+RESPONSE_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+RESPONSE_CACHE_EVICT_TO_RATIO = 0.9
+SQLITE_TIMEOUT_SECONDS = 30
+
+RESPONSE_CACHE_SCHEMA = [
+    """
+CREATE TABLE IF NOT EXISTS llm_responses (
+    key TEXT PRIMARY KEY,
+    response TEXT,
+    size INTEGER,
+    last_access_time REAL
+);""",
+    """
+CREATE INDEX IF NOT EXISTS llm_responses_last_access_index ON llm_responses (last_access_time);
+""",
+]
+
+
+class ResponseCache:
+    """
+    Size-capped on-disk (SQLite) LRU cache of LLM responses, shared by every thread in the process.
+    Keeps hit/miss counters for the lifetime of the process.
+    """
+
+    def __init__(self, path: Path, max_bytes: int = RESPONSE_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        logging.info(f"Opening LLM response cache at {path}")
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=SQLITE_TIMEOUT_SECONDS)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for schema in RESPONSE_CACHE_SCHEMA:
+            self._conn.execute(schema)
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_responses").fetchone()[0]
+
+    def get(self, key: str) -> t.Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM llm_responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self._conn:
+                self._conn.execute("UPDATE llm_responses SET last_access_time = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        size = len(key) + len(response.encode("utf-8"))
+        with self._lock:
+            with self._conn:
+                previous = self._conn.execute("SELECT size FROM llm_responses WHERE key = ?", (key,)).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_responses (key, response, size, last_access_time) VALUES (?, ?, ?, ?)",
+                    (key, response, size, time.time()),
+                )
+                self._total_bytes += size - (previous[0] if previous else 0)
+                if self._total_bytes > self.max_bytes:
+                    self._evict_locked()
+
+    def _evict_locked(self) -> None:
+        target_bytes = self.max_bytes * RESPONSE_CACHE_EVICT_TO_RATIO
+        evicted_keys: list[str] = []
+        for (key, size) in self._conn.execute("SELECT key, size FROM llm_responses ORDER BY last_access_time"):
+            if self._total_bytes <= target_bytes:
+                break
+            evicted_keys.append(key)
+            self._total_bytes -= size
+        self._conn.executemany("DELETE FROM llm_responses WHERE key = ?", [(key,) for key in evicted_keys])
+        self.evictions += len(evicted_keys)
+        logging.info(f"Evicted {len(evicted_keys)} least recently used LLM responses from the response cache")
+
+    def stats(self) -> str:
+        with self._lock:
+            lookups = self.hits + self.misses
+            hit_rate = self.hits / lookups if lookups else 0.0
+            return f"LLM response cache statistics: {self.hits} hits, {self.misses} misses ({hit_rate:.1%} hit rate), {self.evictions} evictions, {self._total_bytes / 1024 / 1024:.1f} MB stored"
+
+
+@functools.lru_cache(maxsize=None)
+def _get_response_cache(path: Path) -> ResponseCache:
+    return ResponseCache(path)
+
+
+def get_response_cache() -> t.Optional[ResponseCache]:
+    """The process-wide response cache, or None if disabled."""
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    return _get_response_cache(Path(cache_friendly_file_storage.directory) / RESPONSE_CACHE_DB_FILENAME)
+
+
+def log_response_cache_stats() -> None:
+    cache = get_response_cache()
+    if cache is not None:
+        logging.info(cache.stats())
+
+
+def make_response_cache_key(
+    llm_engine: Engine,
+    llm_model: t.Any,
+    prompt: str,
+    T: t.Optional[type] = None,
+    sample_index: t.Optional[int] = None,
+) -> str:
+    (_, conf, _) = _prepare_model(llm_model)
+    key_data = {
+        "engine": str(llm_engine),
+        "prompt": prompt,
+        "temperature": conf.get("temperature", None),
+        "max_tokens": conf.get("max_tokens", None),
+        "schema": get_json_schema(get_pydantic_model(T)) if T is not None else None,
+        "sample_index": sample_index,
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def dump_json_result(result: t.Any) -> str:
+    return json.dumps(dataclasses.asdict(result))
+
+
+def load_json_result(T: type, response: str) -> t.Any:
+    # validated like query_for_json does
+    return T(**get_pydantic_model(T)(**json.loads(response)).dict())
+
+
+def cached_query_model(
+    llm_engine: Engine,
+    llm_model: t.Any,
+    prompt: str,
+    sample_index: t.Optional[int] = None,
+) -> str:
+    """`query_model` through the response cache."""
+    cache = get_response_cache()
+    if cache is None:
+        return query_model(llm_model, prompt)
+    key = make_response_cache_key(llm_engine, llm_model, prompt, sample_index=sample_index)
+    cached_response = cache.get(key)
+    if cached_response is not None:
+        return cached_response
+    response = query_model(llm_model, prompt)
+    cache.put(key, response)
+    return response
+
+
+def cached_query_for_json(
+    llm_engine: Engine,
+    llm_model: t.Any,
+    T: type,
+    prompt: str,
+    sample_index: t.Optional[int] = None,
+) -> t.Any:
+    """
+    `query_for_json` through the response cache. Only validated results are cached (so that
+    a response which fails to parse still gets re-queried, as query_for_json would do).
+    """
+    cache = get_response_cache()
+    if cache is None:
+        return query_for_json(llm_model, T, prompt)
+    key = make_response_cache_key(llm_engine, llm_model, prompt, T=T, sample_index=sample_index)
+    cached_response = cache.get(key)
+    if cached_response is not None:
+        return load_json_result(T, cached_response)
+    result = query_for_json(llm_model, T, prompt)
+    cache.put(key, dump_json_result(result))
+    return result
+
+
+def cached_query_samples(
+    llm_engine: Engine,
+    llm_model: t.Any,
+    prompt: str,
+    first_sample_index: int,
+    sample_count: int,
+    T: t.Optional[type] = None,
+) -> list[t.Any]:
+    """
+    The samples `first_sample_index`, ..., `first_sample_index + sample_count - 1` of the prompt, as
+    `cached_query_model` (or `cached_query_for_json` with `T`) returns them one at a time (and cached
+    under the same keys), but all samples missing from the cache are asked for in a single request
+    (see `llm_clients.query_model_samples`). JSON samples that fail to parse are re-queried one by one.
+    """
+    cache = get_response_cache()
+    sample_indexes = list(range(first_sample_index, first_sample_index + sample_count))
+    keys = {
+        sample_index: make_response_cache_key(llm_engine, llm_model, prompt, T=T, sample_index=sample_index)
+        for sample_index in sample_indexes
+    } if cache is not None else {}
+    results: dict[int, t.Any] = {}
+    for (sample_index, key) in keys.items():
+        cached_response = cache.get(key)
+        if cached_response is not None:
+            results[sample_index] = load_json_result(T, cached_response) if T is not None else cached_response
+
+    missing_sample_indexes = [sample_index for sample_index in sample_indexes if sample_index not in results]
+    if missing_sample_indexes:
+        query_prompt = make_json_query_prompt(T, prompt) if T is not None else prompt
+        responses = query_model_samples(llm_model, query_prompt, len(missing_sample_indexes))
+        for (sample_index, response) in zip(missing_sample_indexes, responses):
+            if T is None:
+                results[sample_index] = response
+                if cache is not None:
+                    cache.put(keys[sample_index], response)
+                continue
+            result = parse_json_response(T, response)
+            if result is None:
+                # (cached by cached_query_for_json)
+                results[sample_index] = cached_query_for_json(llm_engine, llm_model, T, prompt, sample_index=sample_index)
+                continue
+            results[sample_index] = result
+            if cache is not None:
+                cache.put(keys[sample_index], dump_json_result(result))
+    return [results[sample_index] for sample_index in sample_indexes]
@@ -0,0 +1,126 @@
+import contextvars
+import logging
+import time
+import typing as t
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+from llm_descriptions_generator.schema import EngineProvider
+
+# Runs the steps of a full run (description generation, comparisons, ...) as a dependency graph:
+# every node starts as soon as the nodes it depends on are done, so independent steps overlap
+# instead of running one after another.
+#
+# Each node names the provider its LLM requests go to. Those requests are throttled by the shared
+# per-provider rate limiters anyway (see rate_limiter.py); the per-provider node limit only keeps
+# one provider's backlog from taking up every node slot while other providers sit idle.
+#
+# Nodes run in worker threads with a copy of the submitting thread's contextvars, so interlab
+# Contexts opened by a node are nested in the Context that was current when the graph started.
+
+DEFAULT_MAX_CONCURRENT_NODES = 8
+DEFAULT_MAX_CONCURRENT_NODES_PER_PROVIDER = 2
+
+
+class RunGraphNode:
+    def __init__(
+        self,
+        key: t.Hashable,
+        run: t.Callable[[], t.Any],
+        provider: t.Optional[EngineProvider] = None,
+        dependencies: t.Optional[list[t.Hashable]] = None,
+    ):
+        self.key = key
+        self.run = run
+        # None: no LLM requests (not counted towards any provider's node limit)
+        self.provider = provider
+        self.dependencies = list(dependencies or [])
+
+
+def _check_graph(nodes: list[RunGraphNode]) -> None:
+    nodes_by_key = {node.key: node for node in nodes}
+    if len(nodes_by_key) != len(nodes):
+        raise Exception("Run graph has several nodes with the same key")
+    for node in nodes:
+        for dependency in node.dependencies:
+            if dependency not in nodes_by_key:
+                raise Exception(f"Run graph node {node.key} depends on unknown node {dependency}")
+    # Kahn's algorithm: every node is reachable in dependency order iff there is no cycle
+    remaining_dependency_counts = {node.key: len(set(node.dependencies)) for node in nodes}
+    ready_keys = [key for (key, count) in remaining_dependency_counts.items() if count == 0]
+    dependents_by_key: dict[t.Hashable, list[t.Hashable]] = {}
+    for node in nodes:
+        for dependency in set(node.dependencies):
+            dependents_by_key.setdefault(dependency, []).append(node.key)
+    ordered_count = 0
+    while ready_keys:
+        key = ready_keys.pop()
+        ordered_count += 1
+        for dependent in dependents_by_key.get(key, []):
+            remaining_dependency_counts[dependent] -= 1
+            if remaining_dependency_counts[dependent] == 0:
+                ready_keys.append(dependent)
+    if ordered_count != len(nodes):
+        raise Exception("Run graph has a dependency cycle")
+
+
+def run_graph(
+    nodes: list[RunGraphNode],
+    max_concurrent_nodes: int = DEFAULT_MAX_CONCURRENT_NODES,
+    max_concurrent_nodes_per_provider: int = DEFAULT_MAX_CONCURRENT_NODES_PER_PROVIDER,
+) -> dict[t.Hashable, t.Any]:
+    """
+    Runs every node once all its dependencies are done, returns the results by node key. Ready
+    nodes start in list order, as node and provider slots free up.
+
+    If a node fails, no new nodes are started, and its exception is raised once the running ones finish.
+    """
+    if max_concurrent_nodes < 1 or max_concurrent_nodes_per_provider < 1:
+        raise Exception("Run graph node limits must be at least 1")
+    _check_graph(nodes)
+    results: dict[t.Hashable, t.Any] = {}
+    pending_nodes = list(nodes)
+    running_nodes_by_future: dict[Future, RunGraphNode] = {}
+    running_counts_by_provider: dict[EngineProvider, int] = {}
+    start_times: dict[t.Hashable, float] = {}
+    error: t.Optional[BaseException] = None
+
+    def is_ready(node: RunGraphNode) -> bool:
+        if any(dependency not in results for dependency in node.dependencies):
+            return False
+        return node.provider is None or running_counts_by_provider.get(node.provider, 0) < max_concurrent_nodes_per_provider
+
+    with ThreadPoolExecutor(max_workers=max_concurrent_nodes, thread_name_prefix="run-graph") as thread_exec:
+        while pending_nodes or running_nodes_by_future:
+            while error is None and len(running_nodes_by_future) < max_concurrent_nodes:
+                node = next((node for node in pending_nodes if is_ready(node)), None)
+                if node is None:
+                    break
+                pending_nodes.remove(node)
+                if node.provider is not None:
+                    running_counts_by_provider[node.provider] = running_counts_by_provider.get(node.provider, 0) + 1
+                logging.info(f"# Run graph: starting {node.key} ({len(running_nodes_by_future) + 1} running, {len(pending_nodes)} pending)")
+                start_times[node.key] = time.monotonic()
+                future = thread_exec.submit(contextvars.copy_context().run, node.run)
+                running_nodes_by_future[future] = node
+            if not running_nodes_by_future:
+                # only reachable after a failure: nothing left to wait for
+                break
+
+            (done_futures, _) = wait(running_nodes_by_future, return_when=FIRST_COMPLETED)
+            for future in done_futures:
+                node = running_nodes_by_future.pop(future)
+                if node.provider is not None:
+                    running_counts_by_provider[node.provider] -= 1
+                elapsed = time.monotonic() - start_times[node.key]
+                try:
+                    results[node.key] = future.result()
+                    logging.info(f"# Run graph: finished {node.key} in {elapsed:.1f}s ({len(results)}/{len(nodes)} done)")
+                except Exception as e:
+                    logging.error(f"# Run graph: {node.key} failed after {elapsed:.1f}s: {e}", exc_info=True)
+                    if error is None:
+                        error = e
+                        logging.error(f"# Run graph: not starting the {len(pending_nodes)} pending nodes, waiting for {len(running_nodes_by_future)} running ones")
+
+    if error is not None:
+        raise error
+    return results
@@ -1,7 +1,201 @@
-from interlab.context import FileStorage
+import json
+import logging
+import os
+import sqlite3
+import threading
+import typing as t
+
+from interlab.context import Context, FileStorage
 
 # use this folder for context artifacts instead of generic "logs"
 # to enable using those logs in a cache-like way to retrieve recent
 # results of successful LLM queries with similar params.
 CACHE_FRIENDLY_FILE_STORAGE_DIR = "context_cache"
-cache_friendly_file_storage = FileStorage(CACHE_FRIENDLY_FILE_STORAGE_DIR)
+CONTEXT_TAG_INDEX_DB_FILENAME = "context_tag_index.sqlite"
+
+CONTEXT_TAG_INDEX_SCHEMA = [
+    """
+CREATE TABLE IF NOT EXISTS context_tags (
+    tag TEXT,
+    -- Path (relative to the storage directory) of the smallest loadable unit
+    -- holding the context: a `<uid>.full.gz` file or a `<uid>.ctx` directory
+    entry_path TEXT,
+    context_uid TEXT,
+    has_result INTEGER
+);""",
+    """
+CREATE INDEX IF NOT EXISTS context_tags_tag_index ON context_tags (tag);
+""",
+    """
+CREATE TABLE IF NOT EXISTS indexed_entries (
+    -- Top-level storage entries already walked (contexts are immutable once written)
+    entry_name TEXT PRIMARY KEY
+);""",
+]
+
+
+def get_context_tag_names(ctx_tags_raw: t.Optional[list]) -> list[str]:
+    ctx_tag_names: list[str] = []
+    if ctx_tags_raw is not None:
+        for tag in ctx_tags_raw:
+            if isinstance(tag, str):
+                ctx_tag_names.append(tag)
+            else:
+                tag_name = tag.get("name", None)
+                if tag_name is not None:
+                    ctx_tag_names.append(tag_name)
+
+    # legacy shim hack: old runs w/ "marketplace" prompt didn't include tag for prompt key,
+    # so shim in one for older data that doesn't have one
+    if (
+        len(ctx_tag_names) == 2
+        and ("engine:" in ctx_tag_names[0] or "engine:" in ctx_tag_names[1])
+        and ("compare_descriptions:" in ctx_tag_names[0] or "compare_descriptions:" in ctx_tag_names[1])
+    ):
+        ctx_tag_names.append("comparison_prompt_key:marketplace")
+    return ctx_tag_names
+
+
+class IndexedFileStorage(FileStorage):
+    """
+    FileStorage with a persistent tag -> context index (SQLite, kept in the storage directory).
+
+    The index is built on first lookup by walking every stored context once, and is then
+    kept up to date by `write_context` (and `refresh_index` for entries written elsewhere),
+    so a tag lookup is a single index query instead of decompressing the whole storage.
+    """
+
+    def __init__(self, directory: os.PathLike | str):
+        super().__init__(directory)
+        self._index_lock = threading.Lock()
+        self._index_conn: t.Optional[sqlite3.Connection] = None
+
+    def _get_index_conn(self) -> sqlite3.Connection:
+        # NOTE: caller must hold self._index_lock
+        if self._index_conn is None:
+            path = os.path.join(self.directory, CONTEXT_TAG_INDEX_DB_FILENAME)
+            logging.info(f"Opening context tag index at {path}")
+            conn = sqlite3.connect(path, check_same_thread=False)
+            for schema in CONTEXT_TAG_INDEX_SCHEMA:
+                conn.execute(schema)
+            conn.commit()
+            self._index_conn = conn
+            self._refresh_index_locked()
+        return self._index_conn
+
+    def _list_entry_names(self) -> list[str]:
+        return [
+            name for name in os.listdir(self.directory)
+            if name.endswith(".full.gz") or name.endswith(".ctx")
+        ]
+
+    def _walk_context_data(
+        self,
+        data: dict,
+        entry_path: str,
+        rows: list[tuple[str, str, str, int]],
+    ) -> None:
+        has_result = 1 if data.get("result", None) is not None else 0
+        for tag in get_context_tag_names(data.get("tags", None)):
+            rows.append((tag, entry_path, data["uid"], has_result))
+        for child in data.get("children", None) or []:
+            self._walk_context_data(child, entry_path, rows)
+
+    def _walk_entry(
+        self,
+        dirpath: str,
+        name: str,
+        rows: list[tuple[str, str, str, int]],
+    ) -> None:
+        path = os.path.join(dirpath, name)
+        entry_path = os.path.relpath(path, self.directory)
+        if name.endswith(".ctx"):
+            self_data = self._read_file(self._file_path(path, "_self"))
+            self_data.pop("children_uids", None)
+            self._walk_context_data(self_data, entry_path, rows)
+            for child_name in os.listdir(path):
+                if child_name.endswith(".full.gz") or child_name.endswith(".ctx"):
+                    self._walk_entry(path, child_name, rows)
+        else:
+            self._walk_context_data(self._read_file(path), entry_path, rows)
+
+    def _index_entries_locked(self, entry_names: list[str]) -> None:
+        conn = self._index_conn
+        for name in entry_names:
+            if conn.execute("SELECT 1 FROM indexed_entries WHERE entry_name = ?", (name,)).fetchone():
+                continue
+            rows: list[tuple[str, str, str, int]] = []
+            try:
+                self._walk_entry(self.directory, name, rows)
+            except (OSError, EOFError, json.JSONDecodeError) as e:
+                logging.warning(f"Skipping unreadable context storage entry {name}: {e}")
+                continue
+            conn.executemany(
+                "INSERT INTO context_tags (tag, entry_path, context_uid, has_result) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            conn.execute("INSERT OR IGNORE INTO indexed_entries (entry_name) VALUES (?)", (name,))
+        conn.commit()
+
+    def _refresh_index_locked(self) -> None:
+        indexed = set(
+            row[0] for row in self._index_conn.execute("SELECT entry_name FROM indexed_entries")
+        )
+        new_entry_names = [name for name in self._list_entry_names() if name not in indexed]
+        if new_entry_names:
+            logging.info(f"Indexing {len(new_entry_names)} new context storage entries in {self.directory}")
+            self._index_entries_locked(new_entry_names)
+
+    def refresh_index(self) -> None:
+        """Index any top-level entries written to the storage directory since the last refresh (e.g. by other processes)."""
+        with self._index_lock:
+            self._get_index_conn()
+            self._refresh_index_locked()
+
+    def write_context(self, context: Context):
+        super().write_context(context)
+        name = f"{context.uid}.ctx" if context.directory else f"{context.uid}.full.gz"
+        with self._index_lock:
+            self._get_index_conn()
+            self._index_entries_locked([name])
+
+    def _read_entry_context(self, entry_path: str) -> Context:
+        path = os.path.join(self.directory, entry_path)
+        if entry_path.endswith(".ctx"):
+            return Context.deserialize(self._read_dir(path))
+        return Context.deserialize(self._read_file(path))
+
+    def find_contexts_by_tags(
+        self,
+        tags_match: list[str],
+        has_result: t.Optional[bool] = None,
+    ) -> t.Iterator[Context]:
+        """Yields stored contexts that carry every tag in `tags_match` (optionally filtered on having a result)."""
+        tags = list(set(tags_match))
+        if not tags:
+            yield from self.find_contexts(lambda _: True)
+            return
+        query = f"""
+            SELECT entry_path, context_uid
+            FROM context_tags
+            WHERE tag IN ({", ".join("?" * len(tags))})
+        """
+        params: list[t.Any] = list(tags)
+        if has_result is not None:
+            query += " AND has_result = ?"
+            params.append(1 if has_result else 0)
+        query += " GROUP BY entry_path, context_uid HAVING COUNT(DISTINCT tag) = ?"
+        params.append(len(tags))
+        with self._index_lock:
+            matches = self._get_index_conn().execute(query, params).fetchall()
+
+        for (entry_path, context_uid) in matches:
+            try:
+                entry_context = self._read_entry_context(entry_path)
+            except (OSError, EOFError, json.JSONDecodeError) as e:
+                logging.warning(f"Indexed context storage entry {entry_path} is unreadable: {e}")
+                continue
+            yield from entry_context.find_contexts(lambda ctx: ctx.uid == context_uid)
+
+
+cache_friendly_file_storage = IndexedFileStorage(CACHE_FRIENDLY_FILE_STORAGE_DIR)
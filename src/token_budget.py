@@ -0,0 +1,110 @@
+import functools
+import logging
+import threading
+import typing as t
+
+import tiktoken
+
+from llm_descriptions_generator.schema import (Engine, OPENAI_ENGINES,
+                                               TextItemGenerationPrompt)
+
+# Context windows (prompt + completion tokens) of every engine. Prompts that don't leave
+# GENERATION_OUTPUT_TOKEN_RESERVE tokens for the generated description are skipped up front,
+# instead of failing (or being truncated) at the provider.
+ENGINE_CONTEXT_WINDOW_TOKENS: dict[Engine, int] = {
+    Engine.gpt35turbo: 16385,
+    Engine.gpt35turbo1106: 16385,
+    Engine.gpt4turbo: 128000,
+    Engine.mistral7binstructv02q4_k_mgguf: 32768,
+    Engine.metallama38binstructq4_k_mgguf: 8192,
+    Engine.groq_llama3_70b_8192: 8192,
+    Engine.groq_llama3_8b_8192: 8192,
+    Engine.groq_mixtral_8x7b_32768: 32768,
+    Engine.groq_gemma_7b_it: 8192,
+    Engine.together_llama_3_8b_chat: 8192,
+    Engine.together_llama_3_70b_chat: 8192,
+    Engine.together_mixtral_8x7b_instruct: 32768,
+    Engine.together_mixtral_8x22b_instruct: 65536,
+    Engine.together_qwen15_05b_chat: 32768,
+    Engine.together_qwen15_4b_chat: 32768,
+    Engine.together_gemma_2b_it: 8192,
+    Engine.together_phi_2: 2048,
+    Engine.together_llama_2_13b_chat: 4096,
+}
+GENERATION_OUTPUT_TOKEN_RESERVE = 512
+# NOTE: non-OpenAI models have their own tokenizers, their prompts are counted with this encoding
+# as an approximation (close for Llama 3, overcounts a little for Mistral/Llama 2 style tokenizers)
+FALLBACK_ENCODING_NAME = "cl100k_base"
+
+# (encoding name, prompt uid) -> prompt token count
+_prompt_token_counts: dict[tuple[str, str], int] = {}
+_prompt_token_counts_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def get_engine_encoding(llm_engine: Engine) -> tiktoken.Encoding:
+    if llm_engine in OPENAI_ENGINES:
+        return tiktoken.encoding_for_model(llm_engine.value)
+    return tiktoken.get_encoding(FALLBACK_ENCODING_NAME)
+
+
+def get_generation_prompt_token_budget(llm_engine: Engine) -> t.Optional[int]:
+    """Max prompt tokens for generation with the engine, or None if its context window is unknown."""
+    context_window_tokens = ENGINE_CONTEXT_WINDOW_TOKENS.get(llm_engine, None)
+    if context_window_tokens is None:
+        return None
+    return context_window_tokens - GENERATION_OUTPUT_TOKEN_RESERVE
+
+
+def count_generation_prompt_tokens(
+    generation_prompt: TextItemGenerationPrompt,
+    llm_engine: Engine,
+) -> int:
+    """Token count of the prompt text, memoised by prompt uid (a hash of the text) per encoding."""
+    encoding = get_engine_encoding(llm_engine)
+    key = (encoding.name, generation_prompt.prompt_uid)
+    with _prompt_token_counts_lock:
+        token_count = _prompt_token_counts.get(key, None)
+    if token_count is None:
+        token_count = len(encoding.encode(generation_prompt.prompt_text, disallowed_special=()))
+        with _prompt_token_counts_lock:
+            _prompt_token_counts[key] = token_count
+    return token_count
+
+
+def is_generation_prompt_over_budget(
+    generation_prompt: TextItemGenerationPrompt,
+    llm_engine: Engine,
+) -> bool:
+    token_budget = get_generation_prompt_token_budget(llm_engine)
+    if token_budget is None:
+        return False
+    return count_generation_prompt_tokens(generation_prompt, llm_engine) > token_budget
+
+
+def split_over_budget_generation_prompts(
+    generation_prompts: list[TextItemGenerationPrompt],
+    llm_engine: Engine,
+) -> tuple[list[TextItemGenerationPrompt], list[TextItemGenerationPrompt]]:
+    """
+    Splits the prompts into those that fit the engine's generation token budget and those
+    that don't, logging every over-length (item, engine) pair and a summary.
+    """
+    token_budget = get_generation_prompt_token_budget(llm_engine)
+    if token_budget is None:
+        logging.warning(f"No context window known for {llm_engine}, not checking prompt lengths")
+        return (list(generation_prompts), [])
+
+    within_budget: list[TextItemGenerationPrompt] = []
+    over_budget: list[TextItemGenerationPrompt] = []
+    for generation_prompt in generation_prompts:
+        if is_generation_prompt_over_budget(generation_prompt, llm_engine):
+            # memoised, so no second tokenization
+            token_count = count_generation_prompt_tokens(generation_prompt, llm_engine)
+            logging.warning(f"Skipping '{generation_prompt.item_title}' ({generation_prompt.prompt_nickname}): prompt has {token_count} tokens, {llm_engine} allows {token_budget}")
+            over_budget.append(generation_prompt)
+        else:
+            within_budget.append(generation_prompt)
+    if over_budget:
+        logging.warning(f"{len(over_budget)}/{len(generation_prompts)} prompts are too long for {llm_engine} and will be skipped")
+    return (within_budget, over_budget)
@@ -0,0 +1,48 @@
+import pytest
+
+from llm_comparison.choice_extraction import extract_choice_id
+
+INT_IDS = ["4821", "7310"]
+
+
+@pytest.mark.parametrize(
+    ("text", "expected_id"),
+    [
+        ("I recommend product 4821.", "4821"),
+        ("After weighing both descriptions, I would choose 7310 for this customer.", "7310"),
+        ("7310 is the better choice.", "7310"),
+        ("Product 4821 is the better option for most buyers.", "4821"),
+        ("I recommend 7310 over 4821.", "7310"),
+        ("4821 is cheaper but 7310 is better.", "7310"),
+        ("I recommend 4821, which is cheaper.", "4821"),
+        ("7310", "7310"),
+    ],
+)
+def test_extracts_plain_choice(text, expected_id):
+    assert extract_choice_id(text, INT_IDS) == expected_id
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        # a verdict or choice phrase in another clause than the ID
+        "While 4821 is cheaper, the clear choice is 7310.",
+        "Unlike 4821, which is better suited to experts, 7310 is the one I recommend.",
+        # negations
+        "I would not recommend 4821.",
+        "I would not recommend 4821; go with 7310.",
+        "4821 is not the better choice.",
+        # both / neither / ties
+        "Both 4821 and 7310 are great.",
+        "I recommend 4821 and I recommend 7310.",
+        "Neither 4821 nor 7310 stands out.",
+        "It's a tie between 4821 and 7310.",
+        "4821 and 7310 are equally good.",
+        # conditional advice
+        "If you want durability, I recommend 4821.",
+        # no ID at all
+        "I recommend the first one.",
+    ],
+)
+def test_leaves_unclear_answers_to_the_llm(text):
+    assert extract_choice_id(text, INT_IDS) is None
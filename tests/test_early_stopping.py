@@ -0,0 +1,89 @@
+import pytest
+
+from llm_comparison.early_stopping import (EarlyStoppingConfig, ItemEarlyStopping,
+                                           get_llm_win_ratio_interval)
+from llm_descriptions_generator.schema import Origin
+
+LLM = str(Origin.LLM)
+HUMAN = str(Origin.Human)
+
+
+def _add_pairs(item_early_stopping: ItemEarlyStopping, winner_origins: list[tuple]) -> None:
+    for (pair_index, (winner_origin_1, winner_origin_2)) in enumerate(winner_origins):
+        item_early_stopping.add_result(f"human-{pair_index}", f"llm-{pair_index}", winner_origin_1)
+        item_early_stopping.add_result(f"llm-{pair_index}", f"human-{pair_index}", winner_origin_2)
+
+
+def test_interval_without_valid_results():
+    assert get_llm_win_ratio_interval(0, 0, confidence=0.95) is None
+
+
+def test_interval_matches_wilson_score():
+    (low, high) = get_llm_win_ratio_interval(10, 0, confidence=0.95)
+    assert low == pytest.approx(0.7225, abs=1e-4)
+    assert high == 1.0
+    (low, high) = get_llm_win_ratio_interval(5, 5, confidence=0.95)
+    assert low == pytest.approx(1 - high)
+    assert low < 0.5 < high
+
+
+def test_interval_widens_with_confidence():
+    (low_95, high_95) = get_llm_win_ratio_interval(7, 3, confidence=0.95)
+    (low_99, high_99) = get_llm_win_ratio_interval(7, 3, confidence=0.99)
+    assert low_99 < low_95 and high_99 > high_95
+
+
+def test_half_completed_pair_is_not_counted():
+    item_early_stopping = ItemEarlyStopping(EarlyStoppingConfig(min_comparisons=2), pair_count=1)
+    item_early_stopping.add_result("human-0", "llm-0", LLM)
+    assert item_early_stopping.completed_pair_count == 0
+    assert item_early_stopping.llm_win_count == 0
+    item_early_stopping.add_result("llm-0", "human-0", HUMAN)
+    assert item_early_stopping.completed_pair_count == 1
+    assert (item_early_stopping.llm_win_count, item_early_stopping.human_win_count) == (1, 1)
+
+
+def test_does_not_stop_before_min_comparisons():
+    item_early_stopping = ItemEarlyStopping(EarlyStoppingConfig(min_comparisons=12), pair_count=6)
+    _add_pairs(item_early_stopping, [(LLM, LLM)] * 5)
+    assert not item_early_stopping.stopped
+    _add_pairs(item_early_stopping, [(LLM, LLM)])
+    assert item_early_stopping.stopped
+
+
+def test_stop_uses_bonferroni_corrected_confidence():
+    # 8/8 LLM wins: the plain 95% interval is above 0.5, the one corrected for 1000 checks isn't
+    assert get_llm_win_ratio_interval(8, 0, confidence=0.95)[0] > 0.5
+    assert get_llm_win_ratio_interval(8, 0, confidence=1 - 0.05 / 1000)[0] < 0.5
+    config = EarlyStoppingConfig(min_comparisons=8)
+
+    few_checks = ItemEarlyStopping(config, pair_count=1)
+    _add_pairs(few_checks, [(LLM, LLM)] * 4)
+    assert few_checks.stopped
+
+    many_checks = ItemEarlyStopping(config, pair_count=1000)
+    _add_pairs(many_checks, [(LLM, LLM)] * 4)
+    assert not many_checks.stopped
+
+
+def test_does_not_stop_on_a_close_tally():
+    item_early_stopping = ItemEarlyStopping(EarlyStoppingConfig(min_comparisons=2), pair_count=20)
+    _add_pairs(item_early_stopping, [(LLM, HUMAN)] * 20)
+    assert not item_early_stopping.stopped
+
+
+def test_invalid_results_complete_pairs_but_count_towards_neither_side():
+    item_early_stopping = ItemEarlyStopping(EarlyStoppingConfig(min_comparisons=2), pair_count=10)
+    _add_pairs(item_early_stopping, [(None, None)] * 10)
+    assert item_early_stopping.completed_pair_count == 10
+    assert (item_early_stopping.llm_win_count, item_early_stopping.human_win_count) == (0, 0)
+    assert not item_early_stopping.stopped
+
+
+def test_add_skipped_counts_under_skipped():
+    item_early_stopping = ItemEarlyStopping(EarlyStoppingConfig(), pair_count=4)
+    battle_tally = {HUMAN: 0, LLM: 4, "Invalid": 0}
+    item_early_stopping.add_skipped(battle_tally)
+    item_early_stopping.add_skipped(battle_tally, 2)
+    assert battle_tally["Skipped"] == 3
+    assert item_early_stopping.skipped_count == 3
@@ -0,0 +1,83 @@
+import json
+from pathlib import Path
+
+import pytest
+
+import llm_batch
+from llm_batch import (BatchRequest, download_shard_results, is_shard_downloaded,
+                       is_shard_ingested, iter_shard_results, read_batch_state,
+                       write_request_shards)
+from llm_descriptions_generator.batch_generation import ingest_generation_batch_results
+from llm_descriptions_generator.schema import Engine
+
+
+def _make_result_line(custom_id: str, content: str) -> bytes:
+    return json.dumps({
+        "custom_id": custom_id,
+        "response": {"status_code": 200, "body": {"choices": [{"message": {"content": content}}]}},
+    }).encode("utf-8")
+
+
+def _make_error_line(custom_id: str) -> bytes:
+    return json.dumps({"custom_id": custom_id, "error": {"code": "server_error"}}).encode("utf-8")
+
+
+class _FakeBatchApiClient:
+    def __init__(self, file_contents: dict[str, bytes], failing_file_ids: tuple[str, ...] = ()):
+        self.file_contents = file_contents
+        self.failing_file_ids = failing_file_ids
+
+    def get_batch(self, batch_id: str) -> dict:
+        return {"id": batch_id, "status": "completed", "output_file_id": "output", "error_file_id": "error"}
+
+    def download_file(self, file_id: str, filepath: Path) -> None:
+        if file_id in self.failing_file_ids:
+            raise Exception(f"Batch API request GET /files/{file_id}/content failed (502)")
+        filepath.write_bytes(self.file_contents[file_id])
+
+
+def _write_submitted_shard(dirpath: Path) -> Path:
+    (requests_filepath,) = write_request_shards(dirpath, [
+        BatchRequest(custom_id=custom_id, engine=Engine.gpt35turbo, prompt="prompt", metadata={})
+        for custom_id in ["a", "b", "c"]
+    ])
+    llm_batch._write_batch_state(requests_filepath, {"api_base": "http://batch.test", "batch_id": "batch", "status": "in_progress"})
+    return requests_filepath
+
+
+def test_download_shard_results_separates_parts_without_trailing_newline(tmp_path, monkeypatch):
+    requests_filepath = _write_submitted_shard(tmp_path)
+    # neither part ends with a newline
+    client = _FakeBatchApiClient({
+        "output": _make_result_line("a", "first") + b"\n" + _make_result_line("b", "second"),
+        "error": _make_error_line("c"),
+    })
+    monkeypatch.setattr(llm_batch, "_make_batch_api_client", lambda *args, **kwargs: client)
+
+    assert len(download_shard_results(tmp_path)) == 1
+    results = [(entry["custom_id"], text) for (entry, text) in iter_shard_results(requests_filepath)]
+    assert results == [("a", "first"), ("b", "second"), ("c", None)]
+
+
+def test_interrupted_download_is_retried_instead_of_ingested(tmp_path, monkeypatch):
+    requests_filepath = _write_submitted_shard(tmp_path)
+    file_contents = {
+        "output": _make_result_line("a", "first") + b"\n" + _make_result_line("b", "second") + b"\n",
+        "error": _make_error_line("c") + b"\n",
+    }
+    client = _FakeBatchApiClient(file_contents, failing_file_ids=("error",))
+    monkeypatch.setattr(llm_batch, "_make_batch_api_client", lambda *args, **kwargs: client)
+
+    with pytest.raises(Exception):
+        download_shard_results(tmp_path)
+    assert not is_shard_downloaded(requests_filepath)
+    assert read_batch_state(requests_filepath)["status"] == "in_progress"
+    # nothing to ingest yet, and the shard must not be marked as done
+    assert ingest_generation_batch_results(tmp_path) == {"stored": 0, "failed": 0, "unparseable": 0}
+    assert not is_shard_ingested(requests_filepath)
+
+    client.failing_file_ids = ()
+    assert len(download_shard_results(tmp_path)) == 1
+    assert read_batch_state(requests_filepath)["status"] == "completed"
+    results = [(entry["custom_id"], text) for (entry, text) in iter_shard_results(requests_filepath)]
+    assert results == [("a", "first"), ("b", "second"), ("c", None)]